@@ -22,9 +22,5 @@ __all__ = [
 # Optional: package version
 __version__ = "0.1.0"
 
-# Optional: load environment variables early if python-dotenv is installed
-try:
-    from dotenv import load_dotenv  # type: ignore
-    load_dotenv()
-except Exception:
-    pass
+# .env (python-dotenv) is loaded by utils.load_env() when the salt, sink URLs
+# or alert settings are first read, not at import
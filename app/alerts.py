@@ -1,24 +1,240 @@
 ## app/alerts.py
 
 from __future__ import annotations
-import os, smtplib, requests
-from email.mime.text import MIMEText
+import atexit, os, queue, re, threading, time
+from collections import OrderedDict
+from typing import Dict, Optional
+from .utils import load_env, logger
 
+"""
+Failure alerts.  send_email / send_slack deliver one message synchronously;
+notify() is what the pipeline calls: it only enqueues, and a background
+AlertDispatcher does the delivery.  The first failure with a given error
+signature is sent straight away, further ones in the same window are
+counted and sent as one digest ("37 files failed with ... in the last 60s").
+The SMTP connection and the Slack HTTP session are kept open between alerts.
+smtplib and requests are imported on the first delivery that needs them.
+"""
 
-def send_email(subject: str, body: str):
-    host = os.getenv("SMTP_HOST"); user = os.getenv("SMTP_USER"); pwd = os.getenv("SMTP_PASS")
-    to_addr = os.getenv("ALERT_EMAIL_TO")
-    if not all([host, user, pwd, to_addr]):
-        return
+
+def _email_env():
+    load_env()
+    return (os.getenv("SMTP_HOST"), os.getenv("SMTP_USER"), os.getenv("SMTP_PASS"),
+            os.getenv("ALERT_EMAIL_TO"))
+
+
+def _message(user: str, to_addr: str, subject: str, body: str) -> str:
+    from email.mime.text import MIMEText
     msg = MIMEText(body)
     msg["Subject"] = subject
     msg["From"] = user
     msg["To"] = to_addr
-    with smtplib.SMTP(host) as s:
-        s.starttls(); s.login(user, pwd); s.sendmail(user, [to_addr], msg.as_string())
+    return msg.as_string()
+
+
+def _smtp_connect(host: str, user: str, pwd: str, timeout: float = 10.0) -> "smtplib.SMTP":
+    import smtplib
+    h, _, port = host.partition(":")
+    s = smtplib.SMTP(h, int(port or 0), timeout=timeout)
+    try:
+        s.ehlo()
+        # SMTPNotSupportedError when STARTTLS is not offered: never log in in cleartext.
+        # SMTP_STARTTLS=0 is for a local stand-in only (app.standin --smtp)
+        if os.getenv("SMTP_STARTTLS", "1") != "0":
+            s.starttls(); s.ehlo()
+        s.login(user, pwd)
+    except Exception:
+        s.close()
+        raise
+    return s
+
+
+def send_email(subject: str, body: str):
+    host, user, pwd, to_addr = _email_env()
+    if not all([host, user, pwd, to_addr]):
+        return
+    with _smtp_connect(host, user, pwd) as s:
+        s.sendmail(user, [to_addr], _message(user, to_addr, subject, body))
+
+
+def _slack_url() -> Optional[str]:
+    load_env()
+    return os.getenv("SLACK_WEBHOOK_URL")
 
 
 def send_slack(text: str):
-    url = os.getenv("SLACK_WEBHOOK_URL")
+    url = _slack_url()
     if not url: return
+    import requests
     requests.post(url, json={"text": text}, timeout=5)
+
+
+def error_signature(e: BaseException) -> str:
+    """Type plus first line of the message with numbers and paths blanked,
+    so 'events_17.csv: Missing required columns' and 'events_18.csv: ...' group."""
+    first = (str(e).splitlines() or [""])[0]
+    first = re.sub(r"[\w./\\:-]*[/\\][\w./\\-]+", "<path>", first)
+    first = re.sub(r"\d+", "N", first)
+    return f"{type(e).__name__}: {first[:200]}"
+
+
+class AlertDispatcher:
+    """Background alert delivery.  notify() never blocks: when the queue is
+    full the event is counted as dropped and reported with the next digest."""
+
+    def __init__(self, window_seconds: float = 60.0, max_queue: int = 1000, max_paths: int = 5,
+                 email: bool = True, slack: bool = True, smtp_timeout: float = 10.0,
+                 http_timeout: float = 5.0):
+        self.window = window_seconds
+        self.max_paths = max_paths
+        self.email = email
+        self.slack = slack
+        self.smtp_timeout = smtp_timeout
+        self.http_timeout = http_timeout
+        self.q: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.stats = {"events": 0, "sent": 0, "digests": 0, "delivery_errors": 0}
+        self._smtp: Optional["smtplib.SMTP"] = None
+        self._session = None  # requests.Session, on the first Slack alert
+        # signature -> {"first": t, "count": failures after the first, "paths": sample of those}
+        self._windows: "OrderedDict[str, Dict]" = OrderedDict()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+        self._thread.start()
+
+    def notify(self, path: str, e: BaseException):
+        try:
+            self.q.put_nowait((time.monotonic(), path, error_signature(e), str(e)))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while not self._stop.is_set() or not self.q.empty():
+            timeout = self._next_due()
+            try:
+                item = self.q.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is not None:
+                self._handle(*item)
+            self._flush_due(time.monotonic())
+        self._flush_due(float("inf"))
+        self._close_smtp()
+
+    def _next_due(self) -> float:
+        if not self._windows:
+            return 0.5
+        first = next(iter(self._windows.values()))["first"]
+        return min(0.5, max(0.0, first + self.window - time.monotonic()))
+
+    def _handle(self, t: float, path: str, sig: str, text: str):
+        self.stats["events"] += 1
+        w = self._windows.get(sig)
+        if w is None:
+            self._windows[sig] = {"first": t, "count": 0, "paths": []}
+            self._deliver("ETL Failure", f"File: {path}\nError: {text}",
+                          f":rotating_light: ETL failure for {path}: {text}")
+            return
+        w["count"] += 1
+        if len(w["paths"]) < self.max_paths:
+            w["paths"].append(path)
+
+    def _flush_due(self, now: float):
+        for sig in list(self._windows):
+            w = self._windows[sig]
+            if w["first"] + self.window > now:
+                break  # insertion order == window start order
+            del self._windows[sig]
+            if w["count"]:
+                self._digest(sig, w)
+        if self.dropped and (now == float("inf") or not self._windows):
+            n, self.dropped = self.dropped, 0
+            self._deliver("ETL alerts dropped", f"{n} failure alerts were dropped (alert queue full).",
+                          f":warning: {n} ETL failure alerts were dropped (alert queue full)")
+
+    def _digest(self, sig: str, w: Dict):
+        more = w["count"] - len(w["paths"])
+        paths = "\n".join(w["paths"]) + (f"\n... and {more} more" if more > 0 else "")
+        head = f"{w['count'] + 1} files failed with {sig} in the last {self.window:g}s (first one alerted already)"
+        self.stats["digests"] += 1
+        self._deliver("ETL Failure digest", f"{head}\n\n{paths}", f":rotating_light: {head}\n{paths}")
+
+    def _deliver(self, subject: str, body: str, slack_text: str):
+        if self.email:
+            try:
+                self._send_email(subject, body)
+            except Exception as e:
+                self.stats["delivery_errors"] += 1
+                self._close_smtp()
+                logger.error(f"Alert email failed: {e}")
+        if self.slack:
+            try:
+                self._send_slack(slack_text)
+            except Exception as e:
+                self.stats["delivery_errors"] += 1
+                logger.error(f"Slack alert failed: {e}")
+        self.stats["sent"] += 1
+
+    def _send_email(self, subject: str, body: str):
+        host, user, pwd, to_addr = _email_env()
+        if not all([host, user, pwd, to_addr]):
+            return
+        import smtplib
+        msg = _message(user, to_addr, subject, body)
+        for attempt in (0, 1):
+            if self._smtp is None:
+                self._smtp = _smtp_connect(host, user, pwd, self.smtp_timeout)
+            try:
+                self._smtp.sendmail(user, [to_addr], msg)
+                return
+            except smtplib.SMTPServerDisconnected:
+                # Servers drop idle connections; reconnect once
+                self._smtp = None
+                if attempt:
+                    raise
+
+    def _close_smtp(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def _send_slack(self, text: str):
+        url = _slack_url()
+        if not url:
+            return
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        self._session.post(url, json={"text": text}, timeout=self.http_timeout).raise_for_status()
+
+    def close(self, timeout: float = 10.0):
+        """Deliver what is queued, flush open digests, and stop."""
+        self._stop.set()
+        self._thread.join(timeout)
+
+
+_dispatcher: Optional[AlertDispatcher] = None
+_lock = threading.Lock()
+
+
+def get_dispatcher(cfg: Optional[dict] = None) -> AlertDispatcher:
+    """Process-wide dispatcher, started on first use with the `alerts:` config section."""
+    global _dispatcher
+    with _lock:
+        if _dispatcher is None:
+            cfg = cfg or {}
+            _dispatcher = AlertDispatcher(window_seconds=cfg.get("window_seconds", 60.0),
+                                          max_queue=cfg.get("max_queue", 1000),
+                                          max_paths=cfg.get("max_paths", 5),
+                                          email=cfg.get("email", True),
+                                          slack=cfg.get("slack", True))
+            atexit.register(_dispatcher.close)
+        return _dispatcher
+
+
+def notify(path: str, e: BaseException, cfg: Optional[dict] = None):
+    """Queue a failure alert; returns immediately."""
+    get_dispatcher(cfg).notify(path, e)
@@ -0,0 +1,193 @@
+## app/arrow_engine.py
+
+from __future__ import annotations
+from functools import lru_cache
+from typing import Iterable, List, Optional
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from . import baseline, dedup, deid, ingest, qc, quarantine
+from .plan import PipelinePlan
+
+"""
+`engine: arrow` — the transform stages as pyarrow.compute kernels on a
+pyarrow.Table, mirroring pipeline.py / qc.py / deid.py column for column.
+
+Each stage replaces only the columns it changes (set_column/append_column);
+every other column keeps pointing at the buffers the CSV reader filled, so
+nothing is copied wholesale the way df.copy() does.  ZIP padding and ZIP3
+run on the dictionary of a dictionary-encoded zip column, and patient ids
+are hashed once per distinct value.  The committer hands the table to the
+Parquet sink as is; only the SQLite / Power BI sinks and the baseline
+sketches see pandas, and those only the columns they need.
+
+Output schema and values match the pandas engine (pipeline.transform_frame).
+"""
+
+
+@lru_cache(maxsize=1)
+def pandas_str() -> pa.DataType:
+    """Arrow type pandas' default str dtype is written as (large_string on pandas 3)."""
+    return pa.Table.from_pandas(pd.DataFrame({"s": pd.Series(["a"], dtype=str)})).schema.field("s").type
+
+
+def _replace(table: pa.Table, name: str, col) -> pa.Table:
+    i = table.schema.get_field_index(name)
+    return table.set_column(i, name, col) if i >= 0 else table.append_column(name, col)
+
+
+def _map_strings(col, fn):
+    """fn over a string column; over just the dictionary when it is dictionary-encoded."""
+    col = col.combine_chunks() if isinstance(col, pa.ChunkedArray) else col
+    if pa.types.is_dictionary(col.type):
+        return pa.DictionaryArray.from_arrays(col.indices, fn(col.dictionary.cast(pa.string())))
+    if not pa.types.is_string(col.type) and not pa.types.is_large_string(col.type):
+        col = col.cast(pa.string())
+    return fn(col)
+
+
+def _floats(col):
+    return col if pa.types.is_floating(col.type) else pc.cast(col, pa.float64())
+
+
+def frame(table: pa.Table, cols: Iterable[str]) -> pd.DataFrame:
+    """Just these columns (those present) as pandas, for code that has no Arrow path."""
+    return table.select([c for c in dict.fromkeys(cols) if c in table.column_names]).to_pandas()
+
+
+def baseline_frame(table: pa.Table, plan: PipelinePlan) -> pd.DataFrame:
+    """The vitals and the columns baseline.group_keys may use."""
+    return frame(table, [*plan.outlier_cols, "zip3", "zip", "dob_year", "dob", "event_date", "event_ts"])
+
+
+def enforce_schema(table: pa.Table, plan: PipelinePlan) -> pa.Table:
+    missing = plan.required - set(table.column_names)
+    if missing:
+        raise ValueError(f"Missing required columns: {sorted(missing)}")
+    for col, t in ingest.arrow_types(plan).items():
+        if col not in table.column_names:
+            continue
+        have = table.schema.field(col).type
+        if have == t or (pa.types.is_dictionary(t) and (pa.types.is_string(have) or pa.types.is_large_string(have))):
+            continue
+        table = _replace(table, col, pc.cast(table.column(col), t))  # ArrowInvalid -> pandas engine
+    return table
+
+
+def clean(table: pa.Table, plan: PipelinePlan) -> pa.Table:
+    if "zip" in table.column_names and plan.zip_length is not None:
+        n = plan.zip_length
+        table = _replace(table, "zip", _map_strings(table.column("zip"), lambda a: pc.utf8_lpad(a, n, "0")))
+    for col, lo, hi in plan.clip_bounds:
+        if col in table.column_names:
+            s = _floats(table.column(col))
+            s = pc.if_else(pc.less(s, lo), lo, s)   # null stays null, NaN stays NaN, like df.loc[s < lo]
+            table = _replace(table, col, pc.if_else(pc.greater(s, hi), hi, s))
+    return table
+
+
+def _quantiles(s, qs: List[float]) -> Optional[List[float]]:
+    out = pc.quantile(s, q=qs, interpolation="linear").to_pylist()
+    return None if not out or out[0] is None else out
+
+
+def _hits(s, plan: PipelinePlan, b) -> np.ndarray:
+    """Outlier rows of one vital; same rules as qc.detect_outliers_iqr/mad."""
+    if b is not None:
+        lo, hi = (pa.array(x) if isinstance(x, np.ndarray) else x for x in b)
+        hit = pc.or_(pc.less(s, lo), pc.greater(s, hi))
+    elif plan.outlier_method == "mad":
+        m = _quantiles(s, [0.5])
+        if m is None:
+            return np.zeros(len(s), dtype=bool)
+        dev = pc.abs(pc.subtract(s, m[0]))
+        mad = _quantiles(dev, [0.5])
+        if mad is None or mad[0] == 0:
+            return np.zeros(len(s), dtype=bool)
+        hit = pc.greater(pc.divide(pc.multiply(dev, 0.6745), mad[0]), plan.outlier_param)
+    else:
+        q = _quantiles(s, [0.25, 0.75])
+        if q is None:
+            return np.zeros(len(s), dtype=bool)
+        k = plan.outlier_param * (q[1] - q[0])
+        hit = pc.or_(pc.less(s, q[0] - k), pc.greater(s, q[1] + k))
+    return pc.fill_null(hit, False).to_numpy(zero_copy_only=False)
+
+
+def quality_checks(table: pa.Table, plan: PipelinePlan, bounds=None) -> pa.Table:
+    if plan.baseline_path:
+        bounds = baseline.get_baseline(plan.baseline_path).bounds_for(baseline_frame(table, plan), plan, bounds)
+    mask = None
+    for bit, col in enumerate(plan.outlier_cols):
+        if col not in table.column_names:
+            continue
+        if bounds is not None and col in bounds:
+            hit = _hits(_floats(table.column(col)), plan, bounds[col]) if bounds[col] else np.zeros(len(table), bool)
+        else:
+            hit = _hits(_floats(table.column(col)), plan, None)
+        bits = hit.astype(np.uint8) << np.uint8(bit)
+        mask = bits if mask is None else mask | bits
+    if mask is not None:
+        table = _replace(table, "outlier_mask", pa.array(mask, pa.uint8()))
+        if plan.flag_strings:
+            labels = pa.array(qc.flag_labels(plan.outlier_cols), pandas_str())
+            table = _replace(table, "outlier_flags", labels.take(pa.array(mask)))
+    return table
+
+
+def _patient_keys(ids, plan: PipelinePlan):
+    """deid.hash_ids on Arrow: HMAC the dictionary (distinct ids) once, then take by index."""
+    ids = ids.combine_chunks() if isinstance(ids, pa.ChunkedArray) else ids
+    if not pa.types.is_dictionary(ids.type):
+        if not pa.types.is_string(ids.type):
+            ids = ids.cast(pa.string())
+        ids = pc.dictionary_encode(ids)
+    deid.key_cache.maxsize = plan.key_cache_size
+    keys = deid.key_cache.lookup(ids.dictionary.cast(pa.string()).to_pylist(), plan.salt)
+    return pa.array(keys, pa.string()).take(ids.indices)
+
+
+def apply_safe_harbor(table: pa.Table, plan: PipelinePlan) -> pa.Table:
+    names = table.column_names
+    table = table.append_column("patient_key", _patient_keys(table.column(plan.id_col), plan))
+    if plan.dob_year and "dob" in names:
+        dob = table.column("dob")
+        if not pa.types.is_temporal(dob.type):
+            dob = pc.cast(dob, pa.date32())
+        year = pc.year(dob)
+        # .dt.year is int32, or float64 once a NaT is involved
+        table = table.append_column("dob_year", pc.cast(year, pa.int32() if year.null_count == 0 else pa.float64()))
+    if plan.event_date and "event_ts" in names:
+        table = table.append_column("event_date", pc.cast(table.column("event_ts"), pa.date32()))
+    if plan.zip3 and "zip" in names:
+        z3 = _map_strings(table.column("zip"), lambda a: pc.utf8_slice_codeunits(pc.utf8_lpad(a, 5, "0"), 0, 3))
+        table = table.append_column("zip3", z3.cast(pandas_str()))
+    return table.drop_columns([c for c in plan.drop_cols if c in table.column_names])
+
+
+def transform_table(table: pa.Table, plan: PipelinePlan, bounds=None, trace=None, row0: int = 0) -> pa.Table:
+    """pipeline.transform_frame for the Arrow engine."""
+    with trace.stage("enforce_schema", table):
+        table = enforce_schema(table, plan)
+    with trace.stage("clean", table):
+        table = clean(table, plan)
+    with trace.stage("quality_checks", table):
+        qc_done = quality_checks(table, plan, bounds)
+    why = quarantine.reasons(qc_done, plan) if plan.reject_path else None
+    ts = None
+    if plan.dedup_path:
+        ts = (dedup.event_ns(frame(qc_done, ["event_ts"])) if "event_ts" in qc_done.column_names
+              else np.full(len(qc_done), dedup.NO_TS, dtype="int64"))
+    with trace.stage("apply_safe_harbor", qc_done):
+        masked = apply_safe_harbor(qc_done, plan)
+    if ts is not None:
+        with trace.stage("dedup_keys", masked):
+            keys, buckets = dedup.keys_and_buckets(frame(masked, ["patient_key", *plan.dedup_cols]), ts, plan)
+            masked = masked.append_column("_dedup_key", pa.array(keys)).append_column("_dedup_bucket", pa.array(buckets))
+    if why is not None:
+        masked = quarantine.mark(masked, why, row0)
+    elif plan.outlier_action == "quarantine" and "outlier_mask" in masked.column_names and pc.any(
+            pc.not_equal(masked.column("outlier_mask"), 0)).as_py():
+        raise ValueError("Outliers detected; quarantining file per config")
+    return masked
@@ -0,0 +1,165 @@
+## app/baseline.py
+
+from __future__ import annotations
+import json, os, time
+from typing import Dict, Iterable, Optional, Tuple
+import numpy as np
+import pandas as pd
+from .sketch import KLLSketch
+from .utils import logger
+from . import qc
+
+"""
+Long-run outlier baselines: one mergeable quantile sketch per vital (and,
+optionally, per zip3 / age band), updated by the committer after every file
+and checkpointed to JSON.  QC compares each file against these thresholds
+instead of the file's own quartiles once enough history has been seen.
+"""
+
+
+def group_keys(df: pd.DataFrame, group_by: Iterable[str]) -> Optional[pd.Series]:
+    """'zip3=191|age_band=40' per row; works before de-ID (zip, dob, event_ts) and after."""
+    parts = []
+    for g in group_by:
+        if g == "zip3":
+            if "zip3" in df:
+                z = df["zip3"].astype(str)
+            elif "zip" in df:
+                z = df["zip"].astype(str).str.zfill(5).str[:3]
+            else:
+                continue
+            parts.append("zip3=" + z)
+        elif g == "age_band":
+            if "dob_year" in df:
+                born = pd.to_numeric(df["dob_year"], errors="coerce")
+            elif "dob" in df:
+                born = pd.to_datetime(df["dob"], errors="coerce").dt.year
+            else:
+                continue
+            when = df["event_date"] if "event_date" in df else df.get("event_ts")
+            if when is None:
+                continue
+            age = pd.to_datetime(when, errors="coerce").dt.year - born
+            parts.append("age_band=" + (age // 10 * 10).astype("Int64").astype(str))
+    if not parts:
+        return None
+    key = parts[0]
+    for p in parts[1:]:
+        key = key + "|" + p
+    return key
+
+
+class Baseline:
+    def __init__(self, k: int = 256):
+        self.k = k
+        self.sketches: Dict[str, KLLSketch] = {}
+
+    def _bounds(self, key: str, plan, min_count: int):
+        sk = self.sketches.get(key)
+        if sk is None or sk.n < min_count:
+            return None
+        return qc.sketch_bounds(sk, plan.outlier_method, plan.outlier_param) or (np.nan, np.nan)
+
+    def bounds_for(self, df: pd.DataFrame, plan, fallback: Optional[dict] = None) -> dict:
+        """Per-column (lo, hi) for qc.outlier_flags; arrays when grouped.
+
+        Groups without enough history use the column's global baseline; columns
+        without enough history are left out (per-file stats, or fallback).
+        """
+        out = dict(fallback or {})
+        keys = group_keys(df, plan.baseline_group_by)
+        if keys is not None:
+            codes, uniques = pd.factorize(keys)
+        for col in plan.outlier_cols:
+            if col not in df:
+                continue
+            glob_b = self._bounds(col, plan, plan.baseline_min_count)
+            if glob_b is None:
+                continue
+            if keys is None:
+                out[col] = glob_b
+                continue
+            lo = np.full(len(uniques) + 1, glob_b[0], dtype="float64")
+            hi = np.full(len(uniques) + 1, glob_b[1], dtype="float64")
+            for i, g in enumerate(uniques):
+                b = self._bounds(f"{col}|{g}", plan, plan.baseline_min_count)
+                if b is not None:
+                    lo[i], hi[i] = b
+            out[col] = (lo[codes], hi[codes])
+        return out
+
+    def sketch_frame(self, df: pd.DataFrame, plan) -> Dict[str, KLLSketch]:
+        """Sketches of one frame's vitals, to be merge()d once its file commits."""
+        delta: Dict[str, KLLSketch] = {}
+        keys = group_keys(df, plan.baseline_group_by)
+        if keys is not None:
+            codes, uniques = pd.factorize(keys)
+            order = np.argsort(codes, kind="stable")
+            starts = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+        for col in plan.outlier_cols:
+            if col not in df:
+                continue
+            vals = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+            delta[col] = KLLSketch(self.k).update(vals)
+            if keys is not None:
+                for i, g in enumerate(uniques):
+                    delta[f"{col}|{g}"] = KLLSketch(self.k).update(vals[order[starts[i]:starts[i + 1]]])
+        return delta
+
+    def covers(self, plan) -> bool:
+        """True when every outlier column already has a usable global baseline."""
+        return all(self._bounds(c, plan, plan.baseline_min_count) is not None for c in plan.outlier_cols)
+
+    def merge(self, delta: Dict[str, KLLSketch]):
+        for key, sk in delta.items():
+            if key in self.sketches:
+                self.sketches[key].merge(sk)
+            else:
+                self.sketches[key] = sk
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"k": self.k, "saved_at": time.time(),
+                       "sketches": {k: sk.to_dict() for k, sk in self.sketches.items()}}, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Baseline":
+        with open(path, "r", encoding="utf-8") as f:
+            d = json.load(f)
+        b = cls(d.get("k", 256))
+        b.sketches = {k: KLLSketch.from_dict(v) for k, v in d["sketches"].items()}
+        return b
+
+
+_cache: Dict[str, Tuple[Optional[float], Baseline]] = {}
+_unsaved: Dict[str, int] = {}
+
+
+def get_baseline(path: str) -> Baseline:
+    """Process-wide baseline for path; re-read only when another process checkpointed it."""
+    mtime = os.stat(path).st_mtime if os.path.exists(path) else None
+    hit = _cache.get(path)
+    if hit is not None and (hit[0] == mtime or _unsaved.get(path)):
+        return hit[1]
+    try:
+        b = Baseline.load(path) if mtime is not None else Baseline()
+    except Exception as e:
+        logger.error(f"Could not read outlier baseline {path}, starting empty: {e}")
+        b = Baseline()
+    _cache[path] = (mtime, b)
+    return b
+
+
+def record(plan, delta: Dict[str, KLLSketch]):
+    """Committer only: fold a committed file's sketches in and checkpoint every N files."""
+    path = plan.baseline_path
+    b = get_baseline(path)
+    b.merge(delta)
+    _unsaved[path] = _unsaved.get(path, 0) + 1
+    if _unsaved[path] >= plan.baseline_checkpoint_every:
+        b.save(path)
+        _unsaved[path] = 0
+        _cache[path] = (os.stat(path).st_mtime, b)
@@ -0,0 +1,505 @@
+## app/bench.py
+
+from __future__ import annotations
+import argparse, json, os, subprocess, sys, tempfile, time
+import numpy as np
+import pandas as pd
+
+"""
+Benchmarks for the ETL stages and sinks.  Synthetic input is generated here
+(no Java / Synthea needed) and shaped like schemas.Event.
+
+Usage:
+  python -m app.bench suite [--sizes 10k,100k,1M] [--out bench.json]
+                            [--baseline bench_baseline.json] [--threshold 0.2] [--save-baseline]
+  python -m app.bench gen <out.csv> [--rows 1M] [--patients N] [--outlier-rate 0.01] [--missing-rate 0]
+  python -m app.bench sqlite [--rows 200000] [--file-rows 2000] [--batch-rows 50000]
+  python -m app.bench powerbi [--rows 200000] [--latency-ms 50] [--concurrency 4]
+  python -m app.bench imports [--modules app.watcher,...] [--repeat 5] [--budget-ms 1000]
+  python -m app.bench claims [--watchers 3] [--files 60] [--rows 2000] [--kill-every 3]
+
+`suite` times every pipeline stage and every sink at each size, plus
+end-to-end watcher throughput for many small files and a few huge ones,
+writes JSON, and (with --baseline) exits 1 when any rows/sec figure drops
+by more than --threshold against the stored baseline.  `imports` times a
+fresh-interpreter import of each entry point (best of --repeat, interpreter
+startup subtracted), lists the slowest imports under it (-X importtime) and
+exits 1 when any takes longer than --budget-ms.  `claims` runs several
+watchers with watcher.claims on one incoming/ folder, SIGKILLs and restarts
+a random one every --kill-every seconds, and exits 1 unless every file ends
+up in exactly one Parquet commit and the SQLite table and rollups hold every
+row once.
+"""
+
+GEN_CHUNK_ROWS = 1_000_000
+IMPORT_MODULES = "app.watcher,app.pipeline,app.metrics,app.noise_injector,app.mapper_synthea_events"
+
+
+def parse_size(s: str) -> int:
+    s = s.strip().lower()
+    mult = {"k": 1_000, "m": 1_000_000}.get(s[-1:], 1)
+    return int(float(s[:-1] if mult > 1 else s) * mult)
+
+
+def synthetic_events(rows: int, patients: int | None = None, outlier_rate: float = 0.01,
+                     missing_rate: float = 0.0, dup_rate: float = 0.0, zip3s: int = 30, seed: int = 0,
+                     start_id: int = 0) -> pd.DataFrame:
+    """Raw events with the schemas.Event columns; vitals get outlier_rate spikes and
+    missing_rate blanks, dup_rate re-emits existing rows.  Patients live in zip3s
+    distinct 3-digit zip areas (the Parquet sink partitions on zip3)."""
+    rng = np.random.default_rng(seed)
+    patients = patients or max(1, rows // 20)
+    pid = rng.integers(0, patients, rows)
+    vitals = {"systolic_bp": (120, 15, 260), "diastolic_bp": (80, 10, 160), "heart_rate": (75, 12, 240)}
+    df = pd.DataFrame({
+        "patient_id": pd.Series(pid + start_id).map("P{:09d}".format),
+        "first_name": "Pat",
+        "last_name": "Doe",
+        "dob": (pd.Timestamp("1930-01-01") + pd.to_timedelta(pid * 37 % 27000, unit="D")).strftime("%Y-%m-%d"),
+        "zip": pd.Series((150 + pid % zip3s) * 100 + pid // zip3s % 100).astype(str),
+        "event_ts": (pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 1500 * 86400, rows), unit="s"))
+                    .strftime("%Y-%m-%d %H:%M:%S"),
+    })
+    for col, (mu, sd, hi) in vitals.items():
+        v = rng.normal(mu, sd, rows).round()
+        v[rng.random(rows) < outlier_rate] = hi * 1.5
+        if missing_rate:
+            v[rng.random(rows) < missing_rate] = np.nan
+        df[col] = v
+    if missing_rate:
+        df.loc[rng.random(rows) < missing_rate, "zip"] = None
+    if dup_rate:
+        dups = df.iloc[rng.integers(0, rows, int(rows * dup_rate))]
+        df = pd.concat([df, dups], ignore_index=True)
+    return df
+
+
+def write_events(path: str, rows: int, chunk_rows: int = GEN_CHUNK_ROWS, **kw) -> str:
+    """CSV of `rows` synthetic events written chunk by chunk (10M rows never sit in memory)."""
+    seed = kw.pop("seed", 0)
+    for i, start in enumerate(range(0, rows, chunk_rows)):
+        n = min(chunk_rows, rows - start)
+        synthetic_events(n, seed=seed + i, **kw).to_csv(path, mode="w" if i == 0 else "a",
+                                                        header=(i == 0), index=False)
+    return path
+
+
+def bench_cfg(root: str, **streaming) -> dict:
+    """Self-contained pipeline config with every sink under root."""
+    return {
+        "input_format": "csv",
+        "file_glob": "events_*.csv",
+        "watcher": {"poll_seconds": 0.2, "stable_seconds": 0, "use_events": False,
+                    "manifest_path": os.path.join(root, "logs", "processed_files.sqlite")},
+        "schema": {"required_columns": ["patient_id", "dob", "zip", "event_ts",
+                                        "systolic_bp", "diastolic_bp", "heart_rate"],
+                   "types": {"patient_id": "string", "dob": "date", "zip": "string", "event_ts": "datetime",
+                             "systolic_bp": "float", "diastolic_bp": "float", "heart_rate": "float"}},
+        "cleaning": {"zip_pad_left": True, "zip_length": 5,
+                     "clip_ranges": {"heart_rate": [20, 240], "systolic_bp": [50, 260], "diastolic_bp": [30, 160]}},
+        "outliers": {"method": "iqr", "iqr_multiplier": 1.5, "action": "flag"},
+        "hipaa_safe_harbor": {"hash_salt_env": "DEID_SALT", "hash_id_column": "patient_id",
+                              "dates": {"dob": "year_only", "event_ts": "date_only"},
+                              "zip_truncate_to_3": True, "remove": ["first_name", "last_name"]},
+        "streaming": streaming or {"enabled": False},
+        "metrics": {"path": os.path.join(root, "logs", "metrics.json"), "flush_seconds": 0},
+        "sinks": {
+            "parquet": {"enabled": True, "path": os.path.join(root, "masked_out", "cleaned.parquet"),
+                        "partition_by": ["zip3"]},
+            "sqlite": {"enabled": True, "uri": f"sqlite:///{os.path.join(root, 'masked_out', 'cleaned.sqlite')}",
+                       "table": "cleaned_events"},
+            "powerbi_push": {"enabled": False},
+        },
+    }
+
+
+def synthetic_masked(rows: int, patients: int = 5000, seed: int = 0) -> pd.DataFrame:
+    """A frame shaped like pipeline output (schemas.CleanEvent)."""
+    rng = np.random.default_rng(seed)
+    pid = rng.integers(0, patients, rows)
+    return pd.DataFrame({
+        "systolic_bp": rng.normal(120, 15, rows).round(),
+        "diastolic_bp": rng.normal(80, 10, rows).round(),
+        "heart_rate": rng.normal(75, 12, rows).round(),
+        "outlier_mask": (rng.random(rows) < 0.02).astype("uint8"),
+        "outlier_flags": "",
+        "patient_key": pd.Series(pid).map(lambda i: f"{i:064x}"),
+        "dob_year": (1930 + pid % 70).astype("int32"),
+        "event_date": (pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 1500, rows), unit="D")).date,
+        "zip3": pd.Series(pid % 40 + 150).astype(str),
+    })
+
+
+def _rate(rows: int, seconds: float) -> dict:
+    return {"rows": rows, "seconds": round(seconds, 4), "rows_per_sec": round(rows / seconds) if seconds else None}
+
+
+def bench_sqlite(rows: int, file_rows: int, batch_rows: int) -> dict:
+    """Legacy sink (new engine + df.to_sql per file) vs pooled WAL bulk insert."""
+    from sqlalchemy import create_engine
+    from .sinks import to_sqlite
+    df = synthetic_masked(rows)
+    files = [df.iloc[i:i + file_rows] for i in range(0, rows, file_rows)]
+    out = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = f"sqlite:///{os.path.join(tmp, 'legacy.sqlite')}"
+        t = time.perf_counter()
+        for f in files:
+            f.to_sql("cleaned_events", create_engine(uri), if_exists="append", index=False)
+        out["legacy_to_sql"] = _rate(rows, time.perf_counter() - t)
+
+        # Same table shape as legacy, then with the dashboard indexes the sink now maintains
+        for name, index_columns in (("pooled_bulk", ()),
+                                    ("pooled_bulk_indexed", ("event_date", "zip3", "patient_key"))):
+            uri = f"sqlite:///{os.path.join(tmp, name + '.sqlite')}"
+            t = time.perf_counter()
+            for f in files:
+                to_sqlite(f, uri, "cleaned_events", batch_rows=batch_rows, index_columns=index_columns)
+            out[name] = _rate(rows, time.perf_counter() - t)
+            out[name]["speedup_vs_legacy"] = round(out["legacy_to_sql"]["seconds"] / out[name]["seconds"], 2)
+    return out
+
+
+def bench_powerbi(rows: int, latency_ms: float, concurrency: int, throttle_rate: float = 0.0) -> dict:
+    """Sequential one-connection-per-POST (old sink, at the 10k row limit) vs pooled concurrent pusher."""
+    import requests
+    from .powerbi import PowerBIPusher, iter_payloads
+    from .standin import StandIn
+    df = synthetic_masked(rows)
+    out = {}
+    with StandIn(latency_ms=latency_ms) as srv:
+        t = time.perf_counter()
+        for body in iter_payloads(df):
+            requests.post(srv.url, data=body, timeout=30).raise_for_status()
+        out["sequential_post"] = _rate(rows, time.perf_counter() - t)
+    with StandIn(latency_ms=latency_ms, throttle_rate=throttle_rate) as srv, \
+            tempfile.TemporaryDirectory() as spool:
+        pusher = PowerBIPusher(srv.url, concurrency=concurrency, backoff_seconds=0.05, spool_dir=spool)
+        t = time.perf_counter()
+        stats = pusher.push(df)
+        out["pooled_concurrent"] = _rate(rows, time.perf_counter() - t)
+        out["pooled_concurrent"].update(stats)
+        out["pooled_concurrent"]["rows_received"] = srv.stats["rows"]
+        out["pooled_concurrent"]["speedup_vs_sequential"] = round(
+            out["sequential_post"]["seconds"] / out["pooled_concurrent"]["seconds"], 2)
+    return out
+
+
+def bench_stages(rows: int, tmp: str, stream_rows: int = 2_000_000, **gen) -> dict:
+    """Seconds and rows/sec per pipeline stage for one file of `rows` events.
+    Files above stream_rows go through the streaming path, as the watcher would send them."""
+    from .instrument import Trace
+    from .plan import PipelinePlan
+    from . import pipeline
+    os.environ.setdefault("DEID_SALT", "bench-salt")
+    path = write_events(os.path.join(tmp, f"events_stages_{rows}.csv"), rows, **gen)
+    streaming = {"enabled": True, "min_file_mb": 0, "chunk_rows": 500_000} if rows > stream_rows else {}
+    plan = PipelinePlan.compile(bench_cfg(os.path.join(tmp, f"stages_{rows}"), **streaming))
+    trace = Trace()
+    t = time.perf_counter()
+    if streaming:
+        pipeline.stream_file(path, plan, trace)
+    else:
+        pipeline.commit(path, pipeline.transform(path, plan, trace), plan, trace)
+    out = {r["stage"]: _rate(r["rows"] or rows, r["seconds"]) for r in trace.records.values()}
+    out["total"] = _rate(rows, time.perf_counter() - t)
+    out["total"]["streamed"] = bool(streaming)
+    return out
+
+
+def bench_sinks(rows: int, tmp: str, latency_ms: float = 5.0) -> dict:
+    """Each sink on the same de-identified frame; Power BI goes to the local stand-in."""
+    from .sinks import to_parquet, to_sqlite
+    from .powerbi import PowerBIPusher
+    from .standin import StandIn
+    df = synthetic_masked(rows)
+    out = {}
+    t = time.perf_counter()
+    to_parquet(df, os.path.join(tmp, f"sink_{rows}.parquet"), partition_by=["zip3"])
+    out["parquet"] = _rate(rows, time.perf_counter() - t)
+    uri = f"sqlite:///{os.path.join(tmp, f'sink_{rows}.sqlite')}"
+    t = time.perf_counter()
+    to_sqlite(df, uri, "cleaned_events")
+    out["sqlite"] = _rate(rows, time.perf_counter() - t)
+    with StandIn(latency_ms=latency_ms) as srv:
+        t = time.perf_counter()
+        PowerBIPusher(srv.url, spool_dir=os.path.join(tmp, "powerbi_spool")).push(df)
+        out["powerbi_standin"] = _rate(rows, time.perf_counter() - t)
+    return out
+
+
+def bench_watcher(files: int, rows_per_file: int, tmp: str, workers: int = 1, timeout: float = 1800) -> dict:
+    """End-to-end: start the real watcher on a prepared incoming/ folder and time
+    until the metrics snapshot shows every file committed or quarantined."""
+    import yaml
+    root = tempfile.mkdtemp(prefix=f"watch_{files}x{rows_per_file}_", dir=tmp)
+    for d in ("incoming", "logs", "masked_out", "quarantine"):
+        os.makedirs(os.path.join(root, d))
+    for i in range(files):
+        write_events(os.path.join(root, "incoming", f"events_{i:06d}.csv"), rows_per_file, seed=i)
+    # Huge files take the streaming path, as in production
+    cfg = bench_cfg(".", enabled=True, min_file_mb=64, chunk_rows=500_000)
+    cfg["watcher"]["workers"] = workers
+    with open(os.path.join(root, "config.yaml"), "w", encoding="utf-8") as f:
+        yaml.safe_dump(cfg, f)
+    env = dict(os.environ, DEID_SALT="bench-salt",
+               PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                           os.environ.get("PYTHONPATH", "")]))
+    from .metrics import load_snapshot
+    t = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-c", "from app.watcher import run; run('config.yaml')"],
+                            cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    done = 0
+    try:
+        while time.perf_counter() - t < timeout and proc.poll() is None:
+            snap = load_snapshot(os.path.join(root, "logs", "metrics.json")) or {}
+            c = snap.get("counters", {})
+            done = c.get("files_ok", 0) + c.get("files_failed", 0)
+            if done >= files:
+                break
+            time.sleep(0.05)
+        seconds = time.perf_counter() - t
+    finally:
+        proc.terminate()
+        proc.wait()
+    out = _rate(files * rows_per_file, seconds)
+    out.update({"files": files, "files_done": done, "files_per_sec": round(done / seconds, 2), "workers": workers})
+    return out
+
+
+def bench_claims(watchers: int, files: int, rows_per_file: int, tmp: str, kill_every: float = 3.0,
+                 lease_seconds: float = 3.0, seed: int = 0, timeout: float = 900) -> dict:
+    """Exactly-once under crashes: `watchers` watcher processes share one incoming/
+    folder (each with its own manifest, log and metrics, as on separate hosts)
+    while one of them is killed and restarted every kill_every seconds."""
+    import random, sqlite3, yaml
+    from .claims import _read
+    from .dataset import MANIFEST, count_rows
+    from .rollup import TABLE as ROLLUP_TABLE
+    rng = random.Random(seed)
+    root = tempfile.mkdtemp(prefix=f"claims_{watchers}w_", dir=tmp)
+    for d in ("incoming", "logs", "masked_out", "quarantine"):
+        os.makedirs(os.path.join(root, d))
+    for i in range(files):
+        write_events(os.path.join(root, "incoming", f"events_{i:06d}.csv"), rows_per_file, seed=i)
+    for i in range(watchers):
+        cfg = bench_cfg(".")
+        cfg["watcher"].update(manifest_path=os.path.join("logs", f"manifest_{i}.sqlite"),
+                              claims={"enabled": True, "lease_seconds": lease_seconds})
+        cfg["metrics"]["path"] = os.path.join("logs", f"metrics_{i}.json")
+        cfg["logging"] = {"path": os.path.join("logs", f"pipeline_{i}.log")}
+        with open(os.path.join(root, f"config_{i}.yaml"), "w", encoding="utf-8") as f:
+            yaml.safe_dump(cfg, f)
+    env = dict(os.environ, DEID_SALT="bench-salt",
+               PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                           os.environ.get("PYTHONPATH", "")]))
+
+    def start(i: int):
+        return subprocess.Popen([sys.executable, "-c", f"from app.watcher import run; run('config_{i}.yaml')"],
+                                cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    claims_dir = os.path.join(root, "incoming", ".claims")
+    procs = [start(i) for i in range(watchers)]
+    kills, done = 0, 0
+    t = time.perf_counter()
+    next_kill = t + kill_every
+    try:
+        while time.perf_counter() - t < timeout:
+            done = len([p for p in os.listdir(claims_dir) if p.endswith(".done")]) if os.path.isdir(claims_dir) else 0
+            if done >= files:
+                break
+            if kill_every and time.perf_counter() >= next_kill:
+                i = rng.randrange(watchers)
+                procs[i].kill()
+                procs[i].wait()
+                procs[i] = start(i)
+                kills += 1
+                next_kill = time.perf_counter() + kill_every
+            time.sleep(0.05)
+        seconds = time.perf_counter() - t
+    finally:
+        for p in procs:
+            p.terminate()
+            p.wait()
+    commits: dict = {}
+    with open(os.path.join(root, "masked_out", "cleaned.parquet", MANIFEST), "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            for src in entry.get("sources") or {}:
+                commits[src] = commits.get(src, 0) + 1
+    db = sqlite3.connect(os.path.join(root, "masked_out", "cleaned.sqlite"))
+    try:
+        sqlite_rows = db.execute("SELECT COUNT(*) FROM cleaned_events").fetchone()[0]
+        rollup_rows = db.execute(f'SELECT SUM(rows) FROM "{ROLLUP_TABLE}"').fetchone()[0]
+    finally:
+        db.close()
+    markers = [_read(os.path.join(claims_dir, n)) for n in os.listdir(claims_dir) if n.endswith(".done")]
+    outcomes = [d.get("outcome") for d in markers]
+    rows = count_rows(os.path.join(root, "masked_out", "cleaned.parquet"))
+    out = _rate(rows, seconds)
+    out.update({"watchers": watchers, "files": files, "files_done": done, "kills": kills,
+                "finished_by": len({d.get("owner") for d in markers}),
+                "quarantined": outcomes.count("quarantined"),
+                "committed_twice": sorted(p for p, n in commits.items() if n > 1),
+                "never_committed": files - len(commits), "rows": rows, "sqlite_rows": sqlite_rows,
+                "rollup_rows": rollup_rows, "expected_rows": files * rows_per_file})
+    out["exactly_once"] = (done == files and not out["committed_twice"] and not out["never_committed"]
+                           and not out["quarantined"]
+                           and rows == sqlite_rows == rollup_rows == files * rows_per_file)
+    return out
+
+
+def run_suite(sizes, watcher: bool = True, workers: int = 1) -> dict:
+    results = {"meta": {"python": sys.version.split()[0], "pandas": pd.__version__, "numpy": np.__version__,
+                        "cpus": os.cpu_count(), "at": time.strftime("%Y-%m-%dT%H:%M:%S")},
+               "stages": {}, "sinks": {}, "watcher": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            label = _label(n)
+            results["stages"][label] = bench_stages(n, tmp)
+            if n <= 1_000_000:  # sinks take an in-memory frame
+                results["sinks"][label] = bench_sinks(n, tmp)
+        if watcher:
+            results["watcher"]["many_small_files"] = bench_watcher(200, 1_000, tmp, workers)
+            results["watcher"]["few_huge_files"] = bench_watcher(2, max(sizes) // 2, tmp, workers)
+    return results
+
+
+def _label(n: int) -> str:
+    if n >= 1_000_000 and n % 1_000_000 == 0:
+        return f"{n // 1_000_000}M"
+    return f"{n // 1000}k" if n % 1000 == 0 else str(n)
+
+
+def _flatten(d: dict, prefix: str = "") -> dict:
+    out = {}
+    for k, v in d.items():
+        if isinstance(v, dict):
+            out.update(_flatten(v, f"{prefix}{k}."))
+        else:
+            out[prefix + k] = v
+    return out
+
+
+def compare(current: dict, baseline: dict, threshold: float = 0.2) -> list:
+    """rows_per_sec figures that fell more than threshold below the baseline."""
+    cur, base = _flatten(current), _flatten(baseline)
+    regressions = []
+    for key, old in base.items():
+        if not key.endswith("rows_per_sec") or not old or cur.get(key) is None:
+            continue
+        change = cur[key] / old - 1
+        if change < -threshold:
+            regressions.append({"metric": key, "baseline": old, "current": cur[key], "change": round(change, 3)})
+    return regressions
+
+
+def _import_ms(code: str) -> float:
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], check=True, env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"})
+    return (time.perf_counter() - t0) * 1000
+
+
+def bench_imports(modules: list, repeat: int = 5, top: int = 8) -> dict:
+    """Wall-clock ms to import each module in a fresh interpreter, and its slowest imports."""
+    bare = min(_import_ms("pass") for _ in range(repeat))
+    out = {"interpreter_ms": round(bare, 1)}
+    for mod in modules:
+        ms = min(_import_ms(f"import {mod}") for _ in range(repeat))
+        err = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {mod}"],
+                             capture_output=True, text=True, check=True).stderr
+        cum = []
+        for line in err.splitlines()[1:]:  # "import time: self [us] | cumulative | imported package"
+            _, us, name = line.split("|")
+            cum.append((int(us), name.strip()))
+        slow = sorted((c for c in cum if c[1] != mod), reverse=True)[:top]
+        out[mod] = {"ms": round(ms - bare, 1), "slowest": {n: round(us / 1000, 1) for us, n in slow}}
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(prog="python -m app.bench")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sq = sub.add_parser("sqlite", help="SQLite sink rows/sec, legacy vs pooled bulk insert")
+    sq.add_argument("--rows", type=int, default=200_000)
+    sq.add_argument("--file-rows", type=int, default=2_000, help="rows per simulated incoming file")
+    sq.add_argument("--batch-rows", type=int, default=50_000)
+    su = sub.add_parser("suite", help="stages, sinks and watcher throughput; JSON out, baseline compare")
+    su.add_argument("--sizes", default="10k,100k,1M", help="comma list, e.g. 10k,100k,1M,10M")
+    su.add_argument("--out", default="bench.json")
+    su.add_argument("--baseline", default=None, help="baseline JSON to compare against")
+    su.add_argument("--threshold", type=float, default=0.2, help="allowed rows/sec drop (0.2 = 20%%)")
+    su.add_argument("--save-baseline", action="store_true", help="also write results to --baseline")
+    su.add_argument("--no-watcher", action="store_true")
+    su.add_argument("--workers", type=int, default=1)
+    gn = sub.add_parser("gen", help="write a synthetic events CSV")
+    gn.add_argument("out")
+    gn.add_argument("--rows", default="1M")
+    gn.add_argument("--patients", type=int, default=None)
+    gn.add_argument("--outlier-rate", type=float, default=0.01)
+    gn.add_argument("--missing-rate", type=float, default=0.0)
+    gn.add_argument("--dup-rate", type=float, default=0.0)
+    gn.add_argument("--zip3s", type=int, default=30)
+    gn.add_argument("--seed", type=int, default=0)
+    pb = sub.add_parser("powerbi", help="Power BI push rows/sec against the local stand-in")
+    pb.add_argument("--rows", type=int, default=200_000)
+    pb.add_argument("--latency-ms", type=float, default=50.0)
+    pb.add_argument("--concurrency", type=int, default=4)
+    pb.add_argument("--throttle-rate", type=float, default=0.0)
+    im = sub.add_parser("imports", help="cold import time of the entry points, against a budget")
+    im.add_argument("--modules", default=IMPORT_MODULES, help="comma list of modules")
+    im.add_argument("--repeat", type=int, default=5)
+    im.add_argument("--budget-ms", type=float, default=1000.0, help="exit 1 when any import takes longer")
+    cl = sub.add_parser("claims", help="several watchers on one folder under kills; exactly-once check")
+    cl.add_argument("--watchers", type=int, default=3)
+    cl.add_argument("--files", type=int, default=60)
+    cl.add_argument("--rows", type=int, default=2_000, help="rows per file")
+    cl.add_argument("--kill-every", type=float, default=3.0, help="seconds between kills (0 = none)")
+    cl.add_argument("--lease-seconds", type=float, default=3.0)
+    cl.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    if args.cmd == "claims":
+        with tempfile.TemporaryDirectory(prefix="etl_claims_") as tmp:
+            results = bench_claims(args.watchers, args.files, args.rows, tmp, args.kill_every,
+                                   args.lease_seconds, args.seed)
+        print(json.dumps(results, indent=2))
+        if not results["exactly_once"]:
+            sys.exit(1)
+    elif args.cmd == "imports":
+        results = bench_imports(args.modules.split(","), args.repeat)
+        print(json.dumps(results, indent=2))
+        over = [m for m, r in results.items() if isinstance(r, dict) and r["ms"] > args.budget_ms]
+        for m in over:
+            print(f"OVER BUDGET {m}: {results[m]['ms']} ms > {args.budget_ms:g} ms")
+        if over:
+            sys.exit(1)
+    elif args.cmd == "suite":
+        results = run_suite([parse_size(x) for x in args.sizes.split(",")], not args.no_watcher, args.workers)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(json.dumps(results, indent=2))
+        if args.baseline and args.save_baseline:
+            with open(args.baseline, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+        elif args.baseline:
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                regressions = compare(results, json.load(f), args.threshold)
+            for r in regressions:
+                print(f"REGRESSION {r['metric']}: {r['baseline']} -> {r['current']} rows/sec ({r['change']:+.0%})")
+            if regressions:
+                sys.exit(1)
+            print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    elif args.cmd == "gen":
+        write_events(args.out, parse_size(args.rows), patients=args.patients, outlier_rate=args.outlier_rate,
+                     missing_rate=args.missing_rate, dup_rate=args.dup_rate, zip3s=args.zip3s, seed=args.seed)
+    elif args.cmd == "sqlite":
+        print(json.dumps(bench_sqlite(args.rows, args.file_rows, args.batch_rows), indent=2))
+    elif args.cmd == "powerbi":
+        print(json.dumps(bench_powerbi(args.rows, args.latency_ms, args.concurrency, args.throttle_rate), indent=2))
+
+
+if __name__ == "__main__":
+    main()
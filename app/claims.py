@@ -0,0 +1,249 @@
+## app/claims.py
+
+from __future__ import annotations
+import glob, hashlib, json, os, socket, threading, time, uuid
+from typing import Callable, Dict, List, Optional
+from .utils import logger
+
+"""
+Lease-based claiming of incoming files (watcher.claims), so that several
+watchers -- processes on one machine, or hosts sharing the filesystem -- can
+drain one incoming/ folder and each file is committed once.
+
+Layout (watcher.claims.dir, default incoming/.claims/):
+  <file>.lease     created with O_EXCL by the watcher that takes <file>;
+                   its mtime is that watcher's heartbeat
+  <file>.done      outcome (ok / quarantined) and the size/mtime it applies
+                   to, written once the file is finished, before the lease
+                   is removed
+  members/<owner>  one per running watcher, touched on every heartbeat
+
+A heartbeat thread touches the leases and the member file every
+lease_seconds / 3.  A lease not touched for lease_seconds belongs to a
+watcher that died: another watcher renames it aside (one rename wins) and
+takes the file over.  Every sink transaction records its source files with
+the rows (sinks.SinkTxn: the Parquet manifest line, an etl_sources table in
+each database), so before processing a file taken over it asks committed():
+if the dead watcher committed the file everywhere but did not get to write
+.done, the file is only marked done.  Otherwise it is listed in resumed and
+the watcher processes it on its own, so the sinks the dead watcher did
+commit are skipped and the rest are written: Parquet, SQLite and the rollups
+each get the file exactly once.  The Power BI push is not transactional and
+may see its rows twice.
+
+With shard: true each file has a home watcher, chosen by rendezvous hashing
+of the file name over the live members: files spread evenly, and a watcher
+joining or leaving moves only its own share.  The others leave a file to
+its home watcher for as long as that one keeps heartbeating.
+
+Expiry compares lease mtimes with the local clock, so hosts need synced
+clocks (NTP), and lease_seconds must be longer than any stall of a watcher
+(GC, swap, NFS hiccup).  dedup.path and the outlier baseline stay per
+watcher; point them at host-local paths.
+"""
+
+
+def _read(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _touch(path: str):
+    with open(path, "a", encoding="utf-8"):
+        pass
+    os.utime(path, None)
+
+
+class Claims:
+    def __init__(self, root: str, lease_seconds: float = 60, shard: bool = True,
+                 committed: Optional[Callable[[str], bool]] = None):
+        self.root = root
+        self.ttl = lease_seconds
+        self.shard = shard
+        self.committed = committed  # path -> whether every sink already holds its current version
+        self.resumed: set = set()  # files taken over that a dead watcher may have partly committed
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.members_dir = os.path.join(root, "members")
+        os.makedirs(self.members_dir, exist_ok=True)
+        self.held: Dict[str, str] = {}  # path -> lease file
+        self._lock = threading.Lock()
+        self._members = (0.0, [self.owner])
+        self._stop = threading.Event()
+        self._beat()
+        self._thread = threading.Thread(target=self._heartbeat, name="claims-heartbeat", daemon=True)
+        self._thread.start()
+
+    def _file(self, path: str, ext: str) -> str:
+        return os.path.join(self.root, os.path.basename(path) + ext)
+
+    def _expired(self, path: str) -> bool:
+        try:
+            return time.time() - os.stat(path).st_mtime > self.ttl
+        except FileNotFoundError:
+            return False
+
+    def _beat(self):
+        _touch(os.path.join(self.members_dir, self.owner))
+        with self._lock:
+            held = dict(self.held)
+        for path, lease in held.items():
+            if _read(lease).get("owner") == self.owner:
+                try:
+                    os.utime(lease, None)
+                    continue
+                except FileNotFoundError:
+                    pass
+            logger.warning(f"Lost the lease on {path}; another watcher may process it as well")
+            with self._lock:
+                self.held.pop(path, None)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                self._beat()
+            except OSError as e:
+                logger.warning(f"Claims heartbeat failed: {e}")
+
+    def members(self) -> List[str]:
+        """Owners of the watchers that heartbeated within lease_seconds (cached for a third of that)."""
+        now = time.time()
+        if now - self._members[0] < self.ttl / 3:
+            return self._members[1]
+        live = {self.owner}
+        with os.scandir(self.members_dir) as it:
+            for e in it:
+                try:
+                    age = now - e.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                if age <= self.ttl:
+                    live.add(e.name)
+        self._members = (now, sorted(live))
+        return self._members[1]
+
+    def mine(self, path: str) -> bool:
+        """Whether this watcher should take path now (always, without sharding)."""
+        if not self.shard:
+            return True
+        name = os.path.basename(path).encode()
+        home = max(self.members(), key=lambda m: hashlib.blake2b(name + b"/" + m.encode(), digest_size=8).digest())
+        return home == self.owner
+
+    def outcome(self, path: str, size: int, mtime: float) -> Optional[str]:
+        """'ok' / 'quarantined' when a watcher already finished this version of path."""
+        d = _read(self._file(path, ".done"))
+        return d.get("outcome") if (d.get("size"), d.get("mtime")) == (size, mtime) else None
+
+    def claim(self, path: str, size: int, mtime: float) -> bool:
+        """Take path for this watcher; False when another watcher holds or has finished it."""
+        lease = self._file(path, ".lease")
+        prev = None
+        try:
+            fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not self._expired(lease):
+                return False
+            aside = f"{lease}.{self.owner}.stale"
+            try:
+                os.replace(lease, aside)
+            except FileNotFoundError:
+                return False  # another watcher took it over first
+            if not self._expired(aside):  # that watcher had already put a fresh lease there
+                self._give_back(path, aside, lease)
+                return False
+            prev = _read(aside).get("owner", "?")
+            os.remove(aside)
+            try:
+                fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"owner": self.owner, "path": path, "size": size, "mtime": mtime, "at": time.time()}, f)
+        with self._lock:
+            self.held[path] = lease
+        if self.outcome(path, size, mtime) is not None:  # finished just before we created the lease
+            self.release(path)
+            return False
+        if prev is not None:
+            logger.warning(f"Took over {path} from {prev} (lease expired)")
+            if self.committed is not None and self.committed(path):
+                logger.info(f"{path} was committed by {prev} before it stopped; marking it done")
+                self.finish(path, size, mtime, True)
+                return False
+            self.resumed.add(path)
+        return True
+
+    def finish(self, path: str, size: int, mtime: float, ok: bool):
+        """Record the outcome for every watcher, then drop the lease."""
+        self.resumed.discard(path)
+        done = self._file(path, ".done")
+        tmp = f"{done}.{self.owner}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"path": path, "outcome": "ok" if ok else "quarantined", "size": size, "mtime": mtime,
+                       "owner": self.owner, "at": time.time()}, f)
+        os.replace(tmp, done)
+        self.release(path)
+
+    def _give_back(self, path: str, aside: str, lease: str):
+        """Put another watcher's lease back, unless a third one has taken the empty slot meanwhile."""
+        try:
+            os.link(aside, lease)
+        except FileExistsError:
+            logger.warning(f"Lease on {path} by {_read(aside).get('owner', '?')} was lost to a takeover")
+        except OSError:
+            pass
+        os.remove(aside)
+
+    def release(self, path: str):
+        with self._lock:
+            lease = self.held.pop(path, None)
+        if lease is None:
+            return
+        # Rename first, then check: a watcher that took the lease over between a
+        # check and a remove would otherwise lose its fresh lease
+        aside = f"{lease}.{self.owner}.release"
+        try:
+            os.replace(lease, aside)
+        except FileNotFoundError:
+            return
+        if _read(aside).get("owner") == self.owner:
+            os.remove(aside)
+        else:
+            self._give_back(path, aside, lease)
+
+    def prune(self, retention_days: float = 30) -> int:
+        """Forget .done markers of files that are gone, and leftovers of dead members."""
+        cutoff = time.time() - retention_days * 86400
+        gone = 0
+        for done in glob.glob(os.path.join(self.root, "*.done")):
+            try:
+                if os.path.getmtime(done) < cutoff and not os.path.exists(_read(done).get("path", done)):
+                    os.remove(done)
+                    gone += 1
+            except OSError:
+                pass
+        for aside in glob.glob(os.path.join(self.root, "*.stale")) + glob.glob(os.path.join(self.root, "*.release")):
+            try:  # left by a watcher killed between renaming a lease aside and removing it
+                if os.path.getmtime(aside) < cutoff:
+                    os.remove(aside)
+            except OSError:
+                pass
+        for member in glob.glob(os.path.join(self.members_dir, "*")):
+            try:
+                if os.path.getmtime(member) < cutoff:
+                    os.remove(member)
+            except OSError:
+                pass
+        return gone
+
+    def close(self):
+        """Stop heartbeating.  Leases still held expire and are taken over (and checked) elsewhere."""
+        self._stop.set()
+        self._thread.join()
+        try:
+            os.remove(os.path.join(self.members_dir, self.owner))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,324 @@
+## app/dataset.py
+
+from __future__ import annotations
+import json, logging, os, sys, time, uuid
+from typing import Iterable, List, Optional
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+"""
+Append-only, Hive-partitioned Parquet dataset.
+
+Layout:
+  <root>/_manifest.jsonl              one JSON line per commit (add/remove files, sources)
+  <root>/zip3=191/part-<ns>-<id>.parquet
+
+Every batch becomes new part files written to a dot-prefixed temp name and
+os.replace()'d into place; the manifest line is the commit point.  Readers
+replay the manifest to get the live file set, so a compaction that is
+half-way through never shows duplicated rows.  Files a commit removes
+(compaction, overwrite mode) stay on disk for REMOVE_GRACE_SECONDS, so a
+reader that listed them just before can still open them; a later
+compaction or overwrite deletes them.
+
+Usage:
+  python -m app.dataset compact <dataset_dir> [min_files]
+"""
+
+logger = logging.getLogger("pipeline")
+
+MANIFEST = "_manifest.jsonl"
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+PARTITION_TYPES = {"event_date": pa.date32(), "dob_year": pa.int64()}
+REMOVE_GRACE_SECONDS = 3600  # removed files outlive their commit by this much (readers still open)
+
+
+def _partition_value(v) -> str:
+    if v is None or (not isinstance(v, str) and pd.isna(v)):
+        return NULL_PARTITION
+    return quote(str(v), safe="")
+
+
+def _new_name() -> str:
+    return f"part-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet"
+
+
+def _write_atomic(table: pa.Table, dirpath: str, **kw) -> str:
+    os.makedirs(dirpath, exist_ok=True)
+    name = _new_name()
+    tmp = os.path.join(dirpath, f".{name}.tmp")
+    pq.write_table(table, tmp, **kw)
+    os.replace(tmp, os.path.join(dirpath, name))
+    return name
+
+
+def _log_commit(root: str, entry: dict):
+    entry["ts"] = time.time()
+    with open(os.path.join(root, MANIFEST), "a+b") as f:
+        # a writer killed mid-line leaves a torn tail; don't glue this commit onto it
+        end, torn = f.seek(0, os.SEEK_END), False
+        if end:
+            f.seek(end - 1)
+            torn = f.read(1) != b"\n"
+        f.write((("\n" if torn else "") + json.dumps(entry) + "\n").encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def live_files(root: str) -> List[str]:
+    """Replay the manifest; returns paths relative to root in commit order."""
+    mpath = os.path.join(root, MANIFEST)
+    if not os.path.exists(mpath):
+        return []
+    live: dict = {}
+    with open(mpath, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # torn tail from a crashed writer
+            for p in entry.get("remove", []):
+                live.pop(p, None)
+            for p in entry.get("add", []):
+                live[p] = True
+    return list(live)
+
+
+def purge_removed(root: str, grace_seconds: float = REMOVE_GRACE_SECONDS) -> int:
+    """Delete the files of commits that removed them more than grace_seconds ago."""
+    mpath = os.path.join(root, MANIFEST)
+    if not os.path.exists(mpath):
+        return 0
+    cutoff = time.time() - grace_seconds
+    gone = 0
+    with open(mpath, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("ts", cutoff) >= cutoff:
+                continue
+            for rel in entry.get("remove", []):  # part names are unique: never live again
+                try:
+                    os.remove(os.path.join(root, rel))
+                    gone += 1
+                except FileNotFoundError:
+                    pass
+    return gone
+
+
+def _migrate_legacy_file(root: str, partition_by: Iterable[str]):
+    """cleaned.parquet used to be a single file; fold it into the dataset once."""
+    legacy = root + ".legacy"
+    os.replace(root, legacy)
+    append(pd.read_parquet(legacy), root, partition_by)
+    os.remove(legacy)
+    logger.info(f"Migrated single-file parquet into dataset: {root}")
+
+
+def _table_groups(table: pa.Table, parts: List[str]):
+    """(partition key tuple, sub-table) per distinct key, in first-seen order, like groupby(sort=False)."""
+    if not len(table):
+        return
+    codes, values, code = [], [], np.zeros(len(table), dtype="int64")
+    for c in parts:
+        enc = table.column(c).combine_chunks().dictionary_encode()
+        values.append(enc.dictionary.to_pylist() + [None])  # null keys -> trailing None
+        codes.append(enc.indices.fill_null(len(enc.dictionary)).to_numpy().astype("int64"))
+        code = code * (len(enc.dictionary) + 1) + codes[-1]
+    _, first, inverse = np.unique(code, return_index=True, return_inverse=True)
+    order = np.argsort(first[inverse], kind="stable")
+    grouped = table.take(order)
+    bounds = np.r_[np.flatnonzero(np.diff(code[order])) + 1, len(code)]
+    start = 0
+    for end in bounds:
+        row = order[start]
+        yield tuple(v[c[row]] for v, c in zip(values, codes)), grouped.slice(start, end - start)
+        start = end
+
+
+def stage(df, root: str, partition_by: Iterable[str] = (),
+          compression: str = "snappy") -> List[str]:
+    """Write df (a DataFrame or pyarrow Table) as hidden temp files under root; invisible until commit_staged()."""
+    if os.path.isfile(root):
+        _migrate_legacy_file(root, partition_by)
+    os.makedirs(root, exist_ok=True)
+    is_table = isinstance(df, pa.Table)
+    parts = [c for c in partition_by if c in (df.column_names if is_table else df.columns)]
+    if parts and is_table:
+        groups = _table_groups(df, parts)
+    elif parts:
+        groups = df.groupby(parts, dropna=False, sort=False)
+    else:
+        groups = [((), df)]
+    staged = []
+    for key, g in groups:
+        key = key if isinstance(key, tuple) else (key,)
+        rel = "/".join(f"{c}={_partition_value(v)}" for c, v in zip(parts, key))
+        if is_table:
+            table = g.drop_columns(parts)
+        else:
+            table = pa.Table.from_pandas(g.drop(columns=parts), preserve_index=False)
+        os.makedirs(os.path.join(root, rel), exist_ok=True)
+        name = _new_name()
+        pq.write_table(table, os.path.join(root, rel, f".{name}.tmp"), compression=compression)
+        staged.append(f"{rel}/{name}" if rel else name)
+    return staged
+
+
+_sources_seen: dict = {}  # root -> (manifest bytes read, {source: mtime})
+
+
+def committed_sources(root: str) -> dict:
+    """{source file: its mtime} for every committed source; reads only the lines added since the last call."""
+    mpath = os.path.join(root, MANIFEST)
+    if not os.path.exists(mpath):
+        return {}
+    offset, seen = _sources_seen.get(root, (0, {}))
+    if os.path.getsize(mpath) < offset:  # manifest replaced
+        offset, seen = 0, {}
+    with open(mpath, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # a commit still being written
+            offset += len(line)
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("op") == "overwrite":
+                seen = {}
+            if isinstance(entry.get("sources"), dict):  # older lines listed sources without their mtimes
+                seen.update(entry["sources"])
+    _sources_seen[root] = (offset, seen)
+    return seen
+
+
+def _tmp_of(rel: str) -> str:
+    d, name = os.path.split(rel)
+    return os.path.join(d, f".{name}.tmp")
+
+
+def commit_staged(root: str, staged: List[str], rows: int, replace: bool = False,
+                  sources: Optional[dict] = None):
+    """Rename staged files into place and log one manifest line: all-or-nothing for readers.
+
+    replace=True drops every previously live file in the same commit (overwrite mode).
+    sources: {input file: mtime} the rows came from, recorded on the line (see SinkTxn).
+    """
+    old = live_files(root) if replace else []
+    for rel in staged:
+        os.replace(os.path.join(root, _tmp_of(rel)), os.path.join(root, rel))
+    if staged or old:
+        entry = {"op": "overwrite" if replace else "append", "rows": int(rows), "add": staged, "remove": old}
+        if sources:
+            entry["sources"] = dict(sources)
+        _log_commit(root, entry)
+    if old:
+        purge_removed(root)
+
+
+def abort_staged(root: str, staged: List[str]):
+    for rel in staged:
+        try:
+            os.remove(os.path.join(root, _tmp_of(rel)))
+        except OSError:
+            pass
+
+
+def append(df: pd.DataFrame, root: str, partition_by: Iterable[str] = (),
+           compression: str = "snappy") -> List[str]:
+    """Write df as new part files under root and commit them to the manifest."""
+    staged = stage(df, root, partition_by, compression)
+    commit_staged(root, staged, len(df))
+    return staged
+
+
+def dataset(root: str, files: Optional[List[str]] = None) -> ds.Dataset:
+    """pyarrow Dataset over the committed files (Hive partition columns restored)."""
+    files = live_files(root) if files is None else files
+    keys = []
+    for rel in files:
+        for seg in rel.split("/")[:-1]:
+            k = seg.split("=", 1)[0]
+            if k not in keys:
+                keys.append(k)
+    schema = pa.schema([(k, PARTITION_TYPES.get(k, pa.string())) for k in keys])
+    paths = [os.path.join(root, p) for p in files]
+    # Union of the footers (newest first, for its pandas metadata): columns added by
+    # later commits (outlier_mask, ...) would be dropped if the first file set the schema
+    unified = pa.unify_schemas([pq.read_schema(p) for p in reversed(paths)], promote_options="permissive") \
+        if paths else pa.schema([])
+    for field in schema:
+        if field.name not in unified.names:
+            unified = unified.append(field)
+    return ds.dataset(paths, schema=unified, format="parquet",
+                      partitioning=ds.partitioning(schema, flavor="hive"),
+                      partition_base_dir=root)
+
+
+def read_dataset(root: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Read either the partitioned dataset or a legacy single parquet file."""
+    if os.path.isfile(root):
+        return pd.read_parquet(root, columns=columns)
+    files = live_files(root)
+    if not files:
+        return pd.DataFrame(columns=columns)
+    return dataset(root, files).to_table(columns=columns).to_pandas()
+
+
+def count_rows(root: str) -> int:
+    """Row count from Parquet footers only; no column data is read."""
+    if os.path.isfile(root):
+        return pq.ParquetFile(root).metadata.num_rows
+    return sum(pq.ParquetFile(os.path.join(root, rel)).metadata.num_rows for rel in live_files(root))
+
+
+def compact(root: str, min_files: int = 4, sort_by: str = "patient_key",
+            row_group_size: int = 1_000_000, compression: str = "zstd",
+            grace_seconds: float = REMOVE_GRACE_SECONDS) -> int:
+    """Merge small part files per partition into large sorted zstd files.
+
+    Only files live at start are touched, so it is safe to run next to a
+    writer; the merged files are deleted by a compaction grace_seconds or
+    more later, so it is safe next to readers too.  Returns the number of
+    files merged.
+    """
+    purge_removed(root, grace_seconds)
+    by_dir: dict = {}
+    for rel in live_files(root):
+        by_dir.setdefault(os.path.dirname(rel), []).append(rel)
+    removed = 0
+    for rel_dir, files in by_dir.items():
+        if len(files) < min_files:
+            continue
+        tables = [pq.read_table(os.path.join(root, p)) for p in files]
+        table = pa.concat_tables(tables, promote_options="default")
+        if sort_by in table.column_names:
+            table = table.sort_by(sort_by)
+        name = _write_atomic(table, os.path.join(root, rel_dir), compression=compression,
+                             row_group_size=row_group_size)
+        new_rel = f"{rel_dir}/{name}" if rel_dir else name
+        _log_commit(root, {"op": "compact", "rows": table.num_rows, "add": [new_rel], "remove": files})
+        removed += len(files)
+        logger.info(f"Compacted {len(files)} files -> {new_rel} ({table.num_rows} rows)")
+    return removed
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] != "compact":
+        print("Usage: python -m app.dataset compact <dataset_dir> [min_files]")
+        sys.exit(1)
+    min_files = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    n = compact(sys.argv[2], min_files=min_files)
+    print(f"Compacted {n} files in {sys.argv[2]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+## app/dedup.py
+
+from __future__ import annotations
+import glob, json, math, os, shutil, time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import numpy as np
+import pandas as pd
+from .utils import logger
+
+"""
+Cross-file deduplication of de-identified events.
+
+Each row gets a 64-bit keyed hash of (patient_key, full event timestamp,
+vitals); the timestamp never reaches the output, only the hash does, and
+the hash is dropped before the sinks.  The committer checks every batch
+against a persistent index and appends the new keys after the sinks commit.
+
+Index layout (dedup.path, default logs/dedup_index/):
+  b=<bucket>/keys-<ns>.npy   sorted unique keys of one event-time bucket
+  b=<bucket>/bloom-<ns>.npy  Bloom filter over those keys
+  b=<bucket>/meta.json       which keys/bloom files are current
+  journal-<ns>.npy           (bucket, key) pairs added since the last compaction
+  meta.json                  when each bucket last had keys added (drives the TTL)
+
+Buckets are `partition_days` wide.  Lookups read keys and blooms through
+np.load(mmap_mode="r"), so resident memory is the in-memory delta (bounded
+by `max_delta_keys`, then compacted into the bucket files) plus whatever
+pages the OS keeps cached, however many keys the index holds.  A bucket is
+deleted once no keys were added to it for `ttl_days` of wall-clock time, so
+the TTL follows ingest, not event time: replayed history years old is
+checked like any other row.
+"""
+
+NO_TS = np.iinfo("int64").min
+HIDDEN = ("_dedup_key", "_dedup_bucket")
+
+
+def row_keys(masked: pd.DataFrame, ts: np.ndarray, plan) -> np.ndarray:
+    """uint64 per row over (patient_key, event_ts ns, dedup columns), keyed by the salt."""
+    parts = {"k": masked["patient_key"].to_numpy(dtype=object), "t": ts}
+    for c in plan.dedup_cols:
+        if c in masked:
+            parts[c] = pd.to_numeric(masked[c], errors="coerce").to_numpy(dtype="float64")
+    hash_key = (plan.salt or "dedup").encode().ljust(16, b"0")[:16].decode("latin-1")
+    return pd.util.hash_pandas_object(pd.DataFrame(parts), index=False, hash_key=hash_key).to_numpy()
+
+
+def event_ns(df: pd.DataFrame) -> np.ndarray:
+    """Event timestamps as int64 ns (NO_TS where missing); read before de-ID truncates them."""
+    if "event_ts" not in df:
+        return np.full(len(df), NO_TS, dtype="int64")
+    ts = pd.to_datetime(df["event_ts"], errors="coerce")
+    return ts.to_numpy(dtype="datetime64[ns]").view("int64").copy()
+
+
+def keys_and_buckets(masked: pd.DataFrame, ts: np.ndarray, plan) -> Tuple[np.ndarray, np.ndarray]:
+    keys = row_keys(masked, ts, plan)
+    day = np.where(ts == NO_TS, int(time.time() // 86400), ts // (86400 * 10**9))
+    return keys, (day // plan.dedup_partition_days).astype("int64")
+
+
+def mark(masked: pd.DataFrame, ts: np.ndarray, plan) -> pd.DataFrame:
+    """Attach the hidden key/bucket columns; the committer does the filtering."""
+    masked["_dedup_key"], masked["_dedup_bucket"] = keys_and_buckets(masked, ts, plan)
+    return masked
+
+
+def split(masked):
+    """(frame or Arrow table without the hidden columns, keys, buckets)."""
+    keys = np.asarray(masked["_dedup_key"]).astype("uint64", copy=False)
+    buckets = np.asarray(masked["_dedup_bucket"]).astype("int64", copy=False)
+    if isinstance(masked, pd.DataFrame):
+        return masked.drop(columns=list(HIDDEN)), keys, buckets
+    return masked.drop_columns(list(HIDDEN)), keys, buckets
+
+
+def _bloom_positions(keys: np.ndarray, nbits: int, k: int):
+    h1 = keys & np.uint64(0xFFFFFFFF)
+    h2 = (keys >> np.uint64(32)) | np.uint64(1)
+    for i in range(k):
+        yield (h1 + np.uint64(i) * h2) % np.uint64(nbits)
+
+
+def _bloom_build(keys: np.ndarray, bits_per_key: int) -> np.ndarray:
+    nbytes = max(128, (int(len(keys) * bits_per_key) + 7) // 8)
+    nbits, k = nbytes * 8, max(1, round(bits_per_key * math.log(2)))
+    bloom = np.zeros(nbytes + 1, dtype="uint8")
+    bloom[-1] = k  # number of hash functions rides along in the last byte
+    for pos in _bloom_positions(keys, nbits, k):
+        np.bitwise_or.at(bloom, (pos >> np.uint64(3)).astype("int64"),
+                         (np.uint8(1) << (pos & np.uint64(7)).astype("uint8")))
+    return bloom
+
+
+def _bloom_maybe(bloom: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    nbits, k = (len(bloom) - 1) * 8, int(bloom[-1])
+    hit = np.ones(len(keys), dtype=bool)
+    for pos in _bloom_positions(keys, nbits, k):
+        byte = bloom[(pos >> np.uint64(3)).astype("int64")]
+        hit &= (byte >> (pos & np.uint64(7)).astype("uint8")) & 1 == 1
+    return hit
+
+
+def _save_atomic(path: str, arr: np.ndarray):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+
+def _write_json(path: str, obj: dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+class DedupIndex:
+    def __init__(self, root: str, ttl_days: float = 30, bloom_bits_per_key: int = 10,
+                 max_delta_keys: int = 2_000_000, max_open: int = 64):
+        self.root = root
+        self.ttl = ttl_days * 86400
+        self.bits_per_key = bloom_bits_per_key
+        self.max_delta_keys = max_delta_keys
+        self.max_open = max_open
+        self._open: "OrderedDict[int, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self._delta: Dict[int, list] = {}
+        self._delta_sorted: Dict[int, np.ndarray] = {}
+        self._delta_n = 0
+        os.makedirs(root, exist_ok=True)
+        meta = os.path.join(root, "meta.json")
+        m = json.load(open(meta, encoding="utf-8")) if os.path.exists(meta) else {}
+        self.touched: Dict[int, float] = {int(b): t for b, t in m.get("touched", {}).items()}
+        for d in glob.glob(os.path.join(root, "b=*")):  # indexes written before touched was kept
+            self.touched.setdefault(int(os.path.basename(d)[2:]), time.time())
+        for j in sorted(glob.glob(os.path.join(root, "journal-*.npy"))):
+            # Not yet compacted (or compaction was interrupted): replay
+            rec = np.load(j)
+            self._stash(rec["bucket"], rec["key"])
+
+    def _bucket_dir(self, b: int) -> str:
+        return os.path.join(self.root, f"b={b}")
+
+    def _load_bucket(self, b: int):
+        hit = self._open.get(b)
+        if hit is not None:
+            self._open.move_to_end(b)
+            return hit
+        meta = os.path.join(self._bucket_dir(b), "meta.json")
+        if not os.path.exists(meta):
+            return None
+        with open(meta, encoding="utf-8") as f:
+            m = json.load(f)
+        d = self._bucket_dir(b)
+        hit = (np.load(os.path.join(d, m["keys"]), mmap_mode="r"), np.load(os.path.join(d, m["bloom"]), mmap_mode="r"))
+        self._open[b] = hit
+        while len(self._open) > self.max_open:
+            self._open.popitem(last=False)
+        return hit
+
+    def _stash(self, buckets: np.ndarray, keys: np.ndarray):
+        for b in np.unique(buckets):
+            self._delta.setdefault(int(b), []).append(keys[buckets == b])
+            self._delta_sorted.pop(int(b), None)
+        self._delta_n += len(keys)
+
+    def _delta_of(self, b: int) -> Optional[np.ndarray]:
+        if b not in self._delta:
+            return None
+        s = self._delta_sorted.get(b)
+        if s is None:
+            s = self._delta_sorted[b] = np.unique(np.concatenate(self._delta[b]))
+        return s
+
+    def seen(self, keys: np.ndarray, buckets: np.ndarray) -> np.ndarray:
+        """True where the key was already committed (vectorized per bucket)."""
+        out = np.zeros(len(keys), dtype=bool)
+        for b in np.unique(buckets):
+            sel = np.flatnonzero(buckets == b)
+            k = keys[sel]
+            hit = np.zeros(len(k), dtype=bool)
+            base = self._load_bucket(int(b))
+            if base is not None:
+                arr, bloom = base
+                maybe = np.flatnonzero(_bloom_maybe(bloom, k))
+                if len(maybe) and len(arr):
+                    i = np.searchsorted(arr, k[maybe])
+                    hit[maybe] = arr[np.minimum(i, len(arr) - 1)] == k[maybe]
+            delta = self._delta_of(int(b))
+            if delta is not None:
+                i = np.searchsorted(delta, k)
+                hit |= delta[np.minimum(i, len(delta) - 1)] == k
+            out[sel] = hit
+        return out
+
+    def add(self, keys: np.ndarray, buckets: np.ndarray):
+        """Record committed keys: one journal file per call, compaction when the delta is full."""
+        if not len(keys):
+            return
+        rec = np.empty(len(keys), dtype=[("bucket", "int64"), ("key", "uint64")])
+        rec["bucket"], rec["key"] = buckets, keys
+        _save_atomic(os.path.join(self.root, f"journal-{time.time_ns()}.npy"), rec)
+        self._stash(buckets, keys)
+        now = time.time()
+        stale = [int(b) for b in np.unique(buckets) if now - self.touched.get(int(b), 0) >= 3600]
+        if stale:  # touch times only need hour precision against a TTL of days
+            self.touched.update((b, now) for b in stale)
+            self.expire()
+            _write_json(os.path.join(self.root, "meta.json"), {"touched": {str(b): t for b, t in self.touched.items()}})
+        if self._delta_n >= self.max_delta_keys:
+            self.compact()
+
+    def compact(self):
+        """Merge the in-memory delta into the per-bucket key files and rebuild their blooms."""
+        journals = sorted(glob.glob(os.path.join(self.root, "journal-*.npy")))
+        for b in list(self._delta):
+            delta = self._delta_of(b)
+            d = self._bucket_dir(b)
+            os.makedirs(d, exist_ok=True)
+            base = self._load_bucket(b)
+            merged = delta if base is None else np.union1d(np.asarray(base[0]), delta)
+            self._open.pop(b, None)
+            stamp = time.time_ns()
+            names = {"keys": f"keys-{stamp}.npy", "bloom": f"bloom-{stamp}.npy"}
+            _save_atomic(os.path.join(d, names["keys"]), merged)
+            _save_atomic(os.path.join(d, names["bloom"]), _bloom_build(merged, self.bits_per_key))
+            _write_json(os.path.join(d, "meta.json"), {**names, "count": int(len(merged))})
+            for old in glob.glob(os.path.join(d, "*.npy")):
+                if os.path.basename(old) not in names.values():
+                    os.remove(old)
+        for j in journals:
+            os.remove(j)
+        self._delta.clear()
+        self._delta_sorted.clear()
+        self._delta_n = 0
+
+    def expire(self):
+        """Drop buckets nothing was added to within the TTL."""
+        cutoff = time.time() - self.ttl
+        for b in [b for b, t in self.touched.items() if t < cutoff]:
+            del self.touched[b]
+            self._open.pop(b, None)
+            shutil.rmtree(self._bucket_dir(b), ignore_errors=True)
+            if b in self._delta:
+                self._delta_n -= sum(len(x) for x in self._delta.pop(b))
+                self._delta_sorted.pop(b, None)
+            logger.info(f"Dedup index: expired bucket {b}")
+
+
+_indexes: Dict[str, DedupIndex] = {}
+
+
+def get_index(plan) -> DedupIndex:
+    """Committer-side index for plan.dedup_path, opened once per process."""
+    idx = _indexes.get(plan.dedup_path)
+    if idx is None:
+        idx = _indexes[plan.dedup_path] = DedupIndex(plan.dedup_path, plan.dedup_ttl_days, plan.dedup_bloom_bits,
+                                                     plan.dedup_max_delta_keys)
+    return idx
+
+
+def filter_new(masked, plan, also_seen: Optional[np.ndarray] = None):
+    """Committer: (rows not yet in the index, their keys, their buckets, rows dropped).
+
+    Drops repeats within the frame too.  also_seen holds keys already written
+    earlier in the same file (streaming) or batch.
+    """
+    masked, keys, buckets = split(masked)
+    dup = get_index(plan).seen(keys, buckets) | pd.Series(keys).duplicated().to_numpy()
+    if also_seen is not None and len(also_seen):
+        dup |= np.isin(keys, also_seen)
+    keep = ~dup
+    if dup.any():
+        masked = masked.loc[keep] if isinstance(masked, pd.DataFrame) else masked.filter(keep)
+    return masked, keys[keep], buckets[keep], int(dup.sum())
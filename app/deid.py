@@ -1,30 +1,95 @@
 ## app/deid.py
 from __future__ import annotations
-import os
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
 import pandas as pd
 from .utils import hmac_sha256
+from .plan import PipelinePlan, as_plan
 
 # HIPAA Safe Harbor transforms
 
-def apply_safe_harbor(df: pd.DataFrame, *, cfg: dict) -> pd.DataFrame:
+
+class KeyCache:
+    """Bounded LRU of id -> patient_key, kept for the life of the process (across files).
+
+    Entries are only valid for one salt; a different salt empties the cache.
+    """
+
+    def __init__(self, maxsize: int = 1_000_000):
+        self.maxsize = maxsize
+        self.salt: Optional[str] = None
+        self._keys: "OrderedDict[str, str]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def lookup(self, ids, salt: str) -> List[str]:
+        if salt != self.salt:
+            self._keys.clear()
+            self.salt = salt
+        keys = self._keys
+        out: List[Optional[str]] = [None] * len(ids)
+        missing = []
+        for i, v in enumerate(ids):
+            k = keys.get(v)
+            if k is None:
+                missing.append(i)
+            else:
+                keys.move_to_end(v)
+                out[i] = k
+        if missing:
+            vals = [ids[i] for i in missing]
+            new = [hmac_sha256(v, salt) for v in vals]
+            for i, v, k in zip(missing, vals, new):
+                out[i] = k
+                keys[v] = k
+            while len(keys) > self.maxsize:
+                keys.popitem(last=False)
+        return out
+
+
+key_cache = KeyCache()
+
+
+def hash_ids(ids: pd.Series, salt: str) -> pd.Series:
+    """HMAC each distinct id once (factorize → hash uniques → broadcast back)."""
+    codes, uniques = pd.factorize(ids.astype(str))
+    keys = np.empty(len(uniques) + 1, dtype=object)  # last slot: missing ids (code -1)
+    keys[:-1] = key_cache.lookup(list(uniques), salt)
+    keys[-1] = None
+    return pd.Series(keys[codes], index=ids.index, dtype=object)
+
+def _year(s: pd.Series) -> pd.Series:
+    """Year of each date; datetime.date objects are parsed once per distinct value."""
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s.dt.year
+    codes, uniques = pd.factorize(s)
+    parsed = pd.to_datetime(pd.Series(uniques, dtype=object), errors="coerce").to_numpy()
+    return pd.Series(np.append(parsed, parsed.dtype.type("NaT"))[codes], index=s.index).dt.year
+
+def apply_safe_harbor(df: pd.DataFrame, *, cfg: Optional[dict] = None,
+                      plan: Optional[PipelinePlan] = None) -> pd.DataFrame:
+    plan = plan or as_plan(cfg)
     df = df.copy()
-    salt = os.getenv(cfg["hipaa_safe_harbor"]["hash_salt_env"], "")
-    id_col = cfg["hipaa_safe_harbor"]["hash_id_column"]
+    salt = plan.salt
+    id_col = plan.id_col
 
     # Hash patient_id -> patient_key
-    df["patient_key"] = df[id_col].astype(str).apply(lambda v: hmac_sha256(v, salt))
+    key_cache.maxsize = plan.key_cache_size
+    df["patient_key"] = hash_ids(df[id_col], salt)
 
     # Dates
-    if cfg["hipaa_safe_harbor"]["dates"].get("dob") == "year_only" and "dob" in df:
-        df["dob_year"] = pd.to_datetime(df["dob"], errors="coerce").dt.year
-    if cfg["hipaa_safe_harbor"]["dates"].get("event_ts") == "date_only" and "event_ts" in df:
-        df["event_date"] = pd.to_datetime(df["event_ts"], errors="coerce").dt.date
+    if plan.dob_year and "dob" in df:
+        df["dob_year"] = _year(df["dob"])
+    if plan.event_date and "event_ts" in df:
+        ts = df["event_ts"]
+        df["event_date"] = (ts if pd.api.types.is_datetime64_any_dtype(ts) else pd.to_datetime(ts, errors="coerce")).dt.date
 
     # ZIP to ZIP3
-    if cfg["hipaa_safe_harbor"].get("zip_truncate_to_3", True) and "zip" in df:
+    if plan.zip3 and "zip" in df:
         df["zip3"] = df["zip"].astype(str).str.zfill(5).str[:3]
 
     # Remove direct identifiers
-    cols_to_remove = set(cfg["hipaa_safe_harbor"].get("remove", [])) | {id_col, "dob", "zip", "event_ts"}
-    df = df.drop(columns=[c for c in cols_to_remove if c in df.columns], errors="ignore")
+    df = df.drop(columns=[c for c in plan.drop_cols if c in df.columns], errors="ignore")
     return df
@@ -0,0 +1,337 @@
+## app/executor.py
+
+from __future__ import annotations
+import multiprocessing as mp
+import logging, queue, threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+from .utils import logger, log_to_queue, worker_log_queue
+from .plan import load_plan
+from .instrument import Trace, profiled
+from . import metrics, pipeline
+
+
+class WorkerCrashed(RuntimeError):
+    pass
+
+
+class _Job:
+    __slots__ = ("meta", "future", "suspect", "result", "inline")
+
+    def __init__(self, meta, inline=False):
+        self.meta = meta
+        self.inline = inline   # too big to ship back from a worker; streamed by the committer
+        self.future = None
+        self.suspect = False   # was in flight when a worker died
+        self.result = None     # (ok, masked_df | exception) once finished
+
+
+class FilePool:
+    """Transform files in worker processes; sink writes stay in this process.
+
+    - At most max_in_flight files are queued/running; submit() blocks beyond that.
+    - ordered=True commits files in submission order, whatever order workers finish in.
+    - When a worker dies every in-flight file is retried, suspects one at a time,
+      so only the file that actually kills a worker is quarantined.
+    - Files above streaming.min_file_mb are streamed in this process instead,
+      since a worker would have to pickle the whole frame back.
+    - With watcher.batch enabled, consecutive finished files share one commit.
+    """
+
+    def __init__(self, cfg_path: str, workers: int, max_in_flight: Optional[int] = None,
+                 ordered: bool = True, on_done: Optional[Callable[[str, bool, Any], None]] = None):
+        self.cfg_path = cfg_path
+        self.workers = workers
+        self.max_in_flight = max_in_flight or 2 * workers
+        self.ordered = ordered
+        self.on_done = on_done or (lambda path, ok, meta: None)
+        self.jobs: "OrderedDict[str, _Job]" = OrderedDict()
+        self.pool = self._new_pool()
+
+    def _new_pool(self):
+        # workers log through this process's handlers (one writer rotates logs/pipeline.log)
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=mp.get_context("spawn"),
+                                   initializer=log_to_queue,
+                                   initargs=(worker_log_queue(), logging.getLogger().getEffectiveLevel()))
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.jobs
+
+    def __len__(self) -> int:
+        return len(self.jobs)
+
+    def submit(self, path: str, meta: Any = None):
+        while len(self.jobs) >= self.max_in_flight:
+            self.poll(timeout=None)
+        self.jobs[path] = _Job(meta, inline=pipeline.should_stream(path, load_plan(self.cfg_path)))
+        self._schedule()
+
+    def _schedule(self):
+        running = [j for j in self.jobs.values() if j.future is not None and j.result is None]
+        if any(j.suspect for j in running):
+            return
+        for path, job in self.jobs.items():
+            if job.future is not None or job.result is not None or job.inline:
+                continue
+            if job.suspect:
+                if not running:
+                    job.future = self.pool.submit(pipeline.transform_file, path, self.cfg_path)
+                return
+            job.future = self.pool.submit(pipeline.transform_file, path, self.cfg_path)
+            running.append(job)
+
+    def _on_broken(self, crashed: list):
+        alone = len(crashed) == 1 and crashed[0][1].suspect
+        for path, job in crashed:
+            if alone:
+                job.result = (False, WorkerCrashed(f"worker process died while processing {path}"))
+            else:
+                job.suspect, job.future = True, None
+                logger.warning(f"Worker crashed; retrying {path} in isolation")
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.pool = self._new_pool()
+
+    def poll(self, timeout: Optional[float] = 0):
+        """Collect finished transforms and commit whatever is ready."""
+        futures = {j.future: p for p, j in self.jobs.items() if j.future is not None and j.result is None}
+        if futures:
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            crashed = []
+            for fut in done:
+                path = futures[fut]
+                job = self.jobs[path]
+                try:
+                    job.result = (True, fut.result())
+                except BrokenProcessPool:
+                    crashed.append((path, job))
+                except Exception as e:
+                    job.result = (False, e)
+            if crashed:
+                # A dead worker breaks every pending future, not just the one it was running
+                crashed += [(p, j) for p, j in self.jobs.items()
+                            if j.future is not None and j.result is None and (p, j) not in crashed]
+                self._on_broken(crashed)
+        self._commit_ready()
+        self._schedule()
+
+    def _commit_ready(self):
+        plan = load_plan(self.cfg_path)
+        group = []  # watcher.batch: finished transforms waiting for one shared commit
+        for path in list(self.jobs):
+            job = self.jobs[path]
+            if job.inline and job.result is None:
+                self._flush(group, plan)
+                try:
+                    pipeline.stream_file(path, plan)
+                    job.result = (True, None)
+                except Exception as e:
+                    job.result = (False, e)
+            if job.result is None:
+                if self.ordered:
+                    break
+                continue
+            ok, value = job.result
+            if ok and not job.inline:
+                masked, records = value
+                trace = Trace(plan)
+                trace.add(records)
+                if plan.batch_enabled:
+                    group.append((path, masked, trace))
+                    continue
+                try:
+                    pipeline.commit(path, masked, plan, trace)
+                except Exception as e:
+                    ok, value = False, e
+            self._flush(group, plan)
+            self._report(path, None if ok else value, plan)
+        self._flush(group, plan)
+
+    def _flush(self, group: list, plan):
+        if not group:
+            return
+        try:
+            errors = pipeline.commit_batch(group, plan)
+        except Exception as e:
+            errors = {path: e for path, _, _ in group}
+        for path, _, _ in group:
+            self._report(path, errors.get(path, RuntimeError(f"{path} missing from the batch result")), plan)
+        group.clear()
+
+    def _report(self, path: str, error: Optional[BaseException], plan):
+        """Quarantine a failed file and report it; even if fail() raises, the job is finished."""
+        try:
+            if error is not None:
+                pipeline.fail(path, error, plan)
+        except Exception as e:
+            logger.error(f"Quarantining {path} failed: {e}", exc_info=e)
+        finally:
+            self._done(path, error is None)
+
+    def _done(self, path: str, ok: bool):
+        job = self.jobs.pop(path)
+        self.on_done(path, ok, job.meta)
+
+    def drain(self):
+        while self.jobs:
+            self.poll(timeout=None)
+
+    def close(self):
+        self.drain()
+        self.pool.shutdown()
+
+
+class _Item:
+    __slots__ = ("path", "plan", "trace", "value", "error", "inline")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.plan = None
+        self.trace = None
+        self.value = None      # frame/table: read, then transformed
+        self.error = None      # first failure; later stages pass the item through to the committer
+        self.inline = False    # streamed by the committer, like FilePool's inline jobs
+
+
+class StagedPipeline:
+    """One process, three threads: read file N+1 while N is transformed and N-1 is sunk.
+
+    - Bounded queues (watcher.stage_queue_depth) between read, transform and
+      commit; submit() blocks when the reader is that far behind.
+    - Files commit in submission order, one committer thread, so sink and
+      dedup semantics are those of process_file.  Like the worker pool, a
+      file's outlier bounds come from the baseline as of its transform, which
+      may predate the commit of the files just ahead of it.
+    - CSV/Parquet I/O and SQLite writes release the GIL, so the stages overlap.
+    - Same interface as FilePool; on_done runs in the caller's thread (poll()).
+    """
+
+    def __init__(self, cfg_path: str, depth: int = 2, on_done: Optional[Callable[[str, bool, Any], None]] = None):
+        self.cfg_path = cfg_path
+        self.on_done = on_done or (lambda path, ok, meta: None)
+        self.meta: dict = {}   # path -> meta, until on_done
+        self.queues = {name: queue.Queue(maxsize=depth) for name in ("read", "transform", "commit")}
+        self.done: queue.Queue = queue.Queue()
+        for name, fn in (("read", self._read), ("transform", self._transform), ("commit", self._commit)):
+            threading.Thread(target=self._loop, args=(name, fn), name=f"stage-{name}", daemon=True).start()
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.meta
+
+    def __len__(self) -> int:
+        return len(self.meta)
+
+    def submit(self, path: str, meta: Any = None):
+        self.meta[path] = meta
+        while True:
+            try:
+                self.queues["read"].put(_Item(path), timeout=0.1)
+                return
+            except queue.Full:
+                self.poll()
+
+    def _loop(self, name: str, fn):
+        nxt = {"read": "transform", "transform": "commit"}.get(name)
+        q = self.queues[name]
+        while True:
+            item = q.get()
+            if nxt is None:
+                try:
+                    fn(item)
+                except Exception as e:  # a bug, not a bad file: keep committing the rest
+                    logger.error(f"Commit stage failed: {e}", exc_info=e)
+                continue
+            if item.error is None and not item.inline:
+                try:
+                    fn(item)
+                except Exception as e:
+                    item.error, item.value = e, None
+            self.queues[nxt].put(item)
+
+    def _read(self, item: _Item):
+        item.plan = load_plan(self.cfg_path)
+        item.trace = Trace(item.plan)
+        if pipeline.should_stream(item.path, item.plan):
+            item.inline = True
+            return
+        item.value = pipeline.read_file(item.path, item.plan, item.trace)
+
+    def _transform(self, item: _Item):
+        with profiled(item.plan, item.path):
+            item.value = pipeline.transform_frame(item.value, item.plan, trace=item.trace)
+
+    def _commit(self, first: _Item):
+        """Commit first and whatever else is already waiting (shared commits with watcher.batch)."""
+        group, item = [], first
+        while item is not None:
+            if item.error is None and not item.inline and item.plan.batch_enabled:
+                group.append(item)
+            else:
+                self._commit_group(group)
+                group = []
+                self._commit_one(item)
+            try:
+                item = self.queues["commit"].get_nowait()
+            except queue.Empty:
+                item = None
+        self._commit_group(group)
+
+    def _report(self, item: _Item, error: Optional[BaseException]):
+        """Quarantine a failed item and report it; even if fail() raises, the file is never lost."""
+        try:
+            if error is not None:
+                pipeline.fail(item.path, error, item.plan)
+        except Exception as e:
+            logger.error(f"Quarantining {item.path} failed: {e}", exc_info=e)
+        finally:
+            item.value = None
+            self.done.put((item.path, error is None))
+
+    def _commit_one(self, item: _Item):
+        error = item.error
+        if error is None:
+            try:
+                if item.inline:
+                    pipeline.stream_file(item.path, item.plan, item.trace)
+                else:
+                    pipeline.commit(item.path, item.value, item.plan, item.trace)
+            except Exception as e:
+                error = e
+        self._report(item, error)
+
+    def _commit_group(self, group: list):
+        if not group:
+            return
+        try:
+            errors = pipeline.commit_batch([(i.path, i.value, i.trace) for i in group], group[0].plan)
+        except Exception as e:
+            errors = {i.path: e for i in group}
+        for i in group:
+            self._report(i, errors.get(i.path, RuntimeError(f"{i.path} missing from the batch result")))
+
+    def poll(self, timeout: Optional[float] = 0):
+        """Report committed files to on_done; waits up to timeout for the first one."""
+        try:
+            reports = [self.done.get(timeout=timeout) if timeout != 0 else self.done.get_nowait()]
+        except queue.Empty:
+            reports = []
+        while True:
+            try:
+                reports.append(self.done.get_nowait())
+            except queue.Empty:
+                break
+        for path, ok in reports:
+            self.on_done(path, ok, self.meta.pop(path, None))
+        plan = load_plan(self.cfg_path)
+        m = metrics.get_metrics(plan.metrics_path, plan.metrics_flush_seconds)
+        if m is not None:
+            for name, q in self.queues.items():
+                m.set(f"stage_queue_{name}", q.qsize())
+
+    def drain(self):
+        while self.meta:
+            self.poll(timeout=None)
+
+    def close(self):
+        self.drain()
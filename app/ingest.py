@@ -0,0 +1,149 @@
+## app/ingest.py
+
+from __future__ import annotations
+from functools import lru_cache
+from typing import Iterator, Optional
+import pandas as pd
+from .utils import logger
+
+try:  # typed, multithreaded CSV/JSONL parsing; pandas inference otherwise
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.json as pajson
+except ImportError:
+    pa = None
+
+"""
+Typed input readers.
+
+The Arrow schema comes from `schema.types` in config.yaml (or the fields of
+schemas.Event when no types are configured), so values are parsed once,
+straight into their final dtypes:
+
+  string    -> string; `schema.dictionary_columns` (default zip and the
+               names) dictionary-encoded, i.e. pandas categoricals
+  float     -> float64
+  datetime  -> timestamp, tried against `schema.timestamp_formats` in order
+  date      -> date32 (datetime.date objects in pandas, as before)
+
+A file that does not fit the schema (a word in a numeric column, an
+unknown timestamp layout) raises ArrowInvalid; the caller then falls back
+to the pandas reader, whose values are coerced by enforce_schema as before.
+"""
+
+def configured_types(plan) -> tuple:
+    """(column, type) pairs: schema.types, else the annotations of schemas.Event."""
+    if plan.types:
+        return plan.types
+    try:
+        from datetime import date, datetime
+        from .schemas import Event
+    except ImportError:  # pydantic missing
+        return ()
+    names = {str: "string", float: "float", date: "date", datetime: "datetime"}
+    return tuple((c, names[f.annotation]) for c, f in Event.model_fields.items() if f.annotation in names)
+
+
+@lru_cache(maxsize=16)
+def _arrow_types(types: tuple, dictionary_cols: frozenset) -> dict:
+    out = {}
+    for col, t in types:
+        if t == "string":
+            out[col] = pa.dictionary(pa.int32(), pa.string()) if col in dictionary_cols else pa.string()
+        elif t == "float":
+            out[col] = pa.float64()
+        elif t == "datetime":
+            out[col] = pa.timestamp("us")
+        elif t == "date":
+            out[col] = pa.date32()
+    return out
+
+
+def arrow_types(plan) -> dict:
+    return _arrow_types(configured_types(plan), plan.dictionary_cols)
+
+
+def _csv_options(plan, header=None):
+    parsers = [pacsv.ISO8601 if f == "ISO8601" else f for f in plan.ts_formats]
+    types = arrow_types(plan)
+    if header is not None:
+        types = {c: t for c, t in types.items() if c in header}
+    convert = pacsv.ConvertOptions(column_types=types, timestamp_parsers=parsers, strings_can_be_null=True)
+    return pacsv.ReadOptions(use_threads=True), convert
+
+
+def read_table(path: str, plan) -> "pa.Table":
+    """Whole file as a typed Arrow table (raises pa.ArrowInvalid on values that don't fit)."""
+    if plan.input_format == "jsonl":
+        # The JSON reader has no per-column converters: infer, then cast to the schema
+        table = pajson.read_json(path)
+        for c, t in arrow_types(plan).items():
+            if c in table.column_names and table.schema.field(c).type != t:
+                col = table.column(c)
+                if pa.types.is_dictionary(t) and not pa.types.is_string(col.type):
+                    col = col.cast(pa.string())
+                table = table.set_column(table.schema.get_field_index(c), c, col.cast(t))
+        return table
+    read, convert = _csv_options(plan)
+    return pacsv.read_csv(path, read_options=read, convert_options=convert)
+
+
+def to_frame(table: "pa.Table") -> pd.DataFrame:
+    # split_blocks: one block per column, so later column assignments don't consolidate/copy
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def read_arrow(path: str, plan) -> Optional["pa.Table"]:
+    """Typed table, or None when Arrow is off/unavailable or the file needs coercion."""
+    if pa is None or plan.reader != "arrow":
+        return None
+    try:
+        return read_table(path, plan)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+        logger.debug(f"Arrow typed read failed for {path}, using the pandas reader: {e}")
+        return None
+
+
+def read_frame(path: str, plan) -> Optional[pd.DataFrame]:
+    table = read_arrow(path, plan)
+    return None if table is None else to_frame(table)
+
+
+def iter_tables(path: str, plan) -> Optional[Iterator]:
+    """Typed CSV chunks of about plan.stream_chunk_rows rows as Arrow tables, or None
+    (caller reads with pandas).
+
+    Should a later block fail to parse, the rest of the file is read with
+    pandas from the first row not yet yielded, so those chunks are DataFrames.
+    """
+    if pa is None or plan.reader != "arrow" or plan.input_format == "jsonl":
+        return None
+    try:
+        header = pd.read_csv(path, nrows=0).columns
+        read, convert = _csv_options(plan, set(header))
+        reader = pacsv.open_csv(path, read_options=read, convert_options=convert)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+        logger.debug(f"Arrow typed read failed for {path}, using the pandas reader: {e}")
+        return None
+    return _chunks(path, plan, reader)
+
+
+def iter_frames(path: str, plan) -> Optional[Iterator[pd.DataFrame]]:
+    tables = iter_tables(path, plan)
+    return None if tables is None else (t if isinstance(t, pd.DataFrame) else to_frame(t) for t in tables)
+
+
+def _chunks(path: str, plan, reader) -> Iterator:
+    done, pending, n = 0, [], 0
+    try:
+        for batch in reader:
+            pending.append(batch)
+            n += batch.num_rows
+            if n >= plan.stream_chunk_rows:
+                yield pa.Table.from_batches(pending)
+                done, pending, n = done + n, [], 0
+        if pending:
+            yield pa.Table.from_batches(pending)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+        logger.debug(f"Arrow typed read failed in {path} after {done} rows, continuing with pandas: {e}")
+        yield from pd.read_csv(path, chunksize=plan.stream_chunk_rows, skiprows=range(1, done + 1))
@@ -0,0 +1,175 @@
+## app/instrument.py
+
+from __future__ import annotations
+import json, os, random, sys, time
+from typing import Dict, List, Optional
+
+try:
+    import resource  # POSIX only
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+"""
+Per-stage instrumentation for one file.
+
+A Trace always records wall time and rows per stage (a couple of
+perf_counter calls, cheap enough to leave on); that feeds the latency
+histograms in metrics.py.  With `instrumentation.enabled` it also records
+bytes in and memory per stage, and the committer appends one JSON line per
+stage per file to `instrumentation.path`.
+
+    trace = Trace(plan)
+    with trace.stage("clean", df):
+        df = clean(df, plan)
+
+Streamed files call the same stage many times; the records accumulate.
+"""
+
+_PAGE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_MB = float(2 ** 20)
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE
+    except OSError:
+        return None
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (_MB if sys.platform == "darwin" else 1024.0), 1)  # bytes on macOS, KiB elsewhere
+
+
+class _Stage:
+    __slots__ = ("trace", "name", "rows", "bytes_in", "_t0", "_rss0", "_tm0")
+
+    def __init__(self, trace: "Trace", name: str, df=None, bytes_in: Optional[int] = None):
+        self.trace = trace
+        self.name = name
+        self.rows = len(df) if df is not None else 0
+        self.bytes_in = bytes_in
+        if bytes_in is None and df is not None and trace.detailed:
+            nbytes = getattr(df, "nbytes", None)  # pyarrow.Table
+            self.bytes_in = int(nbytes if nbytes is not None else df.memory_usage(index=False).sum())  # shallow: cheap, no string walk
+
+    def __enter__(self) -> "_Stage":
+        if self.trace.memory == "tracemalloc":
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self._tm0 = tracemalloc.get_traced_memory()[0]
+        elif self.trace.memory == "rss":
+            self._rss0 = _rss_bytes()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._t0
+        r = self.trace.records.get(self.name)
+        if r is None:
+            r = self.trace.records[self.name] = {"stage": self.name, "seconds": 0.0, "rows": 0, "calls": 0}
+        r["seconds"] += seconds
+        r["rows"] += self.rows
+        r["calls"] += 1
+        if self.bytes_in is not None:
+            r["bytes_in"] = r.get("bytes_in", 0) + self.bytes_in
+        if self.trace.memory == "tracemalloc":
+            import tracemalloc
+            peak = (tracemalloc.get_traced_memory()[1] - self._tm0) / _MB
+            r["alloc_peak_mb"] = round(max(r.get("alloc_peak_mb", 0.0), peak), 2)
+        elif self.trace.memory == "rss" and self._rss0 is not None:
+            now = _rss_bytes()
+            r["rss_delta_mb"] = round(r.get("rss_delta_mb", 0.0) + (now - self._rss0) / _MB, 2)
+            r["peak_rss_mb"] = _peak_rss_mb()
+        return False
+
+
+class Trace:
+    def __init__(self, plan=None):
+        self.detailed = bool(plan is not None and plan.trace_path)
+        self.memory = plan.trace_memory if self.detailed else "off"
+        self.records: Dict[str, dict] = {}
+
+    def stage(self, name: str, df=None, bytes_in: Optional[int] = None) -> _Stage:
+        return _Stage(self, name, df, bytes_in)
+
+    def add(self, records: List[dict]):
+        """Fold in records from another process (a worker's transform)."""
+        for rec in records:
+            r = self.records.get(rec["stage"])
+            if r is None:
+                self.records[rec["stage"]] = dict(rec)
+                continue
+            for k in ("seconds", "rows", "calls", "bytes_in", "rss_delta_mb"):
+                if k in rec:
+                    r[k] = r.get(k, 0) + rec[k]
+
+    def emit(self, path: str, plan, m=None, **extra):
+        """Committer: latency histograms always, JSONL lines when enabled."""
+        recs = list(self.records.values())
+        if m is not None:
+            for r in recs:
+                m.observe(r["stage"], r["seconds"])
+        if not self.detailed or not recs:
+            return
+        now = time.time()
+        lines = []
+        for r in recs:
+            line = {"ts": now, "file": path, "pid": os.getpid(), **extra, **r}
+            line["seconds"] = round(r["seconds"], 6)
+            line["rows_per_sec"] = round(r["rows"] / r["seconds"]) if r["seconds"] > 0 else None
+            lines.append(json.dumps(line))
+        os.makedirs(os.path.dirname(plan.trace_path) or ".", exist_ok=True)
+        with open(plan.trace_path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+class _Profile:
+    """cProfile (or pyinstrument) around one sampled file; no-op otherwise."""
+
+    def __init__(self, plan, path: str):
+        self.plan = plan
+        self.path = path
+        self.prof = None
+
+    def __enter__(self):
+        plan = self.plan
+        if not plan.profile_rate or random.random() >= plan.profile_rate:
+            return self
+        if plan.profiler == "pyinstrument":
+            try:
+                from pyinstrument import Profiler  # type: ignore
+                self.prof = Profiler()
+            except ImportError:
+                pass
+        if self.prof is None:
+            import cProfile
+            self.prof = cProfile.Profile()
+        if hasattr(self.prof, "enable"):
+            self.prof.enable()
+        else:
+            self.prof.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.prof is None:
+            return False
+        os.makedirs(self.plan.profile_dir, exist_ok=True)
+        stem = os.path.join(self.plan.profile_dir, f"{os.path.basename(self.path)}.{os.getpid()}.{time.time_ns()}")
+        if hasattr(self.prof, "enable"):
+            self.prof.disable()
+            self.prof.dump_stats(stem + ".prof")     # snakeviz / python -m pstats
+        else:
+            self.prof.stop()
+            with open(stem + ".html", "w", encoding="utf-8") as f:
+                f.write(self.prof.output_html())
+        return False
+
+
+def profiled(plan, path: str) -> _Profile:
+    return _Profile(plan, path)
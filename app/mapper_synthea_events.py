@@ -1,12 +1,27 @@
 from __future__ import annotations
-import sys
+import argparse, os
 from pathlib import Path
+import numpy as np
 import pandas as pd
 
+try:  # streaming CSV reader with per-batch filtering; pandas chunks otherwise
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
+
 """
 Build standardized 'events' rows from Synthea patients + observations.
 Output schema:
 patient_id, first_name, last_name, dob, zip, event_ts, systolic_bp, diastolic_bp, heart_rate
+
+observations.csv is streamed in chunks and filtered to the three vital
+LOINC codes before anything is kept; output can be sharded into several
+events_*.csv files so the watcher's workers can process them in parallel.
+
+Usage:
+  python -m app.mapper_synthea_events <synthea_csv_dir> <incoming_dir> [--shard-rows N] [--shard-mb M]
 """
 
 # LOINC codes
@@ -14,73 +29,143 @@ LOINC_HR = "8867-4"
 LOINC_SBP = "8480-6"
 LOINC_DBP = "8462-4"
 
-def load_csv(base: Path, name: str) -> pd.DataFrame:
+CODE_MAP = {LOINC_HR: "heart_rate", LOINC_SBP: "systolic_bp", LOINC_DBP: "diastolic_bp"}
+COLS_OUT = ["patient_id", "first_name", "last_name", "dob", "zip",
+            "event_ts", "systolic_bp", "diastolic_bp", "heart_rate"]
+CHUNK_ROWS = 1_000_000
+
+def _csv_path(base: Path, name: str) -> Path:
     p = base / name
     if not p.exists():
         raise FileNotFoundError(p)
-    return pd.read_csv(p)
-
-def build_events(src_dir: Path) -> pd.DataFrame:
-    # Patients
-    p = load_csv(src_dir, "patients.csv")
-    cols = {c.upper(): c for c in p.columns}
-    pid_col = cols.get("ID", "Id")
-    first_col = cols.get("FIRST", "FIRST")
-    last_col  = cols.get("LAST", "LAST")
-    dob_col   = cols.get("BIRTHDATE", "BIRTHDATE")
-    zip_col   = cols.get("ZIP", "ZIP")
-
-    patients = p[[pid_col, first_col, last_col, dob_col, zip_col]].rename(columns={
-        pid_col: "patient_id",
-        first_col: "first_name",
-        last_col: "last_name",
-        dob_col: "dob",
-        zip_col: "zip",
-    })
-
-    # Observations (vitals)
-    o = load_csv(src_dir, "observations.csv")
-    o_cols = {c.upper(): c for c in o.columns}
-    date_c = o_cols.get("DATE", "DATE")
-    pat_c  = o_cols.get("PATIENT", "PATIENT")
-    code_c = o_cols.get("CODE", "CODE")
-    val_c  = o_cols.get("VALUE", "VALUE")
-
-    keep = o[o[code_c].astype(str).isin([LOINC_HR, LOINC_SBP, LOINC_DBP])].copy()
-    keep["VALUE_NUM"] = pd.to_numeric(keep[val_c], errors="coerce")
-    code_map = {LOINC_HR: "heart_rate", LOINC_SBP: "systolic_bp", LOINC_DBP: "diastolic_bp"}
-    keep["metric"] = keep[code_c].map(code_map)
-
-    pivot = (keep
-             .pivot_table(index=[pat_c, date_c], columns="metric", values="VALUE_NUM", aggfunc="last")
-             .reset_index())
-
-    pivot = pivot.rename(columns={pat_c: "patient_id", date_c: "event_ts"})
-    events = pivot.merge(patients, on="patient_id", how="left")
-
-    cols_out = ["patient_id", "first_name", "last_name", "dob", "zip",
-                "event_ts", "systolic_bp", "diastolic_bp", "heart_rate"]
-    for c in cols_out:
+    return p
+
+def _columns(path: Path, wanted: dict) -> dict:
+    """Map our names to the file's actual header names (Synthea casing varies)."""
+    header = {c.upper(): c for c in pd.read_csv(path, nrows=0).columns}
+    return {k: header.get(v, v) for k, v in wanted.items()}
+
+def load_csv(base: Path, name: str) -> pd.DataFrame:
+    return pd.read_csv(_csv_path(base, name))
+
+def load_patients(src_dir: Path) -> pd.DataFrame:
+    path = _csv_path(src_dir, "patients.csv")
+    cols = _columns(path, {"patient_id": "ID", "first_name": "FIRST", "last_name": "LAST",
+                           "dob": "BIRTHDATE", "zip": "ZIP"})
+    p = pd.read_csv(path, usecols=list(cols.values()), dtype={cols["zip"]: str})
+    return p.rename(columns={v: k for k, v in cols.items()})
+
+def _vitals_arrow(path: Path, cols: dict, block_mb: int = 16) -> pd.DataFrame:
+    wanted = list(cols.values())
+    reader = pacsv.open_csv(path, read_options=pacsv.ReadOptions(block_size=block_mb << 20),
+                            convert_options=pacsv.ConvertOptions(
+                                include_columns=wanted, column_types={c: pa.string() for c in wanted}))
+    codes = pa.array(list(CODE_MAP))
+    batches = []
+    for batch in reader:
+        batch = batch.filter(pc.is_in(batch.column(cols["code"]), value_set=codes))
+        if batch.num_rows:
+            batches.append(batch)
+    return pa.Table.from_batches(batches, schema=reader.schema).to_pandas()
+
+def _vitals_pandas(path: Path, cols: dict, chunk_rows: int) -> pd.DataFrame:
+    parts = []
+    for chunk in pd.read_csv(path, usecols=list(cols.values()), dtype=str, chunksize=chunk_rows):
+        parts.append(chunk[chunk[cols["code"]].isin(list(CODE_MAP))])
+    return pd.concat(parts, ignore_index=True)
+
+def read_vitals(src_dir: Path, chunk_rows: int = CHUNK_ROWS) -> pd.DataFrame:
+    """HR/SBP/DBP rows of observations.csv, filtered while streaming so the
+    full file (usually the largest Synthea output) is never in memory."""
+    path = _csv_path(src_dir, "observations.csv")
+    cols = _columns(path, {"event_ts": "DATE", "patient_id": "PATIENT", "code": "CODE", "value": "VALUE"})
+    keep = _vitals_arrow(path, cols) if pa is not None else _vitals_pandas(path, cols, chunk_rows)
+    keep = keep[list(cols.values())].rename(columns={v: k for k, v in cols.items()})
+    keep["value"] = pd.to_numeric(keep["value"], errors="coerce")
+    keep["metric"] = keep.pop("code").map(CODE_MAP)
+    return keep
+
+def pivot_vitals(keep: pd.DataFrame) -> pd.DataFrame:
+    """One row per (patient, timestamp), last non-null value per vital, sorted by
+    both; the same result as pivot_table(aggfunc="last") on integer codes
+    instead of a string groupby."""
+    keep = keep.dropna(subset=["value"])
+    pk, puniq = pd.factorize(keep["patient_id"], sort=True)
+    tk, tuniq = pd.factorize(keep["event_ts"], sort=True)
+    metrics = list(CODE_MAP.values())
+    mk = pd.Categorical(keep["metric"], categories=metrics).codes
+    key = pk.astype("int64") * len(tuniq) + tk
+    # last row per (key, metric) in file order
+    pos = pd.DataFrame({"key": key, "m": mk}).drop_duplicates(keep="last").index.to_numpy()
+    keys, kpos = np.unique(key, return_inverse=True)  # sorted == (patient, ts) order
+    wide = np.full((len(keys), len(metrics)), np.nan)
+    wide[kpos[pos], mk[pos]] = keep["value"].to_numpy(dtype="float64")[pos]
+    out = pd.DataFrame({"patient_id": puniq[keys // len(tuniq)], "event_ts": tuniq[keys % len(tuniq)]})
+    for i, m in enumerate(metrics):
+        if not np.isnan(wide[:, i]).all():  # pivot_table leaves out vitals never seen
+            out[m] = wide[:, i]
+    return out
+
+def join_patients(pivot: pd.DataFrame, patients: pd.DataFrame) -> pd.DataFrame:
+    """Left join through a hash index on patient_id (get_indexer + take, no merge sort)."""
+    patients = patients.drop_duplicates("patient_id")
+    pos = pd.Index(patients["patient_id"]).get_indexer(pivot["patient_id"])
+    pos[pos < 0] = len(patients)  # unmatched -> the trailing None slot
+    out = pivot.copy()
+    for c in ("first_name", "last_name", "dob", "zip"):
+        out[c] = np.append(patients[c].to_numpy(dtype=object), None)[pos]
+    return out
+
+def build_events(src_dir: Path, chunk_rows: int = CHUNK_ROWS) -> pd.DataFrame:
+    patients = load_patients(src_dir)
+    events = join_patients(pivot_vitals(read_vitals(src_dir, chunk_rows)), patients)
+    for c in COLS_OUT:
         if c not in events.columns:
             events[c] = pd.NA
-    events = events[cols_out]
+    events = events[COLS_OUT]
 
     events["event_ts"] = pd.to_datetime(events["event_ts"], errors="coerce")
     events["dob"] = pd.to_datetime(events["dob"], errors="coerce").dt.date
     return events
 
+def write_shards(events: pd.DataFrame, dest: Path, shard_rows: int | None = None,
+                 shard_mb: float | None = None) -> list:
+    """Write events_<stamp>_<n>.csv files of at most shard_rows rows / ~shard_mb MB each.
+    Each shard is written under a hidden temp name and renamed, so the watcher
+    never picks up a half-written file."""
+    stamp = pd.Timestamp.now().strftime('%Y%m%d_%H%M%S_%f')
+    rows = len(events) or 1
+    if shard_mb:
+        sample = events.head(1000).to_csv(index=False).encode()
+        per_row = max(1.0, len(sample) / max(1, min(1000, len(events))))
+        by_size = max(1, int(shard_mb * 2**20 / per_row))
+        rows = min(rows, by_size)
+    if shard_rows:
+        rows = min(rows, shard_rows)
+    written = []
+    for i, start in enumerate(range(0, max(len(events), 1), rows)):
+        name = f"events_{stamp}.csv" if rows >= len(events) else f"events_{stamp}_{i:04d}.csv"
+        tmp = dest / f".{name}.tmp"
+        events.iloc[start:start + rows].to_csv(tmp, index=False)
+        os.replace(tmp, dest / name)
+        written.append(dest / name)
+    return written
+
 def main():
-    if len(sys.argv) < 3:
-        print("Usage: python -m app.mapper_synthea_events <synthea_csv_dir> <incoming_dir>")
-        sys.exit(1)
-    src = Path(sys.argv[1])
-    dest = Path(sys.argv[2])
+    ap = argparse.ArgumentParser(prog="python -m app.mapper_synthea_events")
+    ap.add_argument("synthea_csv_dir")
+    ap.add_argument("incoming_dir")
+    ap.add_argument("--shard-rows", type=int, default=None, help="max rows per events_*.csv")
+    ap.add_argument("--shard-mb", type=float, default=None, help="approx max size per events_*.csv")
+    ap.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="observations.csv read chunk")
+    args = ap.parse_args()
+    src = Path(args.synthea_csv_dir)
+    dest = Path(args.incoming_dir)
     dest.mkdir(parents=True, exist_ok=True)
 
-    events = build_events(src)
-    out = dest / f"events_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S_%f')}.csv"
-    events.to_csv(out, index=False)
-    print(f"Wrote {len(events)} rows -> {out}")
+    events = build_events(src, args.chunk_rows)
+    files = write_shards(events, dest, args.shard_rows, args.shard_mb)
+    print(f"Wrote {len(events)} rows -> {files[0] if len(files) == 1 else f'{len(files)} files in {dest}'}")
 
 if __name__ == "__main__":
     main()
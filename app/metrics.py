@@ -0,0 +1,212 @@
+## app/metrics.py
+
+from __future__ import annotations
+import argparse, atexit, json, os, threading, time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+"""
+Pipeline metrics kept in memory by the committing process and written to a
+small JSON snapshot (default logs/metrics.json) after commits, at most once
+per flush_seconds.  health.py and dashboards read the snapshot instead of
+scanning folders or Parquet data.
+
+  python -m app.metrics serve [--port 9108] [--path logs/metrics.json]
+    GET /metrics       Prometheus text format
+    GET /metrics.json  the snapshot as-is
+"""
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+RATE_WINDOW = 300.0  # seconds behind the *_per_min rates and rolling latency percentiles
+WINDOW_SAMPLES = 10_000  # per stage; older samples fall out of the rolling window early
+
+
+class Metrics:
+    def __init__(self, path: str, flush_seconds: float = 1.0):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.counters: Dict[str, float] = {"files_ok": 0, "files_failed": 0, "rows": 0,
+                                           "flagged_rows": 0, "arrivals": 0}
+        self.gauges: Dict[str, float] = {"started_at": time.time()}
+        # stage -> {"buckets": per-bucket (not cumulative) counts, +Inf last, "count", "sum"}
+        self.latency: Dict[str, dict] = {}
+        self._recent: Dict[str, deque] = {}
+        self._window: Dict[str, deque] = {}  # stage -> (t, seconds) for the rolling percentiles
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+        prev = load_snapshot(path)
+        if prev and prev.get("latency_buckets") == list(BUCKETS):
+            # Totals carry over watcher restarts; rates start fresh
+            self.counters.update(prev.get("counters", {}))
+            self.latency = prev.get("latency", {})
+
+    def inc(self, name: str, n: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+            self._recent.setdefault(name, deque()).append((time.time(), n))
+
+    def set(self, name: str, value: float):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            h = self.latency.get(stage)
+            if h is None:
+                h = self.latency[stage] = {"buckets": [0] * (len(BUCKETS) + 1), "count": 0, "sum": 0.0}
+            i = 0
+            while i < len(BUCKETS) and seconds > BUCKETS[i]:
+                i += 1
+            h["buckets"][i] += 1
+            h["count"] += 1
+            h["sum"] += seconds
+            w = self._window.get(stage)
+            if w is None:
+                w = self._window[stage] = deque(maxlen=WINDOW_SAMPLES)
+            w.append((time.time(), seconds))
+
+    def _rates(self, now: float) -> Dict[str, float]:
+        out = {}
+        for name, dq in self._recent.items():
+            while dq and dq[0][0] < now - RATE_WINDOW:
+                dq.popleft()
+            out[f"{name}_per_min"] = sum(n for _, n in dq) / (RATE_WINDOW / 60)
+        return out
+
+    def _rolling(self, now: float) -> Dict[str, dict]:
+        out = {}
+        for stage, w in self._window.items():
+            while w and w[0][0] < now - RATE_WINDOW:
+                w.popleft()
+            if not w:
+                continue
+            xs = sorted(x for _, x in w)
+            pick = lambda q: round(xs[min(len(xs) - 1, int(q * len(xs)))], 6)
+            out[stage] = {"count": len(xs), "p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99),
+                          "max": round(xs[-1], 6)}
+        return out
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        with self._lock:
+            return {"updated_at": now, "pid": os.getpid(), "counters": dict(self.counters),
+                    "gauges": dict(self.gauges), "rates_5m": self._rates(now),
+                    "latency_5m": self._rolling(now),
+                    "latency_buckets": list(BUCKETS),
+                    "latency": {k: {"buckets": list(v["buckets"]), "count": v["count"], "sum": v["sum"]}
+                                for k, v in self.latency.items()}}
+
+    def flush(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_seconds:
+            return
+        self._last_flush = now
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, self.path)
+
+
+_metrics: Dict[str, Metrics] = {}
+
+
+def get_metrics(path: Optional[str], flush_seconds: float = 1.0) -> Optional[Metrics]:
+    """Process-wide Metrics for path (None when metrics are disabled)."""
+    if not path:
+        return None
+    m = _metrics.get(path)
+    if m is None:
+        m = _metrics[path] = Metrics(path, flush_seconds)
+        atexit.register(m.flush, True)
+    return m
+
+
+def load_snapshot(path: str) -> Optional[dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def quantile(hist: dict, q: float, buckets=BUCKETS) -> Optional[float]:
+    """Upper bucket bound containing quantile q (Prometheus-style estimate)."""
+    if not hist or not hist["count"]:
+        return None
+    target, seen = q * hist["count"], 0
+    for bound, n in zip(list(buckets) + [float("inf")], hist["buckets"]):
+        seen += n
+        if seen >= target:
+            return bound
+    return float("inf")
+
+
+def render_prometheus(snap: dict) -> str:
+    lines = []
+    for name, v in snap.get("counters", {}).items():
+        lines += [f"# TYPE etl_{name}_total counter", f"etl_{name}_total {v}"]
+    for name, v in {**snap.get("gauges", {}), **snap.get("rates_5m", {})}.items():
+        lines += [f"# TYPE etl_{name} gauge", f"etl_{name} {v}"]
+    buckets = snap.get("latency_buckets", BUCKETS)
+    if snap.get("latency"):
+        lines.append("# TYPE etl_stage_seconds histogram")
+    for stage, h in snap.get("latency", {}).items():
+        cum = 0
+        for bound, n in zip(list(buckets) + ["+Inf"], h["buckets"]):
+            cum += n
+            lines.append(f'etl_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cum}')
+        lines.append(f'etl_stage_seconds_sum{{stage="{stage}"}} {h["sum"]}')
+        lines.append(f'etl_stage_seconds_count{{stage="{stage}"}} {h["count"]}')
+    for stage, r in snap.get("latency_5m", {}).items():
+        for q in ("p50", "p95", "p99"):
+            lines.append(f'etl_stage_seconds_5m{{stage="{stage}",quantile="{q[1:]}"}} {r[q]}')
+    lines.append(f"etl_snapshot_age_seconds {time.time() - snap.get('updated_at', 0):.3f}")
+    return "\n".join(lines) + "\n"
+
+
+def serve(path: str, host: str = "0.0.0.0", port: int = 9108) -> ThreadingHTTPServer:
+    """HTTP endpoint over the snapshot file; each request is one small file read."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            snap = load_snapshot(path)
+            if snap is None:
+                code, ctype, body = 503, "text/plain", b"no metrics snapshot yet\n"
+            elif self.path.startswith("/metrics.json"):
+                code, ctype, body = 200, "application/json", json.dumps(snap).encode()
+            elif self.path.startswith("/metrics"):
+                code, ctype, body = 200, "text/plain; version=0.0.4", render_prometheus(snap).encode()
+            else:
+                code, ctype, body = 404, "text/plain", b"try /metrics or /metrics.json\n"
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def main():
+    ap = argparse.ArgumentParser(prog="python -m app.metrics")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sv = sub.add_parser("serve", help="serve the metrics snapshot over HTTP")
+    sv.add_argument("--path", default=os.path.join("logs", "metrics.json"))
+    sv.add_argument("--host", default="0.0.0.0")
+    sv.add_argument("--port", type=int, default=9108)
+    args = ap.parse_args()
+    srv = serve(args.path, args.host, args.port)
+    print(f"Serving {args.path} on http://{args.host}:{args.port}/metrics")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
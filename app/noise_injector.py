@@ -1,5 +1,6 @@
 from __future__ import annotations
-import sys, random
+import argparse, os, sys, time
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
@@ -11,11 +12,21 @@ Noise Injector for Synthea CSVs
 - Skews timestamps to simulate late-arriving data
 - Emits duplicates for deduplication testing
 
+All injections are masked NumPy operations driven by one seeded
+numpy Generator, so output is deterministic for a given --seed and
+--chunk-rows; observations.csv is processed in chunks.
+
+Rate mode writes synthetic events_*.csv files (no Synthea / Java needed)
+into incoming/ at a target rows/sec, with the same noise, to soak-test
+the watcher.
+
 Usage:
-  python -m app.noise_injector <synthea_csv_dir> <incoming_dir>
+  python -m app.noise_injector <synthea_csv_dir> <incoming_dir> [--seed 42] [--chunk-rows 1000000]
+  python -m app.noise_injector rate <incoming_dir> --rows-per-sec 5000 [--file-rows 1000] [--duration 60]
 """
 
-RAND = random.Random(42)
+SEED = 42
+CHUNK_ROWS = 1_000_000
 
 LAB_MAP = {
     "GLUCOSE": {"loinc": ["2345-7", "2339-0"], "outliers": (20, 600)},
@@ -25,86 +36,137 @@ LAB_MAP = {
     "HEMOGLOBIN": {"loinc": ["718-7"], "outliers": (3.0, 23.0)},
 }
 
-def _inject_missing(series: pd.Series, frac: float):
+def _pick(rng: np.random.Generator, pool: np.ndarray | int, frac: float, of: int | None = None) -> np.ndarray:
+    """Positions for max(1, frac * of) injections drawn without replacement from pool."""
+    n = pool if isinstance(pool, int) else len(pool)
+    if n == 0:
+        return np.empty(0, dtype="int64")
+    k = min(n, max(1, int((n if of is None else of) * frac)))
+    pos = rng.choice(n, size=k, replace=False)
+    return pos if isinstance(pool, int) else pool[pos]
+
+def _inject_missing(series: pd.Series, frac: float, rng: np.random.Generator) -> pd.Series:
     """Randomly replace a fraction of values with None"""
-    if len(series) == 0: 
+    if len(series) == 0:
         return series
-    k = max(1, int(len(series) * frac))
-    idx = RAND.sample(list(series.index), k=k)
-    series.loc[idx] = None
-    return series
+    vals = series.to_numpy(dtype=object, copy=True)
+    vals[_pick(rng, len(series), frac)] = None
+    return pd.Series(vals, index=series.index, name=series.name)
 
-def _perturb_numeric(series: pd.Series, frac_outliers: float, lo: float, hi: float):
+def _perturb_numeric(series: pd.Series, frac_outliers: float, lo: float, hi: float,
+                     rng: np.random.Generator) -> pd.Series:
     """Replace a fraction of numeric values with extreme outliers"""
-    idx_pool = list(series.dropna().index)
-    if not idx_pool: 
-        return series
-    k = max(1, int(len(series) * frac_outliers))
-    for i in RAND.sample(idx_pool, k=k):
-        series.loc[i] = lo + RAND.random() * (hi - lo)
-    return series
+    vals = pd.to_numeric(series, errors="coerce").to_numpy(dtype="float64", copy=True)
+    pos = _pick(rng, np.flatnonzero(~np.isnan(vals)), frac_outliers, of=len(vals))
+    vals[pos] = lo + rng.random(len(pos)) * (hi - lo)
+    return pd.Series(vals, index=series.index, name=series.name)
 
-def _maybe_swap_bp(df: pd.DataFrame, frac: float = 0.02):
+def _maybe_swap_bp(df: pd.DataFrame, rng: np.random.Generator, frac: float = 0.02,
+                   sys_c: str | None = None, dia_c: str | None = None) -> pd.DataFrame:
     """Swap systolic/diastolic in a fraction of rows"""
-    cols = {c.lower(): c for c in df.columns}
-    if not {"systolic", "diastolic"}.issubset(set(cols)):
+    if sys_c is None:
+        cols = {c.lower(): c for c in df.columns}
+        if not {"systolic", "diastolic"}.issubset(set(cols)):
+            return df
+        sys_c, dia_c = cols["systolic"], cols["diastolic"]
+    if len(df) == 0:
         return df
-    sys_c, dia_c = cols["systolic"], cols["diastolic"]
-    k = max(1, int(len(df) * frac))
-    for i in RAND.sample(range(len(df)), k=k):
-        s, d = df.loc[i, [sys_c, dia_c]]
-        df.loc[i, [sys_c, dia_c]] = [d, s]
+    pos = _pick(rng, len(df), frac)
+    s, d = df[sys_c].to_numpy(copy=True), df[dia_c].to_numpy(copy=True)
+    s[pos], d[pos] = d[pos], s[pos].copy()
+    df[sys_c], df[dia_c] = s, d
     return df
 
-def _skew_timestamps(df: pd.DataFrame, time_col: str, frac: float = 0.03):
-    """Shift timestamps backwards by random minutes"""
-    if time_col not in df: 
+def _skew_timestamps(df: pd.DataFrame, time_col: str, rng: np.random.Generator, frac: float = 0.03,
+                     fmt: str | None = None) -> pd.DataFrame:
+    """Shift timestamps backwards by random minutes (written back as ISO 8601, or fmt)"""
+    if time_col not in df or len(df) == 0:
         return df
-    k = max(1, int(len(df) * frac))
-    for i in RAND.sample(list(df.index), k=k):
-        try:
-            ts = pd.to_datetime(df.loc[i, time_col])
-            df.loc[i, time_col] = (ts - pd.Timedelta(minutes=RAND.randint(1, 180))).isoformat()
-        except Exception:
-            pass
+    pos = _pick(rng, len(df), frac)
+    vals = df[time_col].to_numpy(dtype=object, copy=True)
+    ts = pd.to_datetime(pd.Series(vals[pos]), errors="coerce", format="mixed")
+    shifted = ts - pd.to_timedelta(rng.integers(1, 181, len(pos)), unit="min")
+    ok = shifted.notna().to_numpy()  # unparseable values are left as they were
+    shifted = shifted[ok].dt.strftime(fmt) if fmt else shifted[ok].map(pd.Timestamp.isoformat)
+    vals[pos[ok]] = shifted.to_numpy(dtype=object)
+    df[time_col] = vals
     return df
 
+def _stamp() -> str:
+    return pd.Timestamp.now().strftime('%Y%m%d_%H%M%S_%f')
+
 def _write_with_stamp(df: pd.DataFrame, dest_dir: Path, base: str):
-    """Write a CSV with timestamp in filename"""
+    """Write a CSV with timestamp in filename (temp name first, so watchers never see it half-written)"""
     dest_dir.mkdir(parents=True, exist_ok=True)
-    out = dest_dir / f"{base}_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S_%f')}.csv"
-    df.to_csv(out, index=False)
+    out = dest_dir / f"{base}_{_stamp()}.csv"
+    tmp = dest_dir / f".{out.name}.tmp"
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, out)
     return out
 
-def process(src_dir: Path, incoming_dir: Path):
+class _ChunkWriter:
+    """One stamped CSV built from many chunks; renamed into place on close."""
+
+    def __init__(self, dest_dir: Path, base: str):
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        self.out = dest_dir / f"{base}_{_stamp()}.csv"
+        self.tmp = dest_dir / f".{self.out.name}.tmp"
+        self.started = False
+
+    def write(self, df: pd.DataFrame):
+        df.to_csv(self.tmp, mode="a" if self.started else "w", header=not self.started, index=False)
+        self.started = True
+
+    def close(self):
+        if self.tmp.exists():
+            os.replace(self.tmp, self.out)
+        return self.out
+
+def _noisy_observations(o: pd.DataFrame, rng: np.random.Generator) -> pd.DataFrame:
+    for col in [c for c in ["VALUE", "UNITS"] if c in o.columns]:
+        o[col] = _inject_missing(o[col], 0.02, rng)
+    if "CODE" in o.columns and "VALUE" in o.columns:
+        code = o["CODE"].astype(str)
+        value = o["VALUE"].to_numpy(dtype=object, copy=True)
+        for spec in LAB_MAP.values():
+            mask = code.isin(spec["loinc"]).to_numpy()
+            if mask.any():
+                sub = _perturb_numeric(pd.Series(value[mask]), 0.01, *spec["outliers"], rng)  # 1% outliers
+                changed = sub.notna().to_numpy()
+                idx = np.flatnonzero(mask)[changed]
+                value[idx] = sub.to_numpy()[changed]
+        o["VALUE"] = value
+    return o
+
+def process(src_dir: Path, incoming_dir: Path, seed: int = SEED, chunk_rows: int = CHUNK_ROWS):
+    rng = np.random.default_rng(seed)
+
     # Patients
     p = pd.read_csv(src_dir / "patients.csv")
     if "ZIP" in p.columns:
-        p["ZIP"] = _inject_missing(p["ZIP"], 0.03)
+        p["ZIP"] = _inject_missing(p["ZIP"], 0.03, rng)
     if "BIRTHDATE" in p.columns:
-        p["BIRTHDATE"] = _inject_missing(p["BIRTHDATE"], 0.01)
+        p["BIRTHDATE"] = _inject_missing(p["BIRTHDATE"], 0.01, rng)
     _write_with_stamp(p, incoming_dir, "patients")
 
     # Encounters
     e = pd.read_csv(src_dir / "encounters.csv")
     for col in ["START", "STOP", "DATE"]:
         if col in e.columns:
-            e = _skew_timestamps(e, col, 0.05)
+            e = _skew_timestamps(e, col, rng, 0.05)
     _write_with_stamp(e, incoming_dir, "encounters")
 
-    # Observations (labs & vitals)
-    o = pd.read_csv(src_dir / "observations.csv")
-    for col in [c for c in ["VALUE", "UNITS"] if c in o.columns]:
-        o[col] = _inject_missing(o[col], 0.02)
-    if "CODE" in o.columns and "VALUE" in o.columns:
-        o_numeric = pd.to_numeric(o["VALUE"], errors="coerce")
-        for spec in LAB_MAP.values():
-            mask = o["CODE"].astype(str).isin(spec["loinc"]).values
-            if mask.any():
-                sub = o_numeric[mask].copy()
-                _perturb_numeric(sub, 0.01, *spec["outliers"])  # 1% outliers
-                o.loc[sub.index, "VALUE"] = sub
-    _write_with_stamp(o, incoming_dir, "observations")
+    # Observations (labs & vitals), the big one: streamed in chunks.
+    # Duplicates for dedup testing are sampled per chunk as it goes.
+    obs = _ChunkWriter(incoming_dir, "observations")
+    dup = _ChunkWriter(incoming_dir, "observations_dup")
+    for o in pd.read_csv(src_dir / "observations.csv", chunksize=chunk_rows):
+        o = _noisy_observations(o, rng)
+        obs.write(o)
+        if len(o):
+            dup.write(o.iloc[np.sort(rng.choice(len(o), size=int(round(len(o) * 0.02)), replace=False))])
+    obs.close()
+    dup.close()
 
     # Optional vitals CSV
     for candidate in ["vital_signs.csv", "vitals.csv"]:
@@ -113,25 +175,72 @@ def process(src_dir: Path, incoming_dir: Path):
             v = pd.read_csv(vpath)
             for c in ["heart_rate", "systolic", "diastolic", "respiratory_rate", "temperature"]:
                 if c in v.columns:
-                    v[c] = _inject_missing(v[c], 0.02)
-            v = _maybe_swap_bp(v, 0.02)
+                    v[c] = _inject_missing(v[c], 0.02, rng)
+            v = _maybe_swap_bp(v, rng, 0.02)
             _write_with_stamp(v, incoming_dir, Path(candidate).stem)
             break
 
-    # Duplicates for dedup testing
-    if len(o) > 0:
-        dup = o.sample(frac=0.02, random_state=RAND.randint(0, 99999))
-        _write_with_stamp(dup, incoming_dir, "observations_dup")
+def noisy_events(rows: int, rng: np.random.Generator, **gen) -> pd.DataFrame:
+    """Pipeline-shaped events (bench.synthetic_events) with the injector's noise applied."""
+    from .bench import synthetic_events
+    df = synthetic_events(rows, seed=int(rng.integers(2**31)), **gen)
+    df["zip"] = _inject_missing(df["zip"], 0.03, rng)
+    df["dob"] = _inject_missing(df["dob"], 0.01, rng)
+    df = _maybe_swap_bp(df, rng, 0.02, "systolic_bp", "diastolic_bp")
+    return _skew_timestamps(df, "event_ts", rng, 0.03, fmt="%Y-%m-%d %H:%M:%S")
+
+def emit_at_rate(incoming_dir: Path, rows_per_sec: float, file_rows: int = 1000,
+                 duration: float | None = None, max_files: int | None = None, seed: int = SEED, **gen) -> int:
+    """Write events_*.csv files of file_rows rows into incoming_dir, paced to rows_per_sec.
+    Runs until duration seconds / max_files files (forever if neither). Returns files written."""
+    rng = np.random.default_rng(seed)
+    start = time.monotonic()
+    files = 0
+    while (max_files is None or files < max_files) and (duration is None or time.monotonic() - start < duration):
+        df = noisy_events(file_rows, rng, start_id=files * file_rows, **gen)
+        due = start + files * file_rows / rows_per_sec
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        _write_with_stamp(df, incoming_dir, "events")
+        files += 1
+        if files % 100 == 0:
+            elapsed = time.monotonic() - start
+            print(f"{files} files, {files * file_rows / elapsed:,.0f} rows/sec")
+    return files
+
+def rate_main(argv):
+    ap = argparse.ArgumentParser(prog="python -m app.noise_injector rate")
+    ap.add_argument("incoming_dir")
+    ap.add_argument("--rows-per-sec", type=float, required=True)
+    ap.add_argument("--file-rows", type=int, default=1000)
+    ap.add_argument("--duration", type=float, default=None, help="seconds; default runs until Ctrl+C")
+    ap.add_argument("--max-files", type=int, default=None)
+    ap.add_argument("--patients", type=int, default=None)
+    ap.add_argument("--outlier-rate", type=float, default=0.01)
+    ap.add_argument("--seed", type=int, default=SEED)
+    args = ap.parse_args(argv)
+    try:
+        n = emit_at_rate(Path(args.incoming_dir), args.rows_per_sec, args.file_rows, args.duration,
+                         args.max_files, args.seed, patients=args.patients, outlier_rate=args.outlier_rate)
+    except KeyboardInterrupt:
+        return
+    print(f"Wrote {n} files")
 
 def main():
-    if len(sys.argv) < 3:
-        print("Usage: python -m app.noise_injector <synthea_csv_dir> <incoming_dir>")
-        sys.exit(1)
-    src = Path(sys.argv[1])
-    dest = Path(sys.argv[2])
+    if len(sys.argv) > 1 and sys.argv[1] == "rate":
+        return rate_main(sys.argv[2:])
+    ap = argparse.ArgumentParser(prog="python -m app.noise_injector")
+    ap.add_argument("synthea_csv_dir")
+    ap.add_argument("incoming_dir")
+    ap.add_argument("--seed", type=int, default=SEED)
+    ap.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = ap.parse_args()
+    src = Path(args.synthea_csv_dir)
+    dest = Path(args.incoming_dir)
     if not src.exists():
         raise FileNotFoundError(src)
-    process(src, dest)
+    process(src, dest, args.seed, args.chunk_rows)
 
 if __name__ == "__main__":
     main()
@@ -1,29 +1,54 @@
 ## app/pipeline.py
 
 from __future__ import annotations
-import os
+import os, time
+import numpy as np
 import pandas as pd
-from .utils import logger, load_yaml
-from . import deid, qc
-from .alerts import send_email, send_slack
-from .sinks import to_parquet, to_sqlite, powerbi_push
+from .utils import logger
+from .plan import PipelinePlan, as_plan, load_plan
+from . import alerts, baseline, dedup, deid, ingest, metrics, qc, quarantine, rollup
+from .instrument import Trace, profiled
 
+try:  # engine: arrow
+    import pyarrow as pa
+    from . import arrow_engine
+except ImportError:
+    arrow_engine = None
+from .sinks import SinkTxn
+from .sketch import KLLSketch
 
-def read_input(path: str, cfg: dict) -> pd.DataFrame:
-    fmt = cfg.get("input_format", "csv")
-    if fmt == "jsonl":
+
+def read_input(path: str, plan: PipelinePlan) -> pd.DataFrame:
+    plan = as_plan(plan)
+    df = ingest.read_frame(path, plan)
+    if df is not None:
+        return df
+    if plan.input_format == "jsonl":
         return pd.read_json(path, lines=True)
     return pd.read_csv(path)
 
 
-def enforce_schema(df: pd.DataFrame, cfg: dict) -> pd.DataFrame:
-    req = set(cfg["schema"]["required_columns"]) if cfg.get("schema") else set()
-    missing = req - set(df.columns)
+def _typed(s: pd.Series, t: str) -> bool:
+    """Column already holds type t (read by ingest.py), so enforce_schema leaves it alone."""
+    if t == "datetime":
+        return pd.api.types.is_datetime64_any_dtype(s)
+    if t == "float":
+        return pd.api.types.is_float_dtype(s)
+    if t == "string":
+        return isinstance(s.dtype, pd.CategoricalDtype) or pd.api.types.infer_dtype(s, skipna=True) in ("string", "empty")
+    if t == "date":
+        return pd.api.types.infer_dtype(s, skipna=True) in ("date", "empty")
+    return False
+
+
+def enforce_schema(df: pd.DataFrame, plan: PipelinePlan) -> pd.DataFrame:
+    plan = as_plan(plan)
+    cols = set(df.columns)
+    missing = plan.required - cols
     if missing:
         raise ValueError(f"Missing required columns: {sorted(missing)}")
-    types = cfg["schema"].get("types", {})
-    for col, t in types.items():
-        if col not in df.columns: continue
+    for col, t in plan.types:
+        if col not in cols or _typed(df[col], t): continue
         if t == "date":
             df[col] = pd.to_datetime(df[col], errors="coerce").dt.date
         elif t == "datetime":
@@ -35,54 +60,386 @@ def enforce_schema(df: pd.DataFrame, cfg: dict) -> pd.DataFrame:
     return df
 
 
-def clean(df: pd.DataFrame, cfg: dict) -> pd.DataFrame:
-    if "zip" in df.columns and cfg["cleaning"].get("zip_pad_left", True):
-        df["zip"] = df["zip"].astype(str).str.zfill(cfg["cleaning"].get("zip_length", 5))
-    df = qc.clip_ranges(df, cfg["cleaning"].get("clip_ranges", {}))
+def clean(df: pd.DataFrame, plan: PipelinePlan) -> pd.DataFrame:
+    plan = as_plan(plan)
+    if "zip" in df.columns and plan.zip_length is not None:
+        df["zip"] = df["zip"].astype(str).str.zfill(plan.zip_length)
+    df = qc.clip_ranges(df, plan.clip_bounds)
     return df
 
 
-def quality_checks(df: pd.DataFrame, cfg: dict) -> pd.DataFrame:
-    df = qc.outlier_flags(df, cfg)
+def quality_checks(df: pd.DataFrame, plan: PipelinePlan, bounds=None) -> pd.DataFrame:
+    if plan.baseline_path:
+        bounds = baseline.get_baseline(plan.baseline_path).bounds_for(df, plan, bounds)
+    df = qc.outlier_flags(df, plan, bounds)
     return df
 
 
-def sink(df: pd.DataFrame, cfg: dict):
-    sinks = cfg.get("sinks", {})
-    if sinks.get("parquet", {}).get("enabled"):
-        to_parquet(df, sinks["parquet"]["path"], sinks["parquet"].get("mode", "append"))
-    if sinks.get("sqlite", {}).get("enabled"):
-        to_sqlite(df, sinks["sqlite"]["uri"], sinks["sqlite"]["table"])
-    if sinks.get("powerbi_push", {}).get("enabled"):
-        url = os.getenv(sinks["powerbi_push"]["dataset_url_env"], "")
-        if url:
-            powerbi_push(df, url)
+def sink(df: pd.DataFrame, cfg: dict, sources=()):
+    txn = SinkTxn(cfg, sources)
+    try:
+        txn.write(df)
+        txn.commit()
+    except Exception:
+        txn.abort()
+        raise
+
 
+def transform_frame(df: pd.DataFrame, plan: PipelinePlan, bounds=None, trace: Trace | None = None,
+                    row0: int = 0) -> pd.DataFrame:
+    """row0: file row of df's first row (streamed chunks), for the rows quarantine.rows rejects."""
+    trace = trace or Trace()
+    if not isinstance(df, pd.DataFrame):  # pyarrow.Table: engine: arrow
+        return arrow_engine.transform_table(df, plan, bounds, trace, row0)
+    with trace.stage("enforce_schema", df):
+        df = enforce_schema(df, plan)
+    with trace.stage("clean", df):
+        df = clean(df, plan)
+    with trace.stage("quality_checks", df):
+        qc_done = quality_checks(df, plan, bounds)
+    why = quarantine.reasons(qc_done, plan) if plan.reject_path else None
+    ts = dedup.event_ns(qc_done) if plan.dedup_path else None  # full precision, before de-ID truncates it
+    with trace.stage("apply_safe_harbor", qc_done):
+        masked = deid.apply_safe_harbor(qc_done, plan=plan)
+    if ts is not None:
+        with trace.stage("dedup_keys", masked):
+            masked = dedup.mark(masked, ts, plan)
+    if why is not None:
+        masked = quarantine.mark(masked, why, row0)
+    elif plan.outlier_action == "quarantine" and "outlier_mask" in masked and masked["outlier_mask"].any():
+        raise ValueError("Outliers detected; quarantining file per config")
+    return masked
 
-def process_file(path: str, cfg_path: str = "config.yaml"):
-    cfg = load_yaml(cfg_path)
+
+def read_file(path: str, plan: PipelinePlan, trace: Trace | None = None):
+    """The whole file: an Arrow table with engine: arrow when it parses as typed, else a DataFrame."""
+    trace = trace or Trace()
+    with trace.stage("read_input", bytes_in=os.path.getsize(path)) as st:
+        if path.endswith(".parquet"):  # a quarantine row file being replayed
+            df = quarantine.read(path)
+        else:
+            df = ingest.read_arrow(path, plan) if plan.engine == "arrow" else None
+        if df is None:
+            df = read_input(path, plan)
+        st.rows = len(df)
+    return df
+
+
+def transform(path: str, plan: PipelinePlan, trace: Trace | None = None) -> pd.DataFrame:
+    """read → enforce_schema → clean → quality_checks → de-ID; no side effects, safe in a worker process."""
+    trace = trace or Trace()
+    return transform_frame(read_file(path, plan, trace), plan, trace=trace)
+
+
+def should_stream(path: str, plan: PipelinePlan) -> bool:
+    return (plan.stream_min_bytes is not None and not path.endswith(".parquet")
+            and os.path.getsize(path) >= plan.stream_min_bytes)
+
+
+def read_chunks(path: str, plan: PipelinePlan, usecols=None):
+    """DataFrame chunks; Arrow tables instead with engine: arrow (until a chunk needs the pandas reader)."""
+    typed = None
+    if usecols is None:
+        typed = ingest.iter_tables(path, plan) if plan.engine == "arrow" else ingest.iter_frames(path, plan)
+    if typed is not None:
+        yield from typed
+    elif plan.input_format == "jsonl":
+        for chunk in pd.read_json(path, lines=True, chunksize=plan.stream_chunk_rows):
+            yield chunk if usecols is None else chunk[[c for c in usecols if c in chunk.columns]]
+    else:
+        yield from pd.read_csv(path, chunksize=plan.stream_chunk_rows, usecols=usecols)
+
+
+def outlier_bounds(path: str, plan: PipelinePlan) -> dict:
+    """First streaming pass: per-file outlier limits from quantile sketches of the clipped vitals."""
+    if plan.input_format == "jsonl":
+        usecols = list(plan.outlier_cols)
+    else:
+        header = pd.read_csv(path, nrows=0).columns
+        usecols = [c for c in plan.outlier_cols if c in header]
+    sketches = {c: KLLSketch() for c in usecols}
+    for chunk in read_chunks(path, plan, usecols):
+        chunk = qc.clip_ranges(chunk, plan.clip_bounds)
+        for c, sk in sketches.items():
+            if c in chunk:
+                sk.update(pd.to_numeric(chunk[c], errors="coerce").to_numpy(dtype="float64", na_value=float("nan")))
+    return {c: qc.sketch_bounds(sk, plan.outlier_method, plan.outlier_param) for c, sk in sketches.items()}
+
+
+def _flagged(masked) -> int:
+    if isinstance(masked, pd.DataFrame):
+        return int((masked["outlier_mask"] != 0).sum()) if "outlier_mask" in masked else 0
+    if "outlier_mask" not in masked.column_names:
+        return 0
+    return int(np.count_nonzero(masked.column("outlier_mask").to_numpy()))
+
+
+def _baseline_frame(masked, plan: PipelinePlan) -> pd.DataFrame:
+    return masked if isinstance(masked, pd.DataFrame) else arrow_engine.baseline_frame(masked, plan)
+
+
+def _record_dedup(plan: PipelinePlan, keys, buckets):
+    try:
+        dedup.get_index(plan).add(keys, buckets)
+    except Exception as e:
+        # Same as the baseline: the file is committed, a missed index update only lets repeats through
+        logger.error(f"Dedup index update failed: {e}")
+
+
+def _record_commit(path: str, plan: PipelinePlan, rows: int, flagged: int, trace: Trace, dropped: int = 0,
+                   rejected: int = 0):
+    m = metrics.get_metrics(plan.metrics_path, plan.metrics_flush_seconds)
+    trace.emit(path, plan, m)
+    if m is None:
+        return
+    m.inc("files_ok")
+    m.inc("rows", rows)
+    m.inc("flagged_rows", flagged)
+    if plan.dedup_path:
+        m.inc("duplicates_dropped", dropped)
+    if plan.reject_path:
+        m.inc("rows_rejected", rejected)
+    m.set("last_commit_at", time.time())
+    m.flush()
+
+
+def stream_file(path: str, plan: PipelinePlan, trace: Trace | None = None) -> int:
+    """Process a large file chunk by chunk with bounded memory; commits or aborts as a whole."""
+    trace = trace or Trace(plan)
+    base = baseline.get_baseline(plan.baseline_path) if plan.baseline_path else None
+    if base is not None and base.covers(plan):
+        bounds = None
+    else:
+        with trace.stage("outlier_bounds", bytes_in=os.path.getsize(path)):
+            bounds = outlier_bounds(path, plan)
+    delta: dict = {}
+    flagged = dropped = row0 = 0
+    written = []  # dedup (keys, buckets) per chunk, indexed once the file commits
+    rejected = []  # quarantine.rows (rows, reasons) per chunk, written just before the commit
+    held = None
+    txn = SinkTxn(plan.cfg, [path])
+    try:
+        chunks = read_chunks(path, plan)
+        while True:
+            with trace.stage("read_input") as st:
+                chunk = next(chunks, None)
+                st.rows = 0 if chunk is None else len(chunk)
+            if chunk is None:
+                break
+            masked = transform_frame(chunk, plan, bounds, trace, row0)
+            row0 += len(chunk)
+            masked, rows, why = quarantine.split(masked)
+            if rows is not None:
+                rejected.append((rows, why))
+            if plan.dedup_path:
+                with trace.stage("dedup", masked):
+                    seen = np.concatenate([k for k, _ in written]) if written else None
+                    masked, keys, buckets, n = dedup.filter_new(masked, plan, seen)
+                written.append((keys, buckets))
+                dropped += n
+            flagged += _flagged(masked)
+            with trace.stage("sink", masked):
+                txn.write(masked)
+            if base is not None:
+                for key, sk in base.sketch_frame(_baseline_frame(masked, plan), plan).items():
+                    delta[key] = delta[key].merge(sk) if key in delta else sk
+        if rejected:
+            held = quarantine.write(path, np.concatenate([r for r, _ in rejected]),
+                                    np.concatenate([w for _, w in rejected]), plan)
+        with trace.stage("sink"):
+            txn.commit()
+    except Exception:
+        txn.abort()
+        quarantine.discard([held])
+        raise
+    if written:
+        _record_dedup(plan, np.concatenate([k for k, _ in written]), np.concatenate([b for _, b in written]))
+    if base is not None:
+        _record_baseline(plan, delta)
+    n_rejected = sum(len(r) for r, _ in rejected)
+    _record_commit(path, plan, txn.rows, flagged, trace, dropped, n_rejected)
+    logger.info(f"Processed OK (streamed): {path} -> {txn.rows} records" + _notes(dropped, n_rejected))
+    return txn.rows
+
+
+def transform_file(path: str, cfg_path: str = "config.yaml"):
+    """Worker entry point: (masked frame, stage records) for the committer."""
+    plan = load_plan(cfg_path)
+    trace = Trace(plan)
+    with profiled(plan, path):
+        masked = transform(path, plan, trace)
+    return masked, list(trace.records.values())
+
+
+def _record_baseline(plan: PipelinePlan, delta: dict):
     try:
-        raw = read_input(path, cfg)
-        raw = enforce_schema(raw, cfg)
-        raw = clean(raw, cfg)
-        qc_done = quality_checks(raw, cfg)
-        masked = deid.apply_safe_harbor(qc_done, cfg=cfg)
-        outlier_action = cfg["outliers"].get("action", "flag")
-        if outlier_action == "quarantine" and (masked.get("outlier_flags", "") != "").any():
-            raise ValueError("Outliers detected; quarantining file per config")
-        sink(masked, cfg)
-        logger.info(f"Processed OK: {path} -> {len(masked)} records")
+        baseline.record(plan, delta)
     except Exception as e:
-        logger.exception(f"Failed processing {path}: {e}")
-        base = os.path.basename(path)
-        qpath = os.path.join("quarantine", base)
+        # The file is already committed; a missed baseline update must not quarantine it
+        logger.error(f"Outlier baseline update failed: {e}")
+
+
+def _notes(dropped: int, rejected: int) -> str:
+    notes = ([f"{dropped} duplicates dropped"] if dropped else []) + ([f"{rejected} rows quarantined"] if rejected else [])
+    return f" ({', '.join(notes)})" if notes else ""
+
+
+def commit(path: str, masked, plan: PipelinePlan, trace: Trace | None = None):
+    trace = trace or Trace(plan)
+    dropped = 0
+    masked, rows, why = quarantine.split(masked)
+    if plan.dedup_path:
+        with trace.stage("dedup", masked):
+            masked, keys, buckets, dropped = dedup.filter_new(masked, plan)
+    held = quarantine.write(path, rows, why, plan)
+    try:
+        with trace.stage("sink", masked):
+            sink(masked, plan.cfg, [path])
+    except Exception:
+        quarantine.discard([held])
+        raise
+    if plan.dedup_path:
+        _record_dedup(plan, keys, buckets)
+    if plan.baseline_path:
+        _record_baseline(plan, baseline.get_baseline(plan.baseline_path).sketch_frame(_baseline_frame(masked, plan), plan))
+    rejected = 0 if rows is None else len(rows)
+    _record_commit(path, plan, len(masked), _flagged(masked), trace, dropped, rejected)
+    logger.info(f"Processed OK: {path} -> {len(masked)} records" + _notes(dropped, rejected))
+
+
+def _concat(frames: list):
+    if len(frames) == 1:
+        return frames[0]
+    if all(isinstance(f, pd.DataFrame) for f in frames):
+        return pd.concat(frames, ignore_index=True)
+    if not any(isinstance(f, pd.DataFrame) for f in frames):
+        return pa.concat_tables(frames, promote_options="default")
+    return pd.concat([f if isinstance(f, pd.DataFrame) else f.to_pandas() for f in frames], ignore_index=True)
+
+
+def _sink_group(items: list, plan: PipelinePlan):
+    """items: [(path, masked, trace)] in one sink transaction; what the bookkeeping needs after it."""
+    written, done, held = [], [], []
+    try:
+        for path, masked, trace in items:
+            dropped = 0
+            masked, rows, why = quarantine.split(masked)
+            if plan.dedup_path:
+                with trace.stage("dedup", masked):
+                    seen = np.concatenate([k for k, _ in written]) if written else None
+                    masked, keys, buckets, dropped = dedup.filter_new(masked, plan, seen)
+                written.append((keys, buckets))
+            held.append(quarantine.write(path, rows, why, plan))
+            done.append((path, masked, trace, dropped, 0 if rows is None else len(rows)))
+        batch = _concat([d[1] for d in done])
+        trace = Trace(plan)
+        with trace.stage("sink", batch):
+            sink(batch, plan.cfg, [d[0] for d in done])
+    except Exception:
+        quarantine.discard(held)
+        raise
+    return batch, written, done, trace
+
+
+def _record_group(plan: PipelinePlan, batch, written: list, done: list, trace: Trace):
+    if written:
+        _record_dedup(plan, np.concatenate([k for k, _ in written]), np.concatenate([b for _, b in written]))
+    if plan.baseline_path:
+        _record_baseline(plan, baseline.get_baseline(plan.baseline_path).sketch_frame(_baseline_frame(batch, plan), plan))
+    trace.emit(f"<batch of {len(done)} files>", plan, metrics.get_metrics(plan.metrics_path, plan.metrics_flush_seconds),
+               files=[d[0] for d in done])
+    for path, masked, t, dropped, rejected in done:
+        _record_commit(path, plan, len(masked), _flagged(masked), t, dropped, rejected)
+        logger.info(f"Processed OK (batched): {path} -> {len(masked)} records" + _notes(dropped, rejected))
+
+
+def commit_batch(items: list, plan: PipelinePlan) -> dict:
+    """Commit transformed files [(path, masked, trace)] together, up to batch_max_rows rows per sink write.
+
+    Returns {path: None, or the exception to quarantine it with}.  When a shared
+    write fails, that group is retried file by file, so only the file the sinks
+    reject is quarantined.
+    """
+    errors: dict = {}
+    group, rows = [], 0
+    for i, item in enumerate(items):
+        group.append(item)
+        rows += len(item[1])
+        if rows < plan.batch_max_rows and i + 1 < len(items):
+            continue
+        try:
+            state = _sink_group(group, plan)
+        except Exception as e:
+            if len(group) > 1:
+                logger.warning(f"Batch write of {len(group)} files failed ({e}); committing them one by one")
+            for path, masked, trace in group:
+                try:
+                    commit(path, masked, plan, trace)
+                    errors[path] = None
+                except Exception as e1:
+                    errors[path] = e1
+        else:
+            _record_group(plan, *state)
+            errors.update((path, None) for path, _, _ in group)
+        group, rows = [], 0
+    return errors
+
+
+def process_batch(paths: list, cfg_path: str = "config.yaml") -> dict:
+    """watcher.batch: transform each file, commit them together; {path: ok}.
+
+    Transforms are per file, so a file that fails to parse or validate is
+    quarantined alone and the rest of the batch still commits.
+    """
+    plan = load_plan(cfg_path)
+    items, results = [], {}
+    for path in paths:
+        trace = Trace(plan)
         try:
+            with profiled(plan, path):
+                items.append((path, transform(path, plan, trace), trace))
+        except Exception as e:
+            fail(path, e, plan)
+            results[path] = False
+    for path, err in commit_batch(items, plan).items():
+        if err is not None:
+            fail(path, err, plan)
+        results[path] = err is None
+    return results
+
+
+def fail(path: str, e: BaseException, plan: PipelinePlan | None = None):
+    logger.error(f"Failed processing {path}: {e}", exc_info=e)
+    base = os.path.basename(path)
+    qpath = os.path.join("quarantine", base)
+    try:
+        if not os.path.abspath(path).startswith(os.path.abspath("quarantine") + os.sep):  # replays stay put
             import shutil; shutil.move(path, qpath)
-        except Exception:
-            pass
-        send_email("ETL Failure", f"File: {path}\nError: {e}")
-        send_slack(f":rotating_light: ETL failure for {path}: {e}")
+    except Exception:
+        pass
+    if plan is not None:
+        rollup.quarantined(plan.cfg)
+    m = metrics.get_metrics(plan.metrics_path, plan.metrics_flush_seconds) if plan is not None else None
+    if m is not None:
+        m.inc("files_failed")
+        m.set("last_failure_at", time.time())
+        m.flush()
+    # Queued only; delivery (and digesting of repeats) happens on the alert thread
+    alerts.notify(path, e, plan.cfg.get("alerts") if plan is not None else None)
+
+
+def process_file(path: str, cfg_path: str = "config.yaml"):
+    plan = load_plan(cfg_path)
+    trace = Trace(plan)
+    try:
+        with profiled(plan, path):
+            if should_stream(path, plan):
+                stream_file(path, plan, trace)
+            else:
+                masked = transform(path, plan, trace)
+                commit(path, masked, plan, trace)
+    except Exception as e:
+        fail(path, e, plan)
         return False
     else:
         return True
-
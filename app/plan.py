@@ -0,0 +1,167 @@
+## app/plan.py
+
+from __future__ import annotations
+import os
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Optional, Tuple, Union
+from .utils import logger, load_env, load_yaml
+
+VITALS = ("systolic_bp", "diastolic_bp", "heart_rate")
+
+
+@dataclass(frozen=True)
+class PipelinePlan:
+    """config.yaml compiled once into the values each stage needs.
+
+    Stages read these attributes instead of walking the raw cfg dict per file.
+    """
+    cfg: dict = field(repr=False)
+    input_format: str = "csv"
+    engine: str = "pandas"                   # pandas | arrow (transforms on pyarrow Tables, arrow_engine.py)
+    required: FrozenSet[str] = frozenset()
+    types: Tuple[Tuple[str, str], ...] = ()
+    reader: str = "arrow"                    # arrow (typed parse, see ingest.py) | pandas
+    ts_formats: Tuple[str, ...] = ("ISO8601",)
+    dictionary_cols: FrozenSet[str] = frozenset()
+    zip_length: Optional[int] = 5            # None = no left padding
+    clip_bounds: Tuple[Tuple[str, float, float], ...] = ()
+    outlier_method: str = "iqr"
+    outlier_param: float = 1.5               # iqr_multiplier or mad_threshold
+    outlier_cols: Tuple[str, ...] = VITALS
+    outlier_action: str = "flag"
+    flag_strings: bool = True                # also emit the legacy outlier_flags text column
+    baseline_path: Optional[str] = None      # None = per-file thresholds only
+    baseline_group_by: Tuple[str, ...] = ()
+    baseline_min_count: int = 1000
+    baseline_checkpoint_every: int = 10
+    salt: str = field(default="", repr=False)
+    id_col: str = "patient_id"
+    dob_year: bool = False
+    event_date: bool = False
+    zip3: bool = True
+    drop_cols: FrozenSet[str] = frozenset()
+    key_cache_size: int = 1_000_000
+    stream_min_bytes: Optional[int] = None   # None = never stream
+    stream_chunk_rows: int = 200_000
+    batch_enabled: bool = False              # watcher.batch: coalesce small files into one commit
+    batch_max_rows: int = 500_000
+    batch_max_bytes: int = 64 * 2**20
+    batch_max_wait: float = 2.0              # seconds the first file of a batch may wait for more
+    metrics_path: Optional[str] = None       # None = no metrics snapshot
+    metrics_flush_seconds: float = 1.0
+    trace_path: Optional[str] = None         # None = timings for metrics only, no per-stage JSONL
+    trace_memory: str = "rss"                # rss | tracemalloc | off
+    profile_rate: float = 0.0                # fraction of files run under a profiler
+    profiler: str = "cprofile"               # cprofile | pyinstrument
+    profile_dir: str = os.path.join("logs", "profiles")
+    dedup_path: Optional[str] = None         # None = no cross-file deduplication
+    dedup_cols: Tuple[str, ...] = VITALS     # hashed with patient_key and the full event_ts
+    dedup_ttl_days: float = 30.0
+    dedup_partition_days: int = 7
+    dedup_bloom_bits: int = 10
+    dedup_max_delta_keys: int = 2_000_000
+    reject_path: Optional[str] = None        # quarantine.rows: failing rows to Parquet, the rest commits
+
+    @classmethod
+    def compile(cls, cfg: dict) -> "PipelinePlan":
+        load_env()
+        schema = cfg.get("schema") or {}
+        cleaning = cfg.get("cleaning", {})
+        outliers = cfg.get("outliers", {})
+        baseline = outliers.get("baseline", {})
+        hipaa = cfg["hipaa_safe_harbor"]
+        streaming = cfg.get("streaming", {})
+        batch = (cfg.get("watcher") or {}).get("batch", {})
+        metrics = cfg.get("metrics", {})
+        instr = cfg.get("instrumentation", {})
+        dedup = cfg.get("dedup", {})
+        outlier_cols = tuple(outliers.get("columns", VITALS))
+        if len(outlier_cols) > 8:  # outlier_mask is a uint8, one bit per column
+            raise ValueError(f"outliers.columns: at most 8 columns fit in outlier_mask, got {len(outlier_cols)}")
+        quarantine = cfg.get("quarantine", {})
+        dates = hipaa.get("dates", {})
+        method = outliers.get("method", "iqr")
+        id_col = hipaa["hash_id_column"]
+        return cls(
+            cfg=cfg,
+            input_format=cfg.get("input_format", "csv"),
+            engine=cfg.get("engine", "pandas"),
+            required=frozenset(schema.get("required_columns", [])),
+            types=tuple(schema.get("types", {}).items()),
+            reader=schema.get("reader", "arrow"),
+            ts_formats=tuple(schema.get("timestamp_formats", ["%Y-%m-%d %H:%M:%S", "ISO8601"])),
+            dictionary_cols=frozenset(schema.get("dictionary_columns", ["zip", "first_name", "last_name"])),
+            zip_length=cleaning.get("zip_length", 5) if cleaning.get("zip_pad_left", True) else None,
+            clip_bounds=tuple((c, float(lo), float(hi)) for c, (lo, hi) in cleaning.get("clip_ranges", {}).items()),
+            outlier_method=method,
+            outlier_param=float(outliers.get("mad_threshold", 6.0) if method == "mad"
+                                else outliers.get("iqr_multiplier", 1.5)),
+            outlier_cols=outlier_cols,
+            outlier_action=outliers.get("action", "flag"),
+            flag_strings=outliers.get("flag_strings", True),
+            baseline_path=(baseline.get("path", os.path.join("logs", "outlier_baseline.json"))
+                           if baseline.get("enabled", False) else None),
+            baseline_group_by=tuple(baseline.get("group_by", [])),
+            baseline_min_count=int(baseline.get("min_count", 1000)),
+            baseline_checkpoint_every=int(baseline.get("checkpoint_every", 10)),
+            salt=os.getenv(hipaa["hash_salt_env"], ""),
+            id_col=id_col,
+            dob_year=dates.get("dob") == "year_only",
+            event_date=dates.get("event_ts") == "date_only",
+            zip3=hipaa.get("zip_truncate_to_3", True),
+            drop_cols=frozenset(hipaa.get("remove", [])) | {id_col, "dob", "zip", "event_ts"},
+            key_cache_size=int(hipaa.get("key_cache_size", 1_000_000)),
+            stream_min_bytes=(int(streaming.get("min_file_mb", 256) * 2**20)
+                              if streaming.get("enabled", False) else None),
+            stream_chunk_rows=int(streaming.get("chunk_rows", 200_000)),
+            batch_enabled=batch.get("enabled", False),
+            batch_max_rows=int(batch.get("max_rows", 500_000)),
+            batch_max_bytes=int(batch.get("max_mb", 64) * 2**20),
+            batch_max_wait=float(batch.get("max_wait_seconds", 2.0)),
+            metrics_path=(metrics.get("path", os.path.join("logs", "metrics.json"))
+                          if metrics.get("enabled", True) else None),
+            metrics_flush_seconds=float(metrics.get("flush_seconds", 1.0)),
+            trace_path=(instr.get("path", os.path.join("logs", "stages.jsonl"))
+                        if instr.get("enabled", False) else None),
+            trace_memory=instr.get("memory", "rss"),
+            profile_rate=float(instr.get("profile_sample_rate", 0.0)),
+            profiler=instr.get("profiler", "cprofile"),
+            profile_dir=instr.get("profile_dir", os.path.join("logs", "profiles")),
+            dedup_path=(dedup.get("path", os.path.join("logs", "dedup_index"))
+                        if dedup.get("enabled", False) else None),
+            dedup_cols=tuple(dedup.get("columns", VITALS)),
+            dedup_ttl_days=float(dedup.get("ttl_days", 30)),
+            dedup_partition_days=int(dedup.get("partition_days", 7)),
+            dedup_bloom_bits=int(dedup.get("bloom_bits_per_key", 10)),
+            dedup_max_delta_keys=int(dedup.get("max_delta_keys", 2_000_000)),
+            reject_path=(quarantine.get("path", os.path.join("quarantine", "rows"))
+                         if quarantine.get("rows", False) else None),
+        )
+
+
+def as_plan(cfg: Union[dict, PipelinePlan]) -> PipelinePlan:
+    return cfg if isinstance(cfg, PipelinePlan) else PipelinePlan.compile(cfg)
+
+
+_cache: Dict[str, Tuple[float, PipelinePlan]] = {}
+
+
+def load_plan(cfg_path: str = "config.yaml") -> PipelinePlan:
+    """Compiled plan for cfg_path; recompiled only when the file's mtime changes."""
+    mtime = os.stat(cfg_path).st_mtime
+    hit = _cache.get(cfg_path)
+    if hit is not None and hit[0] == mtime:
+        return hit[1]
+    try:
+        plan = PipelinePlan.compile(load_yaml(cfg_path))
+    except Exception as e:
+        if hit is None:
+            raise
+        # Half-saved or broken edit: keep running on the last good plan
+        logger.error(f"Config reload failed for {cfg_path}, keeping previous plan: {e}")
+        _cache[cfg_path] = (mtime, hit[1])
+        return hit[1]
+    if hit is not None:
+        logger.info(f"Config changed, reloaded plan from {cfg_path}")
+    _cache[cfg_path] = (mtime, plan)
+    return plan
@@ -0,0 +1,141 @@
+## app/powerbi.py
+
+from __future__ import annotations
+import glob, os, time, uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, Optional
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from .utils import logger, retry, Retryable
+
+"""
+Power BI push-dataset client: rows are serialized straight to JSON in
+fixed-size chunks (never a full list of dicts), posted over one pooled
+session with bounded concurrency, retried with backoff that honours
+429 Retry-After, and spilled to disk when the endpoint stays down.
+Spilled chunks are re-sent, oldest first, before the next push; one the
+endpoint rejects (4xx) is moved to the spool's dead/ folder.
+"""
+
+MAX_ROWS_PER_POST = 10_000  # Power BI push datasets reject larger requests
+SPOOL_DIR = os.path.join("masked_out", "powerbi_spool")
+
+
+def iter_payloads(df: pd.DataFrame, chunk_rows: int = MAX_ROWS_PER_POST) -> Iterator[bytes]:
+    for start in range(0, len(df), chunk_rows):
+        part = df.iloc[start:start + chunk_rows]
+        yield b'{"rows":' + part.to_json(orient="records", date_format="iso").encode() + b"}"
+
+
+class PowerBIPusher:
+    def __init__(self, url: str, chunk_rows: int = MAX_ROWS_PER_POST, concurrency: int = 4,
+                 max_retries: int = 5, backoff_seconds: float = 1.0, timeout: float = 10.0,
+                 spool_dir: Optional[str] = SPOOL_DIR,
+                 down_seconds: float = 30.0):
+        self.url = url
+        self.down_seconds = down_seconds
+        self._down_until = 0.0
+        self.chunk_rows = min(chunk_rows, MAX_ROWS_PER_POST)
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.spool_dir = spool_dir or SPOOL_DIR  # always spill: an outage must not fail the pipeline
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._post = retry(times=max_retries, delay=backoff_seconds)(self._post_once)
+
+    def _post_once(self, body: bytes):
+        try:
+            r = self.session.post(self.url, data=body, timeout=self.timeout,
+                                  headers={"Content-Type": "application/json"})
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise Retryable(str(e))
+        if r.status_code == 429 or r.status_code >= 500:
+            after = r.headers.get("Retry-After")
+            raise Retryable(f"HTTP {r.status_code}", retry_after=float(after) if after and after.isdigit() else None)
+        r.raise_for_status()
+
+    def _send(self, body: bytes) -> bool:
+        if time.monotonic() < self._down_until:
+            self._spill(body, Retryable("endpoint marked down"))
+            return False
+        try:
+            self._post(body)
+            return True
+        except Retryable as e:
+            # Don't make every remaining chunk sit through the full backoff again
+            self._down_until = time.monotonic() + self.down_seconds
+            self._spill(body, e)
+            return False
+
+    def _spill(self, body: bytes, e: Exception):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        name = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}.json"
+        tmp = os.path.join(self.spool_dir, f".{name}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(body)
+        os.replace(tmp, os.path.join(self.spool_dir, name))
+        logger.warning(f"Power BI push failed ({e}); spilled chunk to {self.spool_dir}/{name}")
+
+    def flush_spool(self) -> int:
+        """Re-send spilled chunks oldest first; stops at the first one that still fails transiently."""
+        if not os.path.isdir(self.spool_dir) or time.monotonic() < self._down_until:
+            return 0
+        sent = 0
+        for path in sorted(glob.glob(os.path.join(self.spool_dir, "*.json"))):
+            with open(path, "rb") as f:
+                body = f.read()
+            try:
+                self._post(body)
+            except Retryable:
+                self._down_until = time.monotonic() + self.down_seconds
+                break
+            except requests.HTTPError as e:  # rejected for good: must not fail every later push
+                dead = os.path.join(self.spool_dir, "dead")
+                os.makedirs(dead, exist_ok=True)
+                os.replace(path, os.path.join(dead, os.path.basename(path)))
+                logger.error(f"Power BI rejected spilled chunk {os.path.basename(path)} ({e}); moved to {dead}")
+                continue
+            os.remove(path)
+            sent += 1
+        if sent:
+            logger.info(f"Re-sent {sent} spilled Power BI chunks")
+        return sent
+
+    def push(self, df: pd.DataFrame) -> Dict[str, int]:
+        """Send df; returns chunk counts. Only non-retryable (4xx) errors raise."""
+        self.flush_spool()
+        stats = {"sent": 0, "spilled": 0}
+        pending: deque = deque()
+        with ThreadPoolExecutor(self.concurrency) as ex:
+            for body in iter_payloads(df, self.chunk_rows):
+                # Bounded: at most 2x concurrency serialized chunks exist at once
+                if len(pending) >= 2 * self.concurrency:
+                    stats["sent" if pending.popleft().result() else "spilled"] += 1
+                pending.append(ex.submit(self._send, body))
+            for fut in pending:
+                stats["sent" if fut.result() else "spilled"] += 1
+        return stats
+
+
+_pushers: Dict[str, PowerBIPusher] = {}
+
+
+def get_pusher(url: str, cfg: Optional[dict] = None) -> PowerBIPusher:
+    """One pusher (and HTTP connection pool) per dataset URL for the life of the process."""
+    p = _pushers.get(url)
+    if p is None:
+        cfg = cfg or {}
+        p = PowerBIPusher(url,
+                          chunk_rows=cfg.get("chunk_rows", MAX_ROWS_PER_POST),
+                          concurrency=cfg.get("concurrency", 4),
+                          max_retries=cfg.get("max_retries", 5),
+                          backoff_seconds=cfg.get("backoff_seconds", 1.0),
+                          timeout=cfg.get("timeout", 10.0),
+                          spool_dir=cfg.get("spool_dir") or SPOOL_DIR,
+                          down_seconds=cfg.get("down_seconds", 30.0))
+        _pushers[url] = p
+    return p
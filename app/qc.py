@@ -1,12 +1,17 @@
 ## app/qc.py
 
 from __future__ import annotations
+import numpy as np
 import pandas as pd
-from typing import Dict, Tuple
+from typing import Dict, Iterable, Optional, Tuple, Union
+from .plan import as_plan
+from .sketch import KLLSketch
 
 
-def clip_ranges(df: pd.DataFrame, ranges: Dict[str, Tuple[float, float]]):
-    for col, (lo, hi) in ranges.items():
+def clip_ranges(df: pd.DataFrame, ranges: Union[Dict[str, Tuple[float, float]], Iterable[Tuple[str, float, float]]]):
+    """ranges: {col: (lo, hi)} or the (col, lo, hi) triples precompiled in PipelinePlan.clip_bounds."""
+    triples = [(c, *b) for c, b in ranges.items()] if isinstance(ranges, dict) else ranges
+    for col, lo, hi in triples:
         if col in df:
             df[col] = pd.to_numeric(df[col], errors="coerce")
             df.loc[df[col] < lo, col] = lo
@@ -30,21 +35,53 @@ def detect_outliers_mad(s: pd.Series, threshold: float = 6.0):
     return z > threshold
 
 
-def outlier_flags(df: pd.DataFrame, cfg: dict):
-    method = cfg["outliers"].get("method", "iqr")
-    flags = []
-    for col in [c for c in ("systolic_bp", "diastolic_bp", "heart_rate") if c in df.columns]:
+def sketch_bounds(sk: KLLSketch, method: str = "iqr", param: float = 1.5) -> Optional[Tuple[float, float]]:
+    """(lower, upper) outlier limits equivalent to detect_outliers_iqr/mad, from a sketch."""
+    if sk.n == 0:
+        return None
+    if method == "mad":
+        m = sk.quantile(0.5)
+        mad = sk.median_abs_deviation(m)
+        if mad == 0:
+            return None
+        half = param * mad / 0.6745
+        return m - half, m + half
+    q1, q3 = sk.quantile(0.25), sk.quantile(0.75)
+    iqr = q3 - q1
+    return q1 - param * iqr, q3 + param * iqr
+
+
+def flag_labels(cols) -> np.ndarray:
+    """Lookup table: outlier_mask value -> legacy comma-separated outlier_flags string."""
+    return np.array([",".join(f"flag_{c}" for i, c in enumerate(cols) if m >> i & 1)
+                     for m in range(2 ** len(cols))], dtype=object)
+
+
+def outlier_flags(df: pd.DataFrame, cfg, bounds: Optional[Dict[str, Optional[Tuple[float, float]]]] = None):
+    """Adds outlier_mask (bit i set = plan.outlier_cols[i] is an outlier) and, if
+    outliers.flag_strings is on, the legacy outlier_flags string column.
+
+    bounds: precomputed {col: (lo, hi)} limits (scalars, or per-row arrays) from a first
+    streaming pass or the long-run baseline; None = no flags for col; columns not in
+    bounds use per-frame stats.
+    """
+    plan = as_plan(cfg)
+    mask = None
+    for bit, col in enumerate(plan.outlier_cols):
+        if col not in df.columns:
+            continue
         s = pd.to_numeric(df[col], errors="coerce")
-        if method == "mad":
-            mask = detect_outliers_mad(s, cfg["outliers"].get("mad_threshold", 6.0))
+        if bounds is not None and col in bounds:
+            b = bounds[col]
+            hit = (s < b[0]) | (s > b[1]) if b else pd.Series(False, index=s.index)
+        elif plan.outlier_method == "mad":
+            hit = detect_outliers_mad(s, plan.outlier_param)
         else:
-            mask = detect_outliers_iqr(s, cfg["outliers"].get("iqr_multiplier", 1.5))
-        flags.append(mask.rename(f"flag_{col}"))
-    if flags:
-        F = pd.concat(flags, axis=1)
-        any_out = F.any(axis=1)
-        df["outlier_flags"] = (
-            F.apply(lambda r: ",".join([c for c, v in r.items() if v]), axis=1).where(any_out, "")
-        )
+            hit = detect_outliers_iqr(s, plan.outlier_param)
+        bits = hit.to_numpy(dtype=np.uint8) << np.uint8(bit)
+        mask = bits if mask is None else mask | bits
+    if mask is not None:
+        df["outlier_mask"] = mask
+        if plan.flag_strings:
+            df["outlier_flags"] = flag_labels(plan.outlier_cols)[mask]
     return df
-
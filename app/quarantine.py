@@ -0,0 +1,224 @@
+## app/quarantine.py
+
+from __future__ import annotations
+import argparse, glob, os, shutil, time
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from .utils import logger, configure_logging_from, ensure_dirs, load_yaml
+
+"""
+Row-level quarantine (quarantine.rows) and replay of quarantined data.
+
+With quarantine.rows enabled a row is rejected, instead of failing its file,
+when
+  missing:<col>   a required column is empty or did not parse as its type
+  outlier:<col>   outliers.action is quarantine and that vital is flagged
+(a row failing several checks gets them all, comma-separated).  The good
+rows go on to the sinks.  The rejected ones are copied verbatim from the
+source file -- every column a string, nothing de-identified, like a
+quarantined file -- to quarantine.path/<file>-<ms>.parquet, plus
+  _reason   the codes above
+  _source   the file the row came from
+  _row      its 0-based data row there
+  _quarantined_at   epoch seconds (so a replay that rejects the same rows
+                    again writes a file with new content)
+The row file is written just before the sinks commit and removed again if
+they fail, so rows are never both committed and quarantined.  Whole-file
+failures (unreadable file, missing column, sink error) still move the file
+to quarantine/.
+
+  python -m app.quarantine replay [--config config.yaml] [--workers N] [--files | --rows]
+
+reprocesses quarantined files and row files with the current config: in N
+worker processes (default watcher.workers), otherwise in batches of files
+sharing one commit.  Inputs whose SHA-256 the watcher's manifest already
+records as committed are skipped; replayed inputs move to
+quarantine/replayed/, and rows that still fail land in a new row file.
+"""
+
+HIDDEN = ("_reject", "_row")
+META = ("_reason", "_source", "_row", "_quarantined_at")
+
+
+def _names(df) -> List[str]:
+    return list(df.columns) if isinstance(df, pd.DataFrame) else df.column_names
+
+
+def _isnull(df, col: str) -> np.ndarray:
+    if isinstance(df, pd.DataFrame):
+        return df[col].isna().to_numpy()
+    import pyarrow.compute as pc
+    return pc.is_null(df.column(col), nan_is_null=True).to_numpy(zero_copy_only=False)
+
+
+def reasons(df, plan) -> Optional[np.ndarray]:
+    """Reason per row ('' = keep) once quality_checks ran; None when every row passes."""
+    names = set(_names(df))
+    checks = [(_isnull(df, c), f"missing:{c}") for c in sorted(plan.required & names)]
+    if plan.outlier_action == "quarantine" and "outlier_mask" in names:
+        mask = np.asarray(df["outlier_mask"]).astype("int64")
+        checks += [(((mask >> bit) & 1).astype(bool), f"outlier:{c}") for bit, c in enumerate(plan.outlier_cols)]
+    out = None
+    for hit, code in checks:
+        if not hit.any():
+            continue
+        if out is None:
+            out = np.full(len(df), "", dtype=object)
+        prev = out[hit]
+        out[hit] = np.where(prev == "", code, prev + "," + code)
+    return out
+
+
+def mark(masked, why: np.ndarray, row0: int = 0):
+    """Attach the hidden reason/row columns; the committer does the splitting."""
+    rows = np.arange(row0, row0 + len(masked), dtype="int64")
+    if isinstance(masked, pd.DataFrame):
+        masked["_reject"], masked["_row"] = why, rows
+        return masked
+    import pyarrow as pa
+    return masked.append_column("_reject", pa.array(why, pa.string())).append_column("_row", pa.array(rows))
+
+
+def split(masked) -> Tuple[object, Optional[np.ndarray], Optional[np.ndarray]]:
+    """(good rows without the hidden columns, rejected source rows, their reasons)."""
+    if "_reject" not in _names(masked):
+        return masked, None, None
+    why = np.asarray(masked["_reject"], dtype=object)
+    rows = np.asarray(masked["_row"]).astype("int64", copy=False)
+    bad = why != ""
+    if isinstance(masked, pd.DataFrame):
+        masked = masked.loc[~bad].drop(columns=list(HIDDEN))
+    else:
+        masked = masked.filter(~bad).drop_columns(list(HIDDEN))
+    return masked, rows[bad], why[bad]
+
+
+def read(path: str) -> pd.DataFrame:
+    """A row file as pipeline input: the source columns, as strings."""
+    return pd.read_parquet(path).drop(columns=list(META), errors="ignore")
+
+
+def raw_rows(path: str, rows: np.ndarray, plan) -> pd.DataFrame:
+    """These data rows of the source file as written: strings, empty cells null."""
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path).iloc[rows].reset_index(drop=True)
+    if plan.input_format == "jsonl":
+        return pd.read_json(path, lines=True, dtype=False).iloc[rows].astype("string").reset_index(drop=True)
+    wanted = pd.Index(rows)
+    parts = [chunk[chunk.index.isin(wanted)]
+             for chunk in pd.read_csv(path, dtype=str, chunksize=plan.stream_chunk_rows)]
+    return pd.concat(parts, ignore_index=True)
+
+
+def write(path: str, rows: Optional[np.ndarray], why: Optional[np.ndarray], plan) -> Optional[str]:
+    """Committer, before the sinks commit: the rejected rows of path to a new row file (None if none)."""
+    if rows is None or not len(rows):
+        return None
+    raw = raw_rows(path, rows, plan)
+    if "_source" not in raw:  # rows of a replayed row file keep pointing at their original file
+        raw["_source"], raw["_row"] = path, rows
+    raw["_reason"] = pd.array(why, dtype="string")
+    raw["_quarantined_at"] = time.time()
+    os.makedirs(plan.reject_path, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(path))[0].split("-rows")[0]
+    out = os.path.join(plan.reject_path, f"{stem}-rows-{time.time_ns() // 10**6}.parquet")
+    raw.to_parquet(out + ".tmp", index=False)
+    os.replace(out + ".tmp", out)
+    logger.info(f"Quarantined {len(rows)} rows of {path} -> {out}")
+    return out
+
+
+def discard(outs: List[Optional[str]]):
+    """The sinks did not commit: drop the row files written for it (the whole file is quarantined)."""
+    for out in outs:
+        if out is not None and os.path.exists(out):
+            os.remove(out)
+
+
+def targets(plan, files: bool = True, rows: bool = True) -> List[str]:
+    out = []
+    if files:
+        out += sorted(p for p in glob.glob(os.path.join("quarantine", "*")) if os.path.isfile(p))
+    if rows:
+        out += sorted(glob.glob(os.path.join(plan.reject_path or os.path.join("quarantine", "rows"), "*.parquet")))
+    return out
+
+
+def _retire(path: str):
+    dest = os.path.join("quarantine", "replayed")
+    os.makedirs(dest, exist_ok=True)
+    target = os.path.join(dest, os.path.basename(path))
+    if os.path.exists(target):
+        root, ext = os.path.splitext(target)
+        target = f"{root}-{time.time_ns() // 10**6}{ext}"
+    shutil.move(path, target)
+
+
+def replay(cfg_path: str = "config.yaml", workers: Optional[int] = None, files: bool = True,
+           rows: bool = True, batch_files: int = 64) -> Tuple[Dict[str, bool], int]:
+    """Reprocess quarantined inputs; ({path: committed}, inputs skipped as already committed)."""
+    from .executor import FilePool
+    from .pipeline import process_batch, process_file, should_stream
+    from .plan import load_plan
+    from .watcher import FileManifest, file_sha256
+    plan = load_plan(cfg_path)
+    wcfg = plan.cfg.get("watcher", {})
+    manifest = FileManifest(wcfg.get("manifest_path", os.path.join("logs", "processed_files.sqlite")),
+                            wcfg.get("manifest_retention_days", 30))
+    todo, skipped = {}, 0
+    for path in targets(plan, files, rows):
+        sha = file_sha256(path)
+        if manifest.committed(sha):
+            logger.info(f"Replay: skipping {path}, already committed")
+            skipped += 1
+            continue
+        st = os.stat(path)
+        todo[path] = (st.st_size, st.st_mtime, sha)
+    results: Dict[str, bool] = {}
+
+    def done(path: str, ok: bool, meta):
+        manifest.record(path, *meta, "ok" if ok else "quarantined")
+        if ok:
+            _retire(path)
+        results[path] = ok
+
+    workers = wcfg.get("workers", 1) if workers is None else workers
+    if workers > 1:
+        pool = FilePool(cfg_path, workers, on_done=done)
+        for path, meta in todo.items():
+            pool.submit(path, meta)
+        pool.close()
+        return results, skipped
+    small = [p for p in todo if not should_stream(p, plan)]
+    for path in todo:
+        if path not in small:
+            done(path, process_file(path, cfg_path), todo[path])
+    for i in range(0, len(small), batch_files):
+        for path, ok in process_batch(small[i:i + batch_files], cfg_path).items():
+            done(path, ok, todo[path])
+    return results, skipped
+
+
+def main():
+    ap = argparse.ArgumentParser(prog="python -m app.quarantine")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rp = sub.add_parser("replay", help="reprocess quarantined files and rows with the current config")
+    rp.add_argument("--config", default="config.yaml")
+    rp.add_argument("--workers", type=int, default=None, help="worker processes (default: watcher.workers)")
+    rp.add_argument("--batch-files", type=int, default=64, help="files per shared commit without workers")
+    what = rp.add_mutually_exclusive_group()
+    what.add_argument("--files", action="store_true", help="only whole quarantined files")
+    what.add_argument("--rows", action="store_true", help="only quarantined rows")
+    args = ap.parse_args()
+    ensure_dirs()
+    configure_logging_from(load_yaml(args.config))
+    t0 = time.time()
+    results, skipped = replay(args.config, args.workers, not args.rows, not args.files, args.batch_files)
+    ok = sum(results.values())
+    print(f"Replayed {ok} of {len(results)} inputs in {time.time() - t0:.1f}s "
+          f"({len(results) - ok} still quarantined, {skipped} already committed)")
+
+
+if __name__ == "__main__":
+    main()
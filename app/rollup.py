@@ -0,0 +1,206 @@
+## app/rollup.py
+
+from __future__ import annotations
+import argparse, os, sqlite3, time
+from datetime import date
+from typing import List, Optional, Sequence
+import numpy as np
+import pandas as pd
+from .plan import VITALS
+from .utils import logger, configure_logging_from, load_yaml
+
+"""
+Dashboard rollups kept next to the row-level tables (sinks.rollups, default:
+in the SQLite sink's database, on by default when that sink is enabled):
+
+  rollup_daily_zip3         one row per event_date x zip3: rows, flagged_rows,
+                            and per vital n_<v>, sum_<v>, sumsq_<v>, outliers_<v>
+  rollup_daily_zip3_stats   view adding mean_<v> and var_<v> (sample variance)
+  rollup_quarantine_daily   one row per day: files quarantined
+
+SinkTxn upserts each batch's aggregates in the same transaction as its rows,
+so the rollups never disagree with cleaned_events.  Power BI can chart KPIs,
+trends and QC rates from a few thousand rollup rows instead of scanning
+every event.
+
+  python -m app.rollup rebuild [--config config.yaml] [--source sqlite|parquet]
+"""
+
+TABLE = "rollup_daily_zip3"
+QUARANTINE_TABLE = "rollup_quarantine_daily"
+KEYS = ("event_date", "zip3")
+
+
+def _stats(cols: Sequence[str]) -> List[str]:
+    return [f"{p}_{c}" for c in cols for p in ("n", "sum", "sumsq", "outliers")]
+
+
+def _key(df: pd.DataFrame, col: str) -> pd.Series:
+    """Key column as text; '' when unknown (SQLite treats NULL keys as distinct)."""
+    if col not in df:
+        return pd.Series("", index=df.index)
+    s = df[col]
+    if pd.api.types.is_datetime64_any_dtype(s):
+        s = s.dt.date
+    return s.astype(object).where(s.notna(), "").map(str)
+
+
+def aggregate(df: pd.DataFrame, cols: Sequence[str] = VITALS) -> pd.DataFrame:
+    """One batch's per event_date x zip3 partial aggregates (outlier bit i = cols[i])."""
+    mask = df["outlier_mask"].to_numpy(dtype="int64") if "outlier_mask" in df else np.zeros(len(df), "int64")
+    work = {"event_date": _key(df, "event_date").to_numpy(), "zip3": _key(df, "zip3").to_numpy(),
+            "rows": np.ones(len(df), dtype="int64"), "flagged_rows": (mask != 0).astype("int64")}
+    for bit, c in enumerate(cols):
+        v = (pd.to_numeric(df[c], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+             if c in df else np.full(len(df), np.nan))
+        ok = ~np.isnan(v)
+        work[f"n_{c}"] = ok.astype("int64")
+        work[f"sum_{c}"] = np.where(ok, v, 0.0)
+        work[f"sumsq_{c}"] = np.where(ok, v * v, 0.0)
+        work[f"outliers_{c}"] = (mask >> bit) & 1
+    return pd.DataFrame(work).groupby(list(KEYS), sort=False, as_index=False).sum()
+
+
+_ready: set = set()
+
+
+def ensure_tables(conn, cols: Sequence[str] = VITALS):
+    """Create the rollup tables/view; add columns for vitals configured since."""
+    key = (str(conn.engine.url), tuple(cols))
+    if key in _ready:
+        return
+    stats = _stats(cols)
+    conn.exec_driver_sql(
+        f'CREATE TABLE IF NOT EXISTS "{TABLE}" (event_date TEXT NOT NULL, zip3 TEXT NOT NULL, '
+        f'rows INTEGER NOT NULL DEFAULT 0, flagged_rows INTEGER NOT NULL DEFAULT 0, '
+        + ", ".join(f'"{s}" {"REAL" if s.startswith("sum") else "INTEGER"} NOT NULL DEFAULT 0' for s in stats)
+        + ", PRIMARY KEY (event_date, zip3))")
+    have = {r[1] for r in conn.exec_driver_sql(f'PRAGMA table_info("{TABLE}")').fetchall()}
+    added = [s for s in stats if s not in have]
+    for s in added:
+        conn.exec_driver_sql(f'ALTER TABLE "{TABLE}" ADD COLUMN "{s}" '
+                             f'{"REAL" if s.startswith("sum") else "INTEGER"} NOT NULL DEFAULT 0')
+    view = conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = ?",
+                                (f"{TABLE}_stats",)).fetchone()
+    if added or view is None:
+        conn.exec_driver_sql(f'DROP VIEW IF EXISTS "{TABLE}_stats"')
+        derived = ", ".join(
+            f'CASE WHEN n_{c} > 0 THEN sum_{c} / n_{c} END AS mean_{c}, '
+            f'CASE WHEN n_{c} > 1 THEN (sumsq_{c} - sum_{c} * sum_{c} / n_{c}) / (n_{c} - 1) END AS var_{c}'
+            for c in cols)
+        conn.exec_driver_sql(f'CREATE VIEW "{TABLE}_stats" AS SELECT *, {derived} FROM "{TABLE}"')
+    _ready.add(key)
+
+
+def upsert(conn, agg: pd.DataFrame, cols: Sequence[str] = VITALS):
+    """Add agg's counts and sums onto the stored rows; the caller owns the transaction."""
+    if agg.empty:
+        return
+    ensure_tables(conn, cols)
+    names = ["rows", "flagged_rows", *_stats(cols)]
+    sql = (f'INSERT INTO "{TABLE}" (event_date, zip3, {", ".join(names)}) '
+           f'VALUES ({", ".join("?" for _ in range(len(names) + 2))}) '
+           f'ON CONFLICT(event_date, zip3) DO UPDATE SET '
+           + ", ".join(f'"{n}" = "{n}" + excluded."{n}"' for n in names))
+    rows = agg[[*KEYS, *names]]
+    conn.exec_driver_sql(sql, list(zip(*(rows[c].tolist() for c in rows.columns))))
+
+
+def _quarantine_table(conn):
+    conn.exec_driver_sql(f'CREATE TABLE IF NOT EXISTS "{QUARANTINE_TABLE}" '
+                         f'(day TEXT PRIMARY KEY, files INTEGER NOT NULL DEFAULT 0)')
+
+
+def record_quarantine(conn, n: int = 1, day: Optional[str] = None):
+    _quarantine_table(conn)
+    conn.exec_driver_sql(f'INSERT INTO "{QUARANTINE_TABLE}" (day, files) VALUES (?, ?) '
+                         f'ON CONFLICT(day) DO UPDATE SET files = files + excluded.files',
+                         (day or date.today().isoformat(), int(n)))
+
+
+def rollup_uri(cfg: dict) -> Optional[str]:
+    """sinks.rollups.uri, else the SQLite sink's; None when rollups are off."""
+    sinks = cfg.get("sinks", {})
+    rcfg, sq = sinks.get("rollups", {}), sinks.get("sqlite", {})
+    if not rcfg.get("enabled", bool(sq.get("enabled"))):
+        return None
+    return rcfg.get("uri") or sq.get("uri")
+
+
+def quarantined(cfg: dict):
+    """pipeline.fail(): count one quarantined file for today (own short transaction)."""
+    uri = rollup_uri(cfg)
+    if not uri:
+        return
+    from .sinks import get_engine
+    try:
+        with get_engine(uri).begin() as conn:
+            record_quarantine(conn)
+    except Exception as e:
+        logger.error(f"Quarantine rollup update failed: {e}")
+
+
+def rebuild(cfg: dict, source: Optional[str] = None) -> int:
+    """Recompute every rollup from the stored events; returns the number of rollup rows."""
+    from .sinks import get_engine
+    uri = rollup_uri(cfg)
+    if not uri:
+        raise SystemExit("Rollups are disabled (sinks.rollups.enabled / sinks.sqlite.enabled)")
+    sinks = cfg.get("sinks", {})
+    cols = tuple(cfg.get("outliers", {}).get("columns", VITALS))
+    table = sinks.get("sqlite", {}).get("table", "cleaned_events")
+    with get_engine(uri).begin() as conn:
+        ensure_tables(conn, cols)
+        have = conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                    (table,)).fetchone()
+        source = source or ("sqlite" if have and sinks.get("sqlite", {}).get("uri") == uri else "parquet")
+        conn.exec_driver_sql(f'DELETE FROM "{TABLE}"')
+        if source == "sqlite":
+            # One GROUP BY inside SQLite; nothing leaves the database
+            info = {r[1] for r in conn.exec_driver_sql(f'PRAGMA table_info("{table}")').fetchall()}
+            key = lambda c: f"COALESCE(CAST({c} AS TEXT), '')" if c in info else "''"
+            mask = "COALESCE(outlier_mask, 0)" if "outlier_mask" in info else "0"
+            exprs = []
+            for bit, c in enumerate(cols):
+                v = f'"{c}"' if c in info else "NULL"
+                exprs += [f"COUNT({v})", f"TOTAL({v})", f"TOTAL({v} * {v})", f"SUM(({mask} >> {bit}) & 1)"]
+            conn.exec_driver_sql(
+                f'INSERT INTO "{TABLE}" (event_date, zip3, rows, flagged_rows, {", ".join(_stats(cols))}) '
+                f'SELECT {key("event_date")}, {key("zip3")}, COUNT(*), SUM({mask} != 0), {", ".join(exprs)} '
+                f'FROM "{table}" GROUP BY 1, 2')
+        else:
+            from .dataset import dataset, live_files
+            root = sinks.get("parquet", {}).get("path", os.path.join("masked_out", "cleaned.parquet"))
+            if live_files(root):
+                for batch in dataset(root).to_batches(batch_size=1_000_000):
+                    upsert(conn, aggregate(batch.to_pandas(), cols), cols)
+        _quarantine_table(conn)
+        conn.exec_driver_sql(f'DELETE FROM "{QUARANTINE_TABLE}"')
+        manifest = cfg.get("watcher", {}).get("manifest_path", os.path.join("logs", "processed_files.sqlite"))
+        if os.path.exists(manifest):
+            # As far back as the watcher's manifest remembers (watcher.manifest_retention_days)
+            with sqlite3.connect(manifest) as m:
+                days = m.execute("SELECT date(processed_at, 'unixepoch', 'localtime'), COUNT(*) FROM processed "
+                                 "WHERE outcome = 'quarantined' GROUP BY 1").fetchall()
+            for day, n in days:
+                record_quarantine(conn, n, day)
+        return conn.exec_driver_sql(f'SELECT COUNT(*) FROM "{TABLE}"').fetchone()[0]
+
+
+def main():
+    ap = argparse.ArgumentParser(prog="python -m app.rollup")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rb = sub.add_parser("rebuild", help="recompute the rollup tables from the stored events")
+    rb.add_argument("--config", default="config.yaml")
+    rb.add_argument("--source", choices=["sqlite", "parquet"], default=None,
+                    help="default: the SQLite table when it shares the rollup database, else the Parquet dataset")
+    args = ap.parse_args()
+    cfg = load_yaml(args.config)
+    configure_logging_from(cfg)
+    t0 = time.time()
+    n = rebuild(cfg, args.source)
+    print(f"Rebuilt {n} rollup rows in {time.time() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -24,4 +24,5 @@ class CleanEvent(BaseModel):
     systolic_bp: float
     diastolic_bp: float
     heart_rate: float
+    outlier_mask: int = Field(0, description="bit per checked vital (systolic_bp, diastolic_bp, heart_rate)")
     outlier_flags: Optional[str] = None
@@ -1,27 +1,247 @@
 ## app/sinks.py
 
 from __future__ import annotations
-import os
+import os, time
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
-import requests
+from . import rollup
+from .plan import VITALS
+from .utils import load_env, logger
 
+# Backends are imported by the sinks that use them: pyarrow.dataset (dataset.py)
+# for Parquet, sqlalchemy for SQLite and the rollups, requests (powerbi.py) for Power BI
 
-def to_parquet(df: pd.DataFrame, path: str, mode: str = "append"):
-    if mode == "overwrite" or not os.path.exists(path):
-        df.to_parquet(path, index=False)
-    else:
-        old = pd.read_parquet(path)
-        pd.concat([old, df], ignore_index=True).to_parquet(path, index=False)
 
+def to_parquet(df: pd.DataFrame, path: str, mode: str = "append", partition_by=()):
+    """Append df to the partitioned dataset at path (a directory); O(batch), never O(history)."""
+    from . import dataset
+    staged = dataset.stage(df, path, partition_by)
+    dataset.commit_staged(path, staged, len(df), replace=(mode == "overwrite"))
 
-def to_sqlite(df: pd.DataFrame, uri: str, table: str):
-    eng = create_engine(uri)
-    df.to_sql(table, eng, if_exists="append", index=False)
 
+_engines: dict = {}
+_indexed: set = set()
 
-def powerbi_push(df: pd.DataFrame, dataset_url: str):
-    payload = {"rows": df.to_dict(orient="records")}
-    r = requests.post(dataset_url, json=payload, timeout=10)
-    r.raise_for_status()
 
+def get_engine(uri: str, synchronous: str = "NORMAL", busy_timeout_ms: int = 30000):
+    """One long-lived pooled engine per URI; SQLite files are put in WAL mode so
+    dashboard readers (Power BI DirectQuery) and the writer stop blocking each other."""
+    eng = _engines.get(uri)
+    if eng is None:
+        from sqlalchemy import create_engine, event
+        eng = create_engine(uri)
+        if uri.startswith("sqlite"):
+            @event.listens_for(eng, "connect")
+            def _pragmas(dbapi_con, _record):
+                cur = dbapi_con.cursor()
+                cur.execute("PRAGMA journal_mode=WAL")
+                cur.execute(f"PRAGMA synchronous={synchronous}")
+                cur.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+                cur.close()
+        _engines[uri] = eng
+    return eng
+
+
+def _sql_type(s: pd.Series) -> str:
+    if pd.api.types.is_integer_dtype(s) or pd.api.types.is_bool_dtype(s):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(s):
+        return "REAL"
+    return "TEXT"
+
+
+def _ensure_table(conn, table: str, df: pd.DataFrame, index_columns=()):
+    if not conn.exec_driver_sql(f'PRAGMA table_info("{table}")').fetchall():
+        # IF NOT EXISTS: another watcher sharing the database may create it first
+        ddl = pd.io.sql.get_schema(df.head(0), table, con=conn)
+        conn.exec_driver_sql(ddl.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1))
+    existing = {r[1] for r in conn.exec_driver_sql(f'PRAGMA table_info("{table}")').fetchall()}
+    for col in df.columns:
+        if col not in existing:  # e.g. outlier_mask on a table created by an older version
+            conn.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN "{col}" {_sql_type(df[col])}')
+            existing.add(col)
+    for col in index_columns:
+        key = (str(conn.engine.url), table, col)
+        if col in existing and key not in _indexed:
+            conn.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS "ix_{table}_{col}" ON "{table}" ("{col}")')
+            _indexed.add(key)
+
+
+def _rows(df: pd.DataFrame):
+    """DataFrame -> list of tuples of plain Python values sqlite3 can bind (NaN -> NULL)."""
+    cols = []
+    for c in df.columns:
+        s = df[c]
+        if pd.api.types.is_datetime64_any_dtype(s):
+            vals = s.dt.strftime("%Y-%m-%d %H:%M:%S.%f").tolist()
+        elif pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+            vals = s.tolist() if isinstance(s.dtype, np.dtype) else s.to_numpy(dtype=object, na_value=None).tolist()
+        elif pd.api.types.is_string_dtype(s) and s.dtype != object:
+            vals = s.to_numpy(dtype=object, na_value=None).tolist()
+        else:
+            vals = [None if v is None or v != v else (v.isoformat() if hasattr(v, "isoformat") else v)
+                    for v in s.tolist()]
+        cols.append(vals)
+    return list(zip(*cols))
+
+
+def bulk_insert(conn, df: pd.DataFrame, table: str, batch_rows: int = 50_000, index_columns=()):
+    """executemany() in batches on an open connection; the caller owns the transaction."""
+    if df.empty:
+        return
+    _ensure_table(conn, table, df, index_columns)
+    cols = ", ".join(f'"{c}"' for c in df.columns)
+    marks = ", ".join("?" for _ in df.columns)
+    sql = f'INSERT INTO "{table}" ({cols}) VALUES ({marks})'
+    for start in range(0, len(df), batch_rows):
+        conn.exec_driver_sql(sql, _rows(df.iloc[start:start + batch_rows]))
+
+
+def to_sqlite(df: pd.DataFrame, uri: str, table: str, batch_rows: int = 50_000,
+              index_columns=("event_date", "zip3", "patient_key")):
+    with get_engine(uri).begin() as conn:
+        bulk_insert(conn, df, table, batch_rows, index_columns)
+
+
+SOURCES_TABLE = "etl_sources"  # input files committed to a database, in the transaction of their rows
+
+
+def _held_sources(conn, sources: dict) -> bool:
+    """Open transaction: creates the sources table; True when it already lists every source at its mtime."""
+    conn.exec_driver_sql(f'CREATE TABLE IF NOT EXISTS "{SOURCES_TABLE}" '
+                         "(path TEXT PRIMARY KEY, mtime REAL, committed_at REAL)")
+    marks = ", ".join("?" for _ in sources)
+    got = dict(conn.exec_driver_sql(f'SELECT path, mtime FROM "{SOURCES_TABLE}" WHERE path IN ({marks})',
+                                    tuple(sources)).fetchall())
+    return all(got.get(p) == m for p, m in sources.items())
+
+
+def _mtimes(paths) -> dict:
+    out = {}
+    for p in paths:
+        try:
+            out[p] = os.stat(p).st_mtime
+        except FileNotFoundError:
+            pass
+    return out
+
+
+def powerbi_push(df: pd.DataFrame, dataset_url: str, cfg: dict | None = None):
+    """Chunked, concurrent push with retry; chunks that still fail are spilled to disk and re-sent later."""
+    from .powerbi import get_pusher
+    return get_pusher(dataset_url, cfg).push(df)
+
+
+class SinkTxn:
+    """One file's worth of sink writes, made visible all at once.
+
+    write() may be called once per chunk. Parquet chunks are staged as hidden
+    temp files; SQLite rows and the rollup upserts (rollup.py) go into one open
+    transaction per database; commit() publishes all of them, abort() discards
+    them. The Power BI push is not transactional: rows are sent as each chunk
+    is written.
+
+    sources (the input files) are committed with the rows, with their mtimes:
+    on the Parquet manifest line and in each database's etl_sources table.  A
+    sink that already holds every source at that mtime is skipped, so a file
+    processed again after a crash between two sinks' commits (or one taken
+    over from a dead watcher, see claims.py) is written only where missing.
+    """
+
+    def __init__(self, cfg: dict, sources=()):
+        self.sinks = cfg.get("sinks", {})
+        self.sources = _mtimes(sources)
+        self.held: set = set()  # database URIs (and "parquet") that already hold the sources
+        self.rows = 0
+        self.staged = []
+        self._conns: dict = {}  # uri -> (connection, transaction)
+        pq_cfg = self.sinks.get("parquet", {})
+        self.parquet = pq_cfg if pq_cfg.get("enabled") else None
+        if self.parquet and self.sources:
+            from . import dataset
+            got = dataset.committed_sources(self.parquet["path"])
+            if all(got.get(p) == m for p, m in self.sources.items()):
+                self._skip("parquet", self.parquet["path"])
+        sq_cfg = self.sinks.get("sqlite", {})
+        self.sqlite = sq_cfg if sq_cfg.get("enabled") else None
+        self.rollup_uri = rollup.rollup_uri(cfg)
+        self.rollup_cols = tuple(cfg.get("outliers", {}).get("columns", VITALS))
+        pb_cfg = self.sinks.get("powerbi_push", {})
+        self.powerbi_cfg = pb_cfg
+        self.powerbi_url = ""
+        if pb_cfg.get("enabled"):
+            load_env()
+            self.powerbi_url = os.getenv(pb_cfg["dataset_url_env"], "")
+
+    def _skip(self, key: str, where: str):
+        self.held.add(key)
+        logger.info(f"{where} already holds {', '.join(self.sources)}; skipping it")
+
+    def _conn(self, uri: str):
+        hit = self._conns.get(uri)
+        if hit is None:
+            conn = get_engine(uri, (self.sqlite or {}).get("synchronous", "NORMAL")).connect()
+            hit = self._conns[uri] = (conn, conn.begin())
+            if self.sources and _held_sources(conn, self.sources):
+                self._skip(uri, uri)
+        return hit[0]
+
+    def _writes(self, uri: str) -> bool:
+        """Opens uri's transaction; False when that database already holds the sources."""
+        self._conn(uri)
+        return uri not in self.held
+
+    def holds_all(self) -> bool:
+        """Every transactional sink (Parquet, SQLite, rollups) already holds the sources."""
+        uris = {u for u in ((self.sqlite or {}).get("uri"), self.rollup_uri) if u}
+        if not self.sources or not (self.parquet or uris):
+            return False
+        return (not self.parquet or "parquet" in self.held) and not any(self._writes(u) for u in uris)
+
+    def write(self, df):
+        """df: DataFrame, or a pyarrow Table (engine: arrow), which goes to Parquet as is."""
+        if self.parquet and "parquet" not in self.held:
+            from . import dataset
+            self.staged += dataset.stage(df, self.parquet["path"], self.parquet.get("partition_by", []))
+        if not isinstance(df, pd.DataFrame) and (self.sqlite or self.rollup_uri or self.powerbi_url):
+            df = df.to_pandas()
+        if self.sqlite and self._writes(self.sqlite["uri"]):
+            bulk_insert(self._conn(self.sqlite["uri"]), df, self.sqlite["table"], self.sqlite.get("batch_rows", 50_000),
+                        self.sqlite.get("index_columns", ["event_date", "zip3", "patient_key"]))
+        if self.rollup_uri and self._writes(self.rollup_uri):
+            rollup.upsert(self._conn(self.rollup_uri), rollup.aggregate(df, self.rollup_cols), self.rollup_cols)
+        if self.powerbi_url:
+            powerbi_push(df, self.powerbi_url, self.powerbi_cfg)
+        self.rows += len(df)
+
+    def commit(self):
+        for uri, (conn, txn) in self._conns.items():
+            if self.sources and uri not in self.held:
+                now = time.time()
+                conn.exec_driver_sql(f'INSERT OR REPLACE INTO "{SOURCES_TABLE}" VALUES (?, ?, ?)',
+                                     [(p, m, now) for p, m in self.sources.items()])
+            txn.commit()
+            conn.close()
+        self._conns.clear()
+        if self.parquet and "parquet" not in self.held:
+            from . import dataset
+            dataset.commit_staged(self.parquet["path"], self.staged, self.rows,
+                                  replace=(self.parquet.get("mode", "append") == "overwrite"), sources=self.sources)
+
+    def abort(self):
+        for conn, txn in self._conns.values():
+            txn.rollback()
+            conn.close()
+        self._conns.clear()
+        if self.parquet:
+            from . import dataset
+            dataset.abort_staged(self.parquet["path"], self.staged)
+
+
+def committed(cfg: dict, path: str) -> bool:
+    """Whether every transactional sink already holds path at its current mtime."""
+    txn = SinkTxn(cfg, [path])
+    try:
+        return txn.holds_all()
+    finally:
+        txn.abort()
@@ -0,0 +1,94 @@
+## app/sketch.py
+
+from __future__ import annotations
+from typing import Optional, Tuple
+import numpy as np
+
+
+class KLLSketch:
+    """Mergeable quantile sketch (KLL-style compactors).
+
+    Memory is O(k log(n/k)) whatever n is; rank error is roughly 1.7/k.
+    Sketches built on different chunks/files can be merge()d losslessly
+    with respect to that error bound.
+    """
+
+    def __init__(self, k: int = 256, seed: int = 0):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, h: int) -> int:
+        return max(8, int(self.k * (2 / 3) ** (len(self.levels) - h - 1)))
+
+    def update(self, values) -> "KLLSketch":
+        v = np.asarray(values, dtype="float64").ravel()
+        v = v[~np.isnan(v)]
+        if v.size:
+            self.levels[0] = np.concatenate([self.levels[0], v])
+            self.n += int(v.size)
+            self._compress()
+        return self
+
+    def merge(self, other: "KLLSketch") -> "KLLSketch":
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, lv in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], lv])
+        self.n += other.n
+        self._compress()
+        return self
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            lv = self.levels[h]
+            if lv.size > self._capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                lv = np.sort(lv)
+                stay = lv[:lv.size % 2]   # odd item stays so total weight is conserved
+                lv = lv[lv.size % 2:]
+                promoted = lv[int(self._rng.integers(2))::2]
+                self.levels[h] = stay
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+            h += 1
+
+    def _weighted(self) -> Tuple[np.ndarray, np.ndarray]:
+        vals = np.concatenate(self.levels)
+        w = np.concatenate([np.full(lv.size, 2.0 ** h) for h, lv in enumerate(self.levels)])
+        order = np.argsort(vals, kind="stable")
+        return vals[order], np.cumsum(w[order])
+
+    def quantile(self, q: float) -> float:
+        if self.n == 0:
+            return float("nan")
+        vals, cw = self._weighted()
+        i = int(np.searchsorted(cw, q * cw[-1], side="left"))
+        return float(vals[min(i, vals.size - 1)])
+
+    def median_abs_deviation(self, center: Optional[float] = None) -> float:
+        """median(|x - center|) read off the sketch's CDF, no second pass needed."""
+        if self.n == 0:
+            return float("nan")
+        m = self.quantile(0.5) if center is None else center
+        vals, cw = self._weighted()
+        total = cw[-1]
+        d = np.unique(np.abs(vals - m))
+        hi = np.searchsorted(vals, m + d, side="right")
+        lo = np.searchsorted(vals, m - d, side="left")
+        covered = (np.where(hi > 0, cw[np.maximum(hi - 1, 0)], 0.0)
+                   - np.where(lo > 0, cw[np.maximum(lo - 1, 0)], 0.0))
+        i = int(np.searchsorted(covered, 0.5 * total, side="left"))
+        return float(d[min(i, d.size - 1)])
+
+    def to_dict(self) -> dict:
+        return {"k": self.k, "n": self.n, "levels": [lv.tolist() for lv in self.levels]}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "KLLSketch":
+        sk = cls(k=d["k"])
+        sk.n = d["n"]
+        sk.levels = [np.asarray(lv, dtype="float64") for lv in d["levels"]] or [np.empty(0)]
+        return sk
@@ -0,0 +1,214 @@
+## app/standin.py
+
+from __future__ import annotations
+import argparse, json, random, socketserver, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+Local stand-ins for a Power BI push-dataset endpoint (also usable as the
+Slack webhook) and for the alert SMTP server, for tests and throughput
+benchmarks without a tenant.
+
+  POST /<anything>  {"rows": [...]}  -> 200, rows counted
+  GET  /stats                         -> {"requests", "rows", "throttled", "failed"}
+
+SMTPStandIn accepts AUTH PLAIN with any credentials and keeps every
+message in .messages.  It offers no STARTTLS, which the alert client
+requires unless SMTP_STARTTLS=0 is set.
+
+Usage:
+  python -m app.standin [--port 8765] [--latency-ms 0] [--throttle-rate 0] [--fail-rate 0]
+  python -m app.standin --smtp [--port 8025]
+"""
+
+
+class StandIn:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0,
+                 throttle_rate: float = 0.0, fail_rate: float = 0.0, retry_after: int = 1,
+                 max_rows: int = 10_000, keep_bodies: bool = False, seed: int = 0):
+        self.latency = latency_ms / 1000.0
+        self.throttle_rate = throttle_rate
+        self.fail_rate = fail_rate
+        self.retry_after = retry_after
+        self.max_rows = max_rows
+        self.stats = {"requests": 0, "rows": 0, "throttled": 0, "failed": 0, "rejected": 0}
+        self.bodies: list | None = [] if keep_bodies else None
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/rows"
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, code: int, body: dict, headers: dict | None = None):
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                with standin._lock:
+                    self._reply(200, dict(standin.stats))
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if standin.latency:
+                    time.sleep(standin.latency)
+                with standin._lock:
+                    standin.stats["requests"] += 1
+                    roll = standin._rng.random()
+                    if roll < standin.throttle_rate:
+                        standin.stats["throttled"] += 1
+                        return self._reply(429, {"error": "throttled"}, {"Retry-After": str(standin.retry_after)})
+                    if roll < standin.throttle_rate + standin.fail_rate:
+                        standin.stats["failed"] += 1
+                        return self._reply(503, {"error": "unavailable"})
+                try:
+                    rows = json.loads(body).get("rows")
+                except ValueError:
+                    rows = None
+                with standin._lock:
+                    if rows is not None and len(rows) > standin.max_rows:
+                        standin.stats["rejected"] += 1
+                        return self._reply(400, {"error": f"more than {standin.max_rows} rows"})
+                    standin.stats["rows"] += len(rows or [])
+                    if standin.bodies is not None:
+                        standin.bodies.append(json.loads(body))
+                self._reply(200, {})
+
+        return Handler
+
+    def start(self) -> "StandIn":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class SMTPStandIn:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000.0
+        self.messages: list = []
+        self.stats = {"connections": 0, "messages": 0}
+        self._lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def host(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"{host}:{port}"
+
+    def _handler(self):
+        standin = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def _say(self, line: str):
+                self.wfile.write(line.encode() + b"\r\n")
+
+            def handle(self):
+                with standin._lock:
+                    standin.stats["connections"] += 1
+                self._say("220 standin ESMTP")
+                sender, rcpts = None, []
+                for raw in self.rfile:
+                    cmd = raw.decode(errors="replace").rstrip("\r\n")
+                    verb = cmd.split(" ", 1)[0].upper()
+                    if verb in ("EHLO", "HELO"):
+                        self.wfile.write(b"250-standin\r\n250 AUTH PLAIN LOGIN\r\n")
+                    elif verb == "AUTH":
+                        self._say("235 ok")
+                    elif verb == "MAIL":
+                        sender, rcpts = cmd[10:].strip("<> "), []
+                        self._say("250 ok")
+                    elif verb == "RCPT":
+                        rcpts.append(cmd[8:].strip("<> "))
+                        self._say("250 ok")
+                    elif verb == "DATA":
+                        self._say("354 end with .")
+                        lines = []
+                        for d in self.rfile:
+                            d = d.decode(errors="replace").rstrip("\r\n")
+                            if d == ".":
+                                break
+                            lines.append(d[1:] if d.startswith("..") else d)
+                        if standin.latency:
+                            time.sleep(standin.latency)
+                        with standin._lock:
+                            standin.stats["messages"] += 1
+                            standin.messages.append({"from": sender, "to": rcpts, "data": "\n".join(lines)})
+                        self._say("250 queued")
+                    elif verb == "QUIT":
+                        self._say("221 bye")
+                        return
+                    else:  # NOOP, RSET, ...
+                        self._say("250 ok")
+
+        return Handler
+
+    def start(self) -> "SMTPStandIn":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    ap = argparse.ArgumentParser(prog="python -m app.standin")
+    ap.add_argument("--port", type=int, default=None)
+    ap.add_argument("--smtp", action="store_true", help="run the SMTP stand-in instead")
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of POSTs answered 429")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="fraction of POSTs answered 503")
+    args = ap.parse_args()
+    if args.smtp:
+        m = SMTPStandIn(port=args.port or 8025, latency_ms=args.latency_ms)
+        print(f"SMTP stand-in listening on {m.host} (set SMTP_HOST to this and SMTP_STARTTLS=0)")
+        try:
+            m.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+    s = StandIn(port=args.port or 8765, latency_ms=args.latency_ms,
+                throttle_rate=args.throttle_rate, fail_rate=args.fail_rate)
+    print(f"Stand-in listening on {s.url} (GET /stats for counters)")
+    try:
+        s.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,109 @@
 ## app/utils.py
 
 from __future__ import annotations
-import hashlib, hmac, os, time, logging
-from functools import wraps
-from typing import Any, Callable
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
-    handlers=[
-        logging.FileHandler("logs/pipeline.log"),
-        logging.StreamHandler()
-    ],
-)
+import atexit, hashlib, hmac, os, queue, random, time, logging
+from functools import lru_cache, wraps
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Callable, Optional
+
+LOG_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+_listener: Optional[QueueListener] = None
+_log_args: tuple = ()
+_worker_queue = None
+
+
+def configure_logging(path: str = os.path.join("logs", "pipeline.log"), max_mb: float = 50,
+                      backups: int = 5, level: str = "INFO"):
+    """Root logging through a QueueHandler: a log call only enqueues the record;
+    a QueueListener thread formats it and writes the console and the log file,
+    which rotates at max_mb (keeping `backups` old files).  Idempotent.
+
+    Called by the entry points (watcher.run, the CLI mains), not at import, so
+    importing app.* creates no logs/ folder and starts no thread."""
+    global _listener, _log_args
+    if _log_args == (path, max_mb, backups, level):
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fmt = logging.Formatter(LOG_FORMAT)
+    handlers = [RotatingFileHandler(path, maxBytes=int(max_mb * 2**20), backupCount=backups,
+                                    encoding="utf-8", delay=True), logging.StreamHandler()]
+    for h in handlers:
+        h.setFormatter(fmt)
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    old = [h for h in root.handlers if isinstance(h, QueueHandler)]
+    root.addHandler(QueueHandler(q))
+    for h in old:
+        root.removeHandler(h)
+    root.setLevel(level)
+    if _listener is not None:  # drains what was queued to the old handlers
+        _listener.stop()
+        for h in _listener.handlers:
+            h.close()
+    _listener = QueueListener(q, *handlers, respect_handler_level=True)
+    _listener.start()
+    _log_args = (path, max_mb, backups, level)
+
+
+def configure_logging_from(cfg: dict):
+    """configure_logging() with the config's logging: section."""
+    lcfg = cfg.get("logging") or {}
+    configure_logging(lcfg.get("path", os.path.join("logs", "pipeline.log")), lcfg.get("max_mb", 50),
+                      lcfg.get("backups", 5), lcfg.get("level", "INFO"))
+
+
+class _Forward(logging.Handler):
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def worker_log_queue():
+    """Queue for ProcessPoolExecutor(initializer=log_to_queue): worker records are
+    written by this process's handlers, so only one process ever rotates the file."""
+    global _worker_queue
+    if _worker_queue is None:
+        import multiprocessing as mp
+        _worker_queue = mp.get_context("spawn").Queue()
+        QueueListener(_worker_queue, _Forward()).start()
+    return _worker_queue
+
+
+def log_to_queue(q, level: int = logging.INFO):
+    """Worker process initializer, see worker_log_queue(); level: the parent's root level."""
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(QueueHandler(q))
+    root.setLevel(level)
+
+
+@atexit.register
+def _flush_logs():
+    if _listener is not None:
+        _listener.stop()
+
+
 logger = logging.getLogger("pipeline")
+logger.addHandler(logging.NullHandler())  # until an entry point calls configure_logging()
+
+
+@lru_cache(maxsize=1)
+def load_env() -> bool:
+    """Load .env once, when python-dotenv is installed; called where settings are read from the environment."""
+    try:
+        from dotenv import load_dotenv  # type: ignore
+    except ImportError:
+        return False
+    return load_dotenv()
+
 
 class Retryable(Exception):
-    pass
+    """Transient failure; retry_after (seconds) is honoured when the server asked for it (HTTP 429)."""
+    def __init__(self, *args, retry_after: float | None = None):
+        super().__init__(*args)
+        self.retry_after = retry_after
 
-def retry(times: int = 3, delay: float = 1.0):
+def retry(times: int = 3, delay: float = 1.0, max_delay: float = 60.0):
     def deco(fn: Callable[..., Any]):
         @wraps(fn)
         def wrapper(*args, **kwargs):
@@ -28,8 +113,13 @@ def retry(times: int = 3, delay: float = 1.0):
                     return fn(*args, **kwargs)
                 except Retryable as e:
                     last = e
-                    logger.warning(f"Retry {i+1}/{times} for {fn.__name__}: {e}")
-                    time.sleep(delay * (2 ** i))
+                    if i + 1 == times:
+                        break
+                    wait = min(max_delay, delay * (2 ** i)) * random.uniform(0.5, 1.0)
+                    if e.retry_after is not None:
+                        wait = max(wait, e.retry_after)
+                    logger.warning(f"Retry {i+1}/{times} for {fn.__name__} in {wait:.1f}s: {e}")
+                    time.sleep(wait)
             raise last if last else Exception("Retry failed")
         return wrapper
     return deco
@@ -1,25 +1,234 @@
 ## app/watcher.py
 
 from __future__ import annotations
-import time, glob, os
-from .utils import logger, ensure_dirs, load_yaml
-from .pipeline import process_file
+import time, os, fnmatch, hashlib, queue, sqlite3
+from .utils import logger, configure_logging_from, ensure_dirs, load_yaml
+from .pipeline import process_batch, process_file, should_stream
+from .executor import FilePool, StagedPipeline
+from .plan import load_plan
+from .claims import Claims
+from . import metrics, sinks
+
+# Optional: native change notifications (inotify / ReadDirectoryChangesW / FSEvents)
+try:
+    from watchdog.observers import Observer  # type: ignore
+    from watchdog.events import FileSystemEventHandler  # type: ignore
+except Exception:
+    Observer = None
+
+
+class FileManifest:
+    """On-disk record of processed files so a restart only looks at new files."""
+
+    def __init__(self, path: str, retention_days: float = 30):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.retention = retention_days * 86400
+        self.con = sqlite3.connect(path)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS processed ("
+            " path TEXT PRIMARY KEY, size INTEGER, mtime REAL, sha256 TEXT,"
+            " outcome TEXT, processed_at REAL)"
+        )
+        self.con.execute("CREATE INDEX IF NOT EXISTS processed_sha256 ON processed (sha256)")
+        self.con.commit()
+
+    def is_done(self, path: str, size: int, mtime: float) -> bool:
+        row = self.con.execute(
+            "SELECT 1 FROM processed WHERE path = ? AND size = ? AND mtime = ?", (path, size, mtime)
+        ).fetchone()
+        return row is not None
+
+    def committed(self, sha256: str) -> bool:
+        """A file with this content was processed OK, under whatever path."""
+        row = self.con.execute(
+            "SELECT 1 FROM processed WHERE sha256 = ? AND outcome = 'ok' LIMIT 1", (sha256,)
+        ).fetchone()
+        return row is not None
+
+    def record(self, path: str, size: int, mtime: float, sha256: str, outcome: str):
+        self.con.execute(
+            "INSERT OR REPLACE INTO processed VALUES (?, ?, ?, ?, ?, ?)",
+            (path, size, mtime, sha256, outcome, time.time()),
+        )
+        self.con.commit()
+
+    def prune(self):
+        """Forget old entries whose files are gone, so the manifest stays bounded."""
+        cutoff = time.time() - self.retention
+        old = self.con.execute("SELECT path FROM processed WHERE processed_at < ?", (cutoff,)).fetchall()
+        gone = [(p,) for (p,) in old if not os.path.exists(p)]
+        if gone:
+            self.con.executemany("DELETE FROM processed WHERE path = ?", gone)
+            self.con.commit()
+        return len(gone)
+
+
+def file_sha256(path: str, block: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(block), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _scan(directory: str, pattern: str):
+    with os.scandir(directory) as it:
+        for e in it:
+            if e.is_file() and fnmatch.fnmatch(e.name, pattern):
+                yield os.path.join(directory, e.name)
+
+
+def _start_observer(directory: str, pattern: str):
+    """Return a queue fed by filesystem events, or None to fall back to polling."""
+    if Observer is None:
+        return None, None
+    events: queue.Queue = queue.Queue()
+
+    class _Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            path = getattr(event, "dest_path", "") or event.src_path
+            if not event.is_directory and fnmatch.fnmatch(os.path.basename(path), pattern):
+                events.put(os.path.join(directory, os.path.basename(path)))
+
+    obs = Observer()
+    obs.schedule(_Handler(), directory, recursive=False)
+    obs.daemon = True
+    obs.start()
+    return obs, events
 
 
 def run(cfg_path: str = "config.yaml"):
     ensure_dirs()
     cfg = load_yaml(cfg_path)
-    pattern = os.path.join("incoming", cfg.get("file_glob", "*.csv"))
-    poll = cfg["watcher"].get("poll_seconds", 3)
+    configure_logging_from(cfg)
+    wcfg = cfg["watcher"]
+    incoming = "incoming"
+    pattern = cfg.get("file_glob", "*.csv")
+    poll = wcfg.get("poll_seconds", 3)
+    stable_for = wcfg.get("stable_seconds", 2)
+    rescan_every = wcfg.get("rescan_seconds", 60)
+    manifest = FileManifest(wcfg.get("manifest_path", os.path.join("logs", "processed_files.sqlite")),
+                            wcfg.get("manifest_retention_days", 30))
+
+    ccfg = wcfg.get("claims", {})
+    claims = None
+    if ccfg.get("enabled", False):  # several watchers share incoming/
+        claims = Claims(ccfg.get("dir", os.path.join(incoming, ".claims")), ccfg.get("lease_seconds", 60),
+                        ccfg.get("shard", True), lambda path: sinks.committed(load_plan(cfg_path).cfg, path))
+
+    def on_done(path: str, ok: bool, meta):
+        manifest.record(path, *meta, "ok" if ok else "quarantined")
+        if claims is not None:
+            claims.finish(path, meta[0], meta[1], ok)
 
-    seen = set()
-    logger.info("Watching for new files...")
+    workers = wcfg.get("workers", 1)
+    pool = None
+    if workers > 1:
+        pool = FilePool(cfg_path, workers, wcfg.get("max_in_flight"), wcfg.get("ordered", True), on_done=on_done)
+    elif wcfg.get("pipelined", False):
+        pool = StagedPipeline(cfg_path, wcfg.get("stage_queue_depth", 2), on_done=on_done)
+
+    obs, events = _start_observer(incoming, pattern) if wcfg.get("use_events", True) else (None, None)
+    pending: dict = {}  # path -> (size, mtime) at last look; only files not yet stable
+    batch: dict = {}    # watcher.batch: stable small files waiting for one shared commit, path -> (sig, sha)
+    others: set = set()  # watcher.claims: stable files another watcher holds or should take
+    batch_since = 0.0
+
+    def flush():
+        results = process_batch(list(batch), cfg_path)
+        for path, (sig, sha) in batch.items():
+            on_done(path, bool(results.get(path)), (*sig, sha))
+        batch.clear()
+
+    last_scan = last_prune = 0.0
+    logger.info(f"Watching for new files ({'events' if events else 'polling'})...")
     while True:
-        for path in sorted(glob.glob(pattern)):
-            if path in seen: continue
-            ok = process_file(path, cfg_path)
-            seen.add(path)
-        time.sleep(poll)
+        now = time.time()
+        plan = load_plan(cfg_path)  # hot reload: recompiles only when config.yaml's mtime changed
+        m = metrics.get_metrics(plan.metrics_path, plan.metrics_flush_seconds)
+        if events is None or now - last_scan >= rescan_every:
+            candidates = set(_scan(incoming, pattern))
+            last_scan = now
+        else:
+            candidates = set()
+        while events is not None:
+            try:
+                candidates.add(events.get_nowait())
+            except queue.Empty:
+                break
+        candidates.update(pending)
+        candidates.update(others)
+
+        for path in sorted(candidates):
+            if (pool is not None and path in pool) or path in batch:
+                continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                pending.pop(path, None)
+                others.discard(path)
+                continue
+            sig = (st.st_size, st.st_mtime)
+            if manifest.is_done(path, *sig):
+                pending.pop(path, None)
+                continue
+            if m is not None and path not in pending and path not in others:
+                m.inc("arrivals")
+            # Half-written files: wait until size/mtime stop changing for stable_for seconds
+            if pending.get(path, sig) != sig or now - st.st_mtime < stable_for:
+                pending[path] = sig
+                continue
+            pending.pop(path, None)
+            if claims is not None:
+                outcome = claims.outcome(path, *sig)
+                if outcome is not None:  # finished by another watcher
+                    others.discard(path)
+                    manifest.record(path, *sig, None, outcome)
+                    continue
+                if not claims.mine(path) or not claims.claim(path, *sig):
+                    others.add(path)
+                    continue
+                others.discard(path)
+            sha = file_sha256(path)
+            if claims is not None and path in claims.resumed:  # alone in its own commit, see claims.py
+                if pool is not None:
+                    pool.drain()
+                if batch:
+                    flush()
+                on_done(path, process_file(path, cfg_path), (*sig, sha))
+                continue
+            if pool is not None:
+                pool.submit(path, (*sig, sha))  # blocks while max_in_flight files are queued
+                continue
+            if plan.batch_enabled and not should_stream(path, plan):
+                if not batch:
+                    batch_since = now
+                batch[path] = (sig, sha)
+                if sum(sig[0] for sig, _ in batch.values()) >= plan.batch_max_bytes:
+                    flush()
+                continue
+            on_done(path, process_file(path, cfg_path), (*sig, sha))
+
+        if batch and (not plan.batch_enabled or time.time() - batch_since >= plan.batch_max_wait):
+            flush()
+        if m is not None:
+            m.set("incoming_pending", len(pending) + len(batch) + (len(pool) if pool is not None else 0))
+            m.flush()
+        if now - last_prune >= 3600:
+            manifest.prune()
+            if claims is not None:
+                claims.prune(wcfg.get("manifest_retention_days", 30))
+            last_prune = now
+        if pool is not None and len(pool):
+            pool.poll(timeout=poll)
+        elif events is not None and not pending:
+            try:
+                events.put(events.get(timeout=poll))
+            except queue.Empty:
+                pass
+        else:
+            time.sleep(poll)
 
 if __name__ == "__main__":
     run()
@@ -1,14 +1,17 @@
 from __future__ import annotations
-import os, sys, glob, time, sqlite3, traceback
+import argparse, os, sys, glob, time, sqlite3, traceback
 from datetime import datetime, timedelta
 from pathlib import Path
 
 # Optional deps
 try:
     import pandas as pd  # needed for parquet stats
+    from app.dataset import count_rows, read_dataset
 except Exception:
     pd = None
 
+from app.metrics import load_snapshot, quantile, serve
+
 # ---------- Paths ----------
 ROOT = Path(__file__).resolve().parent
 LOG_PATH = ROOT / "logs" / "pipeline.log"
@@ -16,6 +19,7 @@ INCOMING = ROOT / "incoming"
 QUARANTINE = ROOT / "quarantine"
 PARQUET_PATH = ROOT / "masked_out" / "cleaned.parquet"
 SQLITE_PATH = ROOT / "masked_out" / "cleaned.sqlite"
+METRICS_PATH = ROOT / "logs" / "metrics.json"
 
 def human(n: float) -> str:
     return f"{n:,.0f}"
@@ -45,8 +49,7 @@ def parquet_count(path: Path) -> int | None:
     if pd is None:
         return -1  # indicates pandas missing
     try:
-        df = pd.read_parquet(str(path))
-        return int(len(df))
+        return int(count_rows(str(path)))  # footer metadata only
     except Exception:
         return -2  # indicates parquet engine issue
 
@@ -63,15 +66,22 @@ def sqlite_count(path: Path, table: str = "cleaned_events") -> int | None:
     except Exception:
         return -1
 
-def parquet_outliers(path: Path) -> tuple[int,int] | None:
-    """Return (flagged_rows, total_rows) from parquet if possible."""
+def parquet_outliers(path: Path, snap: dict | None = None) -> tuple[int,int] | None:
+    """Return (flagged_rows, total_rows): from the metrics snapshot when there is one, else from parquet."""
+    if snap:
+        c = snap.get("counters", {})
+        return int(c.get("flagged_rows", 0)), int(c.get("rows", 0))
     if not path.exists() or pd is None:
         return None
     try:
-        df = pd.read_parquet(str(path), columns=["outlier_flags"])
-        total = len(df)
-        flagged = int((df["outlier_flags"].fillna("") != "").sum())
-        return flagged, total
+        try:
+            df = read_dataset(str(path), columns=["outlier_mask"])
+            flagged = int((df["outlier_mask"].fillna(0) != 0).sum())
+        except Exception:
+            # data written before outlier_mask existed
+            df = read_dataset(str(path), columns=["outlier_flags"])
+            flagged = int((df["outlier_flags"].fillna("") != "").sum())
+        return flagged, len(df)
     except Exception:
         return None
 
@@ -101,15 +111,35 @@ def main():
     print(f"As of: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print("="*70)
 
-    # Ingestion & files
-    in_count = count_dir(INCOMING, "events_*.csv")
-    q_count  = count_dir(QUARANTINE, "events_*.csv")
-    rpm = recent_files_per_minute(INCOMING, minutes=5, pattern="events_*.csv")
+    snap = load_snapshot(str(METRICS_PATH))
 
+    # Ingestion & files
     print(f"\nIncoming folder: {INCOMING}")
-    print(f"  events_*.csv present: {human(in_count)}")
-    print(f"  Quarantined files:    {human(q_count)}")
-    print(f"  Arrival rate (5m):    {rpm:.2f} files/min")
+    if snap:
+        c, g, r = snap.get("counters", {}), snap.get("gauges", {}), snap.get("rates_5m", {})
+        age = time.time() - snap.get("updated_at", 0)
+        print(f"  Metrics snapshot:     {METRICS_PATH} (updated {age:.0f}s ago)")
+        print(f"  Pending files:        {human(g.get('incoming_pending', 0))}")
+        print(f"  Processed OK:         {human(c.get('files_ok', 0))}")
+        print(f"  Quarantined files:    {human(c.get('files_failed', 0))}")
+        print(f"  Arrival rate (5m):    {r.get('arrivals_per_min', 0):.2f} files/min")
+        print(f"  Commit rate (5m):     {r.get('files_ok_per_min', 0):.2f} files/min")
+        buckets, rolling = snap.get("latency_buckets"), snap.get("latency_5m", {})
+        if snap.get("latency"):
+            print("  Stage latency (last 5m p50/p95, all-time mean):")
+        for stage, h in snap.get("latency", {}).items():
+            r = rolling.get(stage)
+            recent = (f"{r['p50']:.3f}s / {r['p95']:.3f}s" if r else
+                      f"<= {quantile(h, 0.5, buckets)}s / <= {quantile(h, 0.95, buckets)}s")
+            print(f"    {stage:<20}{recent}, mean {h['sum'] / max(h['count'], 1):.3f}s")
+    else:
+        # No snapshot yet (metrics disabled or watcher never ran): fall back to scanning
+        in_count = count_dir(INCOMING, "events_*.csv")
+        q_count  = count_dir(QUARANTINE, "events_*.csv")
+        rpm = recent_files_per_minute(INCOMING, minutes=5, pattern="events_*.csv")
+        print(f"  events_*.csv present: {human(in_count)}")
+        print(f"  Quarantined files:    {human(q_count)}")
+        print(f"  Arrival rate (5m):    {rpm:.2f} files/min")
 
     # Parquet stats
     pq = parquet_count(PARQUET_PATH)
@@ -121,11 +151,11 @@ def main():
         print("\nParquet: engine error (pyarrow/fastparquet).")
     else:
         print(f"\nParquet rows: {human(pq)}")
-        out_stats = parquet_outliers(PARQUET_PATH)
+        out_stats = parquet_outliers(PARQUET_PATH, snap)
         if out_stats:
             flagged, total = out_stats
             pct = (flagged/total*100) if total else 0
-            print(f"  Outlier-flagged rows: {human(flagged)} ({pct:.2f}%)")
+            print(f"  Outlier-flagged rows: {human(flagged)} ({pct:.2f}%){' of rows committed' if snap else ''}")
 
     # SQLite stats
     sql = sqlite_count(SQLITE_PATH, "cleaned_events")
@@ -144,4 +174,12 @@ def main():
     print("\nDone.\n")
 
 if __name__ == "__main__":
-    main()
+    ap = argparse.ArgumentParser(description="ETL health report")
+    ap.add_argument("--serve", type=int, metavar="PORT",
+                    help="serve the metrics snapshot at /metrics (Prometheus) and /metrics.json instead")
+    args = ap.parse_args()
+    if args.serve:
+        print(f"Serving {METRICS_PATH} on http://0.0.0.0:{args.serve}/metrics")
+        serve(str(METRICS_PATH), port=args.serve).serve_forever()
+    else:
+        main()
@@ -1,5 +1,6 @@
 import pandas as pd, pyarrow
+from app.dataset import read_dataset
 print("pyarrow", pyarrow.__version__)
-df = pd.read_parquet(r"masked_out\cleaned.parquet")
+df = read_dataset(r"masked_out\cleaned.parquet")
 print(df.head(10).to_string(index=False))
 print("\nrows:", len(df))